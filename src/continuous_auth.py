@@ -0,0 +1,53 @@
+import os
+
+import hydra
+import pandas as pd
+from omegaconf import DictConfig
+
+from model.registry import ModelRegistry
+from model.continuous import make_score_func, score_recording
+from sampling.raw_store import is_raw_capture, read_raw_capture
+
+
+def read_recording(path: str) -> pd.DataFrame:
+    if is_raw_capture(path):
+        return read_raw_capture(path)
+    return pd.read_csv(path)
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="continuous_auth")
+def main(cfg: DictConfig):
+    registry = ModelRegistry(
+        cfg.model_registry.model_dir,
+        cfg.model.modelname,
+        cfg.model_registry.memory_budget_mb,
+        cfg.model_registry.mmap_mode,
+    )
+    pair = ModelRegistry.pair_key(cfg.user1_name, cfg.user2_name)
+    if cfg.model.param_dict_path:
+        registry.register(pair, cfg.model.param_dict_path)
+    feature_set = registry.get_feature_set(pair)
+
+    scores = score_recording(
+        read_recording(cfg.device1_data_path),
+        read_recording(cfg.device2_data_path),
+        make_score_func(registry.get(pair), feature_set),
+        cfg.window.length,
+        cfg.window.hop,
+        None if feature_set is None else feature_set[1],
+        cfg.window.chunk_windows,
+    )
+    threshold = registry.get_threshold(pair, cfg.pred_threshold)
+    scores["authorized"] = scores["score"] >= threshold
+
+    output_path = os.path.join(os.getcwd(), cfg.output_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    scores.to_csv(output_path, index=False)
+    print(
+        f"{len(scores)} windows, {scores['authorized'].sum()} authorized, "
+        f"written to {output_path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
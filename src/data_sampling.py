@@ -7,6 +7,10 @@ import faulthandler
 import tracemalloc
 
 from sampling.data_sampler import PairDataSampler, SamplingMode
+from sampling.device_model import make_output_config
+from sampling.ingest import make_ingest_config
+from model.registry import ModelRegistry
+from model.continuous import SlidingWindowAuthenticator, make_score_func
 
 
 @hydra.main(version_base=None, config_path="../conf", config_name="data_sampling")
@@ -31,11 +35,70 @@ def main(cfg: DictConfig):
         device1_address,
         device2_address,
         mode=SamplingMode.SAMPLING,
+        output_config=make_output_config(
+            cfg.sensor_output.rate_hz, cfg.sensor_output.content
+        ),
+        recording_dir_path=(
+            output_dir_path if cfg.recorder.enabled or cfg.raw_capture else None
+        ),
+        recorder_config={
+            "chunk_size": cfg.recorder.chunk_size,
+            "max_pending_chunks": cfg.recorder.max_pending_chunks,
+            "fsync_interval_sec": cfg.recorder.fsync_interval_sec,
+            "rotate_rows": cfg.recorder.rotate_rows,
+        },
+        raw_capture=cfg.raw_capture,
+        ingest_config=make_ingest_config(
+            cfg.ingest_process.enabled,
+            cfg.ingest_process.ring_capacity,
+            cfg.ingest_process.poll_interval_sec,
+        ),
     )
+
+    authenticator = None
+    if cfg.continuous_auth.enabled:
+        authenticator = continuous_authenticator(cfg.continuous_auth)
+        sampler.set_sample_listener(authenticator.push)
+        authenticator.start()
+
     sampler.run()
+    if authenticator is not None:
+        authenticator.stop()
+        print(
+            f"continuous authentication: dropped={authenticator.dropped_windows}, "
+            f"skipped={authenticator.skipped_windows}"
+        )
     sampler.output_sampling_data(output_dir_path, remark_data)
 
 
+def continuous_authenticator(cfg: DictConfig) -> SlidingWindowAuthenticator:
+    # Scores windows of the stream while the pair is recorded
+    registry = ModelRegistry(
+        cfg.model_registry.model_dir,
+        cfg.model_registry.modelname,
+        cfg.model_registry.memory_budget_mb,
+        cfg.model_registry.mmap_mode,
+    )
+    pair = ModelRegistry.pair_key(cfg.user1_name, cfg.user2_name)
+    if cfg.model_registry.param_dict_path:
+        registry.register(pair, cfg.model_registry.param_dict_path)
+    feature_set = registry.get_feature_set(pair)
+    threshold = registry.get_threshold(pair, cfg.pred_threshold)
+
+    def on_score(start_time: int, end_time: int, score: float):
+        result = "authorized" if score >= threshold else "unauthorized"
+        print(f"window {start_time}-{end_time}: score={score:.3f} {result}")
+
+    return SlidingWindowAuthenticator(
+        make_score_func(registry.get(pair), feature_set),
+        on_score,
+        cfg.window,
+        cfg.hop,
+        None if feature_set is None else feature_set[1],
+        cfg.max_pending_windows,
+    )
+
+
 if __name__ == "__main__":
 
     tracemalloc.start()
@@ -0,0 +1,292 @@
+import os
+import json
+import mmap
+import struct
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from preprocess.pair_data_extraction import time_to_ns
+from util.file import atomic_write
+
+# magic, index offset, index length
+HEADER_FORMAT = "<8sQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b"DAPPACK1"
+# Every append leaves the previous index behind, the archive is rewritten
+# when these dead bytes exceed this fraction of the file
+COMPACT_DEAD_FRACTION = 0.25
+
+
+class DatasetArchive:
+    """
+    データセットを1ファイルにまとめたアーカイブ
+
+    ファイル先頭のヘッダにインデックスの位置を持ち、インデックスに各計測データのオフセットと行数を持つ
+    計測データはtime(int64のナノ秒)とセンサ値(float64)を行優先で並べたもの
+    """
+
+    def __init__(self, archive_path: str):
+        self.archive_path = archive_path
+        self.columns: list[str] = None
+        self.ids: list[dict] = []
+        self.entries: list[dict] = []
+        # Bytes of the indices replaced by later appends
+        self.dead_bytes = 0
+        self._index_length = 0
+        self._mmap = None
+        self._mmap_lock = Lock()
+
+        if os.path.exists(archive_path):
+            self._read_index()
+
+    def _read_index(self):
+        with open(self.archive_path, "rb") as f:
+            magic, index_offset, index_length = struct.unpack(
+                HEADER_FORMAT, f.read(HEADER_SIZE)
+            )
+            if magic != MAGIC:
+                raise ValueError(f"Not a dataset archive: {self.archive_path}")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length))
+        self.columns = index["columns"]
+        self.ids = index["ids"]
+        self.entries = index["entries"]
+        self.dead_bytes = index.get("dead_bytes", 0)
+        self._index_length = index_length
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self) -> set[tuple[str, str, str]]:
+        return {(e["mode"], e["pair_id"], e["name"]) for e in self.entries}
+
+    def append(self, entries: list[dict], ids: list[dict] = None):
+        """
+        entriesの各要素はmode, pair_id, user1_id, user2_id, name, split,
+        user1_data, user2_dataを持つ
+
+        新しい計測データとインデックスを末尾に書き込んでからヘッダを更新するため、
+        書き込み中に中断しても既存のインデックスは有効なまま残る
+        置き換えられたインデックスが増えた場合はcompact()でファイルを書き直す
+        """
+        if ids is not None:
+            known_ids = {i["id"] for i in self.ids}
+            self.ids += [i for i in ids if i["id"] not in known_ids]
+
+        mode = "r+b" if os.path.exists(self.archive_path) else "w+b"
+        with open(self.archive_path, mode) as f:
+            if mode == "w+b":
+                f.write(struct.pack(HEADER_FORMAT, MAGIC, 0, 0))
+            f.seek(0, os.SEEK_END)
+
+            for entry in entries:
+                packed_entry = {
+                    k: entry[k]
+                    for k in [
+                        "mode",
+                        "pair_id",
+                        "user1_id",
+                        "user2_id",
+                        "name",
+                        "split",
+                    ]
+                }
+                packed_entry["recordings"] = [
+                    self._write_recording(f, entry["user1_data"]),
+                    self._write_recording(f, entry["user2_data"]),
+                ]
+                self.entries.append(packed_entry)
+
+            self.dead_bytes += self._index_length
+            self._write_index(f)
+            file_size = f.tell()
+
+        # Readers opened before the append keep their own index and mapping
+        self.close()
+        if self.dead_bytes > COMPACT_DEAD_FRACTION * file_size:
+            self.compact()
+
+    def _write_index(self, f):
+        # The index is written at the current position, then the header points to it
+        index = json.dumps(
+            {
+                "columns": self.columns,
+                "ids": self.ids,
+                "entries": self.entries,
+                "dead_bytes": self.dead_bytes,
+            }
+        ).encode()
+        index_offset = f.tell()
+        f.write(index)
+        f.flush()
+        os.fsync(f.fileno())
+
+        end = f.tell()
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, index_offset, len(index)))
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(end)
+        self._index_length = len(index)
+
+    def compact(self):
+        # The recordings are copied into a new file that replaces the archive at once.
+        # Readers that still map the old file keep reading it.
+        recording_size = 8 * (1 + len(self.columns or []))
+        entries = []
+        try:
+            with open(self.archive_path, "rb") as src, atomic_write(
+                self.archive_path, "w+b"
+            ) as dst:
+                dst.write(struct.pack(HEADER_FORMAT, MAGIC, 0, 0))
+                for entry in self.entries:
+                    recordings = []
+                    for recording in entry["recordings"]:
+                        src.seek(recording["offset"])
+                        offset = dst.tell()
+                        dst.write(src.read(recording["n_rows"] * recording_size))
+                        recordings.append(
+                            {"offset": offset, "n_rows": recording["n_rows"]}
+                        )
+                    entries.append({**entry, "recordings": recordings})
+                self.entries = entries
+                self.dead_bytes = 0
+                self._write_index(dst)
+        except BaseException:
+            # The archive on disk is unchanged, so is the index read back from it
+            self._read_index()
+            raise
+        self.close()
+
+    def _write_recording(self, f, df: pd.DataFrame) -> dict:
+        sensor_columns = [c for c in df.columns if c != "time"]
+        if self.columns is None:
+            self.columns = sensor_columns
+        elif sensor_columns != self.columns:
+            raise ValueError(
+                f"Columns do not match the archive: archive: {self.columns}, "
+                f"data: {sensor_columns}"
+            )
+        time = time_to_ns(df.loc[:, "time"]).astype("<i8")
+        values = df.loc[:, self.columns].to_numpy(dtype="<f8")
+        offset = f.tell()
+        f.write(time.tobytes())
+        f.write(np.ascontiguousarray(values).tobytes())
+        return {"offset": offset, "n_rows": len(df)}
+
+    def read(self, recording: dict) -> pd.DataFrame:
+        with self._mmap_lock:
+            if self._mmap is None:
+                with open(self.archive_path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = self._mmap
+
+        n_rows = recording["n_rows"]
+        offset = recording["offset"]
+        time = np.frombuffer(buffer, dtype="<i8", count=n_rows, offset=offset)
+        values = np.frombuffer(
+            buffer,
+            dtype="<f8",
+            count=n_rows * len(self.columns),
+            offset=offset + n_rows * 8,
+        ).reshape(n_rows, len(self.columns))
+
+        # Copies are returned so that the mapping can be closed while the data is in use
+        df = pd.DataFrame(values.copy(), columns=self.columns)
+        df.insert(0, "time", time.copy())
+        return df
+
+    def close(self):
+        with self._mmap_lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+
+class PackedPairDataset:
+    """
+    DatasetArchiveから計測データを読み込むデータセット
+
+    MaeSoIndivisualDatasetと同じ形式で要素を返す
+    """
+
+    def __init__(
+        self,
+        archive_path: str,
+        correct_pair_names: tuple[str, str] = None,
+        scenario_mode: str = "normal",
+        is_train: bool = True,
+        pair_ids: list[str] = None,
+    ):
+        if not os.path.exists(archive_path):
+            raise ValueError(f"Dataset archive does not exist : {archive_path}")
+        # When correct_pair_names is None, this dataset returns the pair labels rather
+        # than the correct/incorrect labels.
+        if correct_pair_names == (None, None):
+            self.correct_pair_names = None
+        else:
+            self.correct_pair_names = correct_pair_names
+        self.archive = DatasetArchive(archive_path)
+
+        split = "train" if is_train else "test"
+        pair_ids = None if pair_ids is None else [str(i) for i in pair_ids]
+        self.entries = [
+            e
+            for e in self.archive.entries
+            if e["mode"] == scenario_mode
+            and e["split"] == split
+            and (pair_ids is None or e["pair_id"] in pair_ids)
+        ]
+        self.pair_id_list = [e["pair_id"] for e in self.entries]
+
+        self._validate_correct_pair_names()
+
+    def _validate_correct_pair_names(self):
+        if self.correct_pair_names is None:
+            return
+
+        id_list = [i["id"] for i in self.archive.ids]
+        missing = [name for name in self.correct_pair_names if name not in id_list]
+        if missing:
+            raise ValueError(f"User name {', '.join(missing)} not found in dataset")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        if idx >= len(self):
+            raise IndexError("Index out of range")
+
+        entry = self.entries[idx]
+        user1_recording, user2_recording = entry["recordings"]
+        user1_sensor_data = self.archive.read(user1_recording)
+        user2_sensor_data = self.archive.read(user2_recording)
+
+        path = self.archive.archive_path
+        data_info = pd.Series(
+            {
+                "pair_id": entry["pair_id"],
+                "user1_id": entry["user1_id"],
+                "user2_id": entry["user2_id"],
+                "user1_data_path": f"{path}:{entry['user1_id']}/{entry['name']}",
+                "user2_data_path": f"{path}:{entry['user2_id']}/{entry['name']}",
+            }
+        )
+        label = self._get_label(data_info)
+
+        return user1_sensor_data, user2_sensor_data, label, data_info
+
+    def _get_label(self, data_info: pd.Series) -> int:
+        if self.correct_pair_names is None:
+            return data_info["pair_id"]
+
+        if (data_info["user1_id"] in self.correct_pair_names) and (
+            data_info["user2_id"] in self.correct_pair_names
+        ):
+            return 1
+        return 0
+
+    def get_all_pair_name(self):
+        return list(set(self.pair_id_list))
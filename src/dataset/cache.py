@@ -0,0 +1,108 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+
+class CachedRecording:
+    def __init__(self, df: pd.DataFrame):
+        self.columns = list(df.columns)
+        # Sensor values are kept as one float64 block,
+        # other columns (time, id) as they are.
+        # Narrower floats would change the features against uncached reads.
+        self.float_columns = [
+            c for c in self.columns if pd.api.types.is_float_dtype(df[c].dtype)
+        ]
+        self.values = df.loc[:, self.float_columns].to_numpy(dtype=np.float64)
+        self.other_columns = {
+            c: df[c].to_numpy() for c in self.columns if c not in self.float_columns
+        }
+        self.nbytes = self.values.nbytes + sum(
+            int(pd.Series(v).memory_usage(index=False, deep=True))
+            for v in self.other_columns.values()
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # Copied so that callers cannot modify the cached values
+        df = pd.DataFrame(self.values.copy(), columns=self.float_columns, copy=False)
+        for column, value in self.other_columns.items():
+            df[column] = value
+        return df.loc[:, self.columns]
+
+
+def file_key(path: str) -> tuple:
+    # A rewritten file gets a new key, so stale entries are never returned
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        # Raw captures are directories whose files are appended to
+        return (path,) + tuple(
+            file_key(os.path.join(path, name)) for name in sorted(os.listdir(path))
+        )
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+class RecordingCache:
+    """
+    読み込んだ計測データを保持するキャッシュ
+
+    メモリ上限を超えた場合は最も長く使われていないデータから破棄する
+    """
+
+    def __init__(self, memory_budget_mb: float = 1024):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.entries: OrderedDict[tuple, CachedRecording] = OrderedDict()
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def read_csv(self, path: str) -> pd.DataFrame:
+        key = file_key(path)
+        with self._lock:
+            recording = self.entries.get(key)
+            if recording is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return recording.to_dataframe()
+            self.misses += 1
+
+        # The file is read outside of the lock so
+        # that prefetch threads can load in parallel
+        recording = CachedRecording(pd.read_csv(path))
+        with self._lock:
+            if key not in self.entries and recording.nbytes <= self.memory_budget:
+                self.entries[key] = recording
+                self.current_size += recording.nbytes
+                self._evict()
+        return recording.to_dataframe()
+
+    def _evict(self):
+        while self.current_size > self.memory_budget and self.entries:
+            _, recording = self.entries.popitem(last=False)
+            self.current_size -= recording.nbytes
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.current_size = 0
+
+
+_shared_cache: RecordingCache = None
+_shared_cache_lock = Lock()
+
+
+def get_shared_cache(memory_budget_mb: float = 1024) -> RecordingCache:
+    # One cache per process, shared by the train
+    # and test datasets and by hydra multirun jobs
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = RecordingCache(memory_budget_mb)
+        elif _shared_cache.memory_budget != int(memory_budget_mb * 1024 * 1024):
+            with _shared_cache._lock:
+                _shared_cache.memory_budget = int(memory_budget_mb * 1024 * 1024)
+                _shared_cache._evict()
+        return _shared_cache
@@ -0,0 +1,47 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class PrefetchIterator:
+    """
+    データセットの要素を先読みするイテレータ
+
+    次のdepth件をスレッドプールで読み込み、元の順序で返す
+    """
+
+    def __init__(self, dataset, depth: int = 4, workers: int = 2):
+        if depth < 1:
+            raise ValueError(f"Prefetch depth must be at least 1: {depth}")
+        if workers < 1:
+            raise ValueError(
+                f"Number of prefetch workers must be at least 1: {workers}"
+            )
+        self.dataset = dataset
+        self.depth = depth
+        self.workers = workers
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="dataset-prefetch"
+        )
+        # At most depth items are loaded or waiting to be consumed at any time
+        pending: deque[Future] = deque()
+        next_idx = 0
+        try:
+            while next_idx < len(self.dataset) and len(pending) < self.depth:
+                pending.append(executor.submit(self.dataset.__getitem__, next_idx))
+                next_idx += 1
+            while pending:
+                item = pending.popleft().result()
+                if next_idx < len(self.dataset):
+                    pending.append(executor.submit(self.dataset.__getitem__, next_idx))
+                    next_idx += 1
+                yield item
+        finally:
+            # Also reached when the consumer stops early or an item fails to load
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
@@ -6,6 +6,10 @@ from glob import glob
 import numpy as np
 import pandas as pd
 
+from .cache import RecordingCache
+from sampling.raw_store import is_raw_capture, read_raw_capture
+from sampling.session_log import SessionLog, SessionLogReader
+
 
 class BasePairDataset:
     def __init__(self, directory_path: str, correct_pair_names: tuple[str, str]):
@@ -23,9 +27,26 @@ class BasePairDataset:
     def _get_labels(self):
         pass
 
+    def _read_recording(self, path: str) -> pd.DataFrame:
+        # Recordings of the raw capture mode are directories decoded on read
+        if is_raw_capture(path):
+            return read_raw_capture(path)
+        if self.cache is None:
+            return pd.read_csv(path)
+        return self.cache.read_csv(path)
+
 
 class PairDataDataset(BasePairDataset):
-    def __init__(self, directory_path: str, correct_pair_names: tuple[str, str]):
+    def __init__(
+        self,
+        directory_path: str,
+        correct_pair_names: tuple[str, str],
+        cache: RecordingCache = None,
+        user: str = None,
+        date: str = None,
+        device: str = None,
+    ):
+        self.cache = cache
 
         if os.path.exists(directory_path):
             self.directory_path = directory_path
@@ -36,11 +57,38 @@ class PairDataDataset(BasePairDataset):
             self.directory_path, "sensor_data_info.csv"
         )
 
-        self.dataset_info: pd.DataFrame = pd.read_csv(self.dataset_info_path)
-
+        # Only the sessions of user,
+        # date (%Y%m%d) and device address are used when given
+        self.session_filter = {"user": user, "date": date, "device": device}
+        self.session_reader = SessionLogReader(SessionLog(self.directory_path))
+        # Sessions recorded before the session log
+        # was introduced are kept in the CSV file
+        has_info_file = os.path.exists(self.dataset_info_path)
+        if has_info_file:
+            self.session_reader.index.add(
+                pd.read_csv(self.dataset_info_path).to_dict("records")
+            )
+        if not (has_info_file or self.session_reader.session_log.exists()):
+            raise ValueError(f"No session information in dataset : {directory_path}")
         self.correct_pair_names = correct_pair_names
+        self.session_reader.poll()
+        self._update_dataset_info()
+
+    def _update_dataset_info(self):
+        sessions = self.session_reader.index.find(**self.session_filter)
+        if not sessions:
+            raise ValueError(f"No session matches {self.session_filter}")
+        self.dataset_info: pd.DataFrame = pd.DataFrame(sessions)
         self._validate_correct_pair_names()
 
+    def refresh(self) -> int:
+        # Sessions appended by the sampling stations since the last read are added.
+        # Returns the number of new sessions.
+        sessions = self.session_reader.poll()
+        if sessions:
+            self._update_dataset_info()
+        return len(sessions)
+
     def _validate_correct_pair_names(self):
         def df_contain_name(df, name):
             return (name in df.loc[:, "user1_name"].values) or (
@@ -88,8 +136,8 @@ class PairDataDataset(BasePairDataset):
 
         label = self._get_label(data_info)
 
-        user1_sensor_data = pd.read_csv(user1_sensor_data_path)
-        user2_sensor_data = pd.read_csv(user2_sensor_data_path)
+        user1_sensor_data = self._read_recording(user1_sensor_data_path)
+        user2_sensor_data = self._read_recording(user2_sensor_data_path)
 
         return user1_sensor_data, user2_sensor_data, label, data_info
 
@@ -112,7 +160,10 @@ class MaeSoIndivisualDataset(BasePairDataset):
         correct_pair_names: tuple[str, str] = None,
         scenario_mode: MaeSoDatasetMode = MaeSoDatasetMode.NORMAL,
         is_train: bool = True,
+        pair_ids: list[str] = None,
+        cache: RecordingCache = None,
     ):
+        self.cache = cache
         # When correct_pair_names is None, this dataset returns the pair labels rather than the correct/incorrect labels.
         if correct_pair_names == (None, None):
             self.correct_pair_names = None
@@ -120,6 +171,8 @@ class MaeSoIndivisualDataset(BasePairDataset):
             self.correct_pair_names = correct_pair_names
         self.scenario_mode = scenario_mode
         self.is_train = is_train
+        # When pair_ids is given, only the data of these pairs is used.
+        self.pair_ids = None if pair_ids is None else [str(i) for i in pair_ids]
 
         self.id_file_path = os.path.join(directory_path, "id.csv")
         if not os.path.exists(self.id_file_path):
@@ -159,7 +212,14 @@ class MaeSoIndivisualDataset(BasePairDataset):
     def _generate_file_list(
         self, directory_path: str, train_test_split_info: pd.DataFrame = None
     ):
-        generate_split_info = train_test_split_info is None
+        if train_test_split_info is None:
+            train_test_split_info = pd.DataFrame(
+                columns=self.train_test_idx_ref_column_name
+            )
+        # Splits of the pairs missing from the split file are generated and appended
+        # to it, so that a pair enrolled later keeps its split in the following runs
+        split_pair_ids = set(train_test_split_info.loc[:, "pair_id"].astype(str))
+        generated_split_info = []
 
         pair_dir_name_list = [
             name
@@ -172,11 +232,8 @@ class MaeSoIndivisualDataset(BasePairDataset):
             for item in pair_dir_name_list
             if item.split("_")[1] == "1"
         ]
-
-        if generate_split_info:
-            train_test_split_info = pd.DataFrame(
-                columns=self.train_test_idx_ref_column_name
-            )
+        if self.pair_ids is not None:
+            pair_id_list = [i for i in pair_id_list if i in self.pair_ids]
 
         for pair_id in pair_id_list:
             user1_file_path = os.path.join(directory_path, f"{pair_id}_0")
@@ -189,8 +246,8 @@ class MaeSoIndivisualDataset(BasePairDataset):
                     f"Pair data file does not exist : {user1_file_path} or {user2_file_path}"
                 )
 
-            user1_file_path_list = glob(user1_file_path + "/*.csv")
-            user2_file_path_list = glob(user2_file_path + "/*.csv")
+            user1_file_path_list = self._recording_paths(user1_file_path)
+            user2_file_path_list = self._recording_paths(user2_file_path)
             file_path_list_length = min(
                 len(user1_file_path_list), len(user2_file_path_list)
             )
@@ -198,9 +255,9 @@ class MaeSoIndivisualDataset(BasePairDataset):
             user2_file_path_list = user2_file_path_list[:file_path_list_length]
 
             # trainとtestの分割
-            if not generate_split_info:
+            if pair_id in split_pair_ids:
                 pair_train_test_split_info = train_test_split_info[
-                    train_test_split_info.loc[:, "pair_id"] == int(pair_id)
+                    train_test_split_info.loc[:, "pair_id"].astype(str) == pair_id
                 ]
                 train_info = pair_train_test_split_info[
                     pair_train_test_split_info.loc[:, "train/test"] == "train"
@@ -226,31 +283,26 @@ class MaeSoIndivisualDataset(BasePairDataset):
                 train_idx, test_idx = self._generate_train_test_info(
                     [i for i in range(len(user1_file_path_list))]
                 )
-                for i in range(len(user1_file_path_list)):
-                    train_test_split_info = pd.concat(
-                        [
-                            train_test_split_info,
-                            pd.DataFrame(
-                                {
-                                    "pair_id": [pair_id],
-                                    "path1": [
-                                        os.path.relpath(
-                                            user1_file_path_list[i], directory_path
-                                        )
-                                    ],
-                                    "path2": [
-                                        os.path.relpath(
-                                            user2_file_path_list[i], directory_path
-                                        )
-                                    ],
-                                    "train/test": [
-                                        "train" if i in train_idx else "test"
-                                    ],
-                                }
-                            ),
-                        ],
-                        axis=0,
+                generated_split_info.append(
+                    pd.DataFrame(
+                        {
+                            "pair_id": pair_id,
+                            "path1": [
+                                os.path.relpath(path, directory_path)
+                                for path in user1_file_path_list
+                            ],
+                            "path2": [
+                                os.path.relpath(path, directory_path)
+                                for path in user2_file_path_list
+                            ],
+                            "train/test": [
+                                "train" if i in train_idx else "test"
+                                for i in range(len(user1_file_path_list))
+                            ],
+                        },
+                        columns=self.train_test_idx_ref_column_name,
                     )
+                )
 
             if self.is_train:
                 user1_file_path_list = [user1_file_path_list[idx] for idx in train_idx]
@@ -263,7 +315,24 @@ class MaeSoIndivisualDataset(BasePairDataset):
             self.user2_file_path_list += user2_file_path_list
             self.pair_id_list += [pair_id for _ in user1_file_path_list]
 
-        train_test_split_info.to_csv(self.train_test_idx_ref_file_path, index=False)
+        if generated_split_info:
+            train_test_split_info = pd.concat(
+                [train_test_split_info] + generated_split_info, axis=0
+            )
+            train_test_split_info.to_csv(self.train_test_idx_ref_file_path, index=False)
+
+    @staticmethod
+    def _recording_paths(user_dir_path: str) -> list[str]:
+        # CSV files and directories of the raw capture mode,
+        # both named after the start time
+        return sorted(
+            glob(os.path.join(user_dir_path, "*.csv"))
+            + [
+                path
+                for path in glob(os.path.join(user_dir_path, "*.raw"))
+                if is_raw_capture(path)
+            ]
+        )
 
     def _generate_train_test_info(
         self, idx_list, test_rate: float = 0.2
@@ -315,8 +384,8 @@ class MaeSoIndivisualDataset(BasePairDataset):
         ):
             raise ValueError("User data does not match")
 
-        user1_sensor_data = pd.read_csv(user1_file_path)
-        user2_sensor_data = pd.read_csv(user2_file_path)
+        user1_sensor_data = self._read_recording(user1_file_path)
+        user2_sensor_data = self._read_recording(user2_file_path)
 
         user1_id = self.path2id(user1_file_path)
         user2_id = self.path2id(user2_file_path)
@@ -1,6 +1,6 @@
+import time
 import faulthandler
 import tracemalloc
-from datetime import datetime
 from threading import Thread
 
 import pandas as pd
@@ -8,8 +8,13 @@ import hydra
 from omegaconf import DictConfig
 
 from sampling.data_sampler import PairDataSampler, SamplingMode
-from encapsulate_preprocess import preprocessing, feature_extraction
-from model.load import load_model
+from sampling.connection_pool import DeviceConnectionPool
+from sampling.device_model import make_output_config
+from sampling.ingest import make_ingest_config
+from encapsulate_preprocess import PipelinedPairFeatures, authentication_features
+from feature.online import OnlinePairFeatures
+from model.registry import ModelRegistry
+from model.early_decision import CheckpointBounds, Decision, EarlyDecisionSession
 from visualize.demo_visualizer import DemoSite, DemoPageStat
 import logging
 
@@ -54,12 +59,16 @@ def main(cfg: DictConfig):
     # blue band
     device2_address = cfg.devices.device2.address
 
-    visualizer = DemoSite()
+    visualizer = DemoSite(
+        cfg.visualize.refresh_interval_ms,
+        cfg.visualize.history_length,
+        cfg.visualize.max_points_per_update,
+    )
     print(id(visualizer))
 
     def on_device_update(
         sensor_name: str,
-        time: datetime,
+        time: int,
         acc: list[float],
         gyro: list[float],
         angle: list[float],
@@ -76,11 +85,33 @@ def main(cfg: DictConfig):
         target_comp.update_data(acc, gyro, angle, mag)
 
     def on_device_terminate():
-        visualizer.state = DemoPageStat.AUTHORIZE
         visualizer.sampling_page.is_terminated = True
+        visualizer.set_state(DemoPageStat.AUTHORIZE)
 
     def on_authorization_complete(result):
-        visualizer.authorize_page.result = result
+        visualizer.set_result(result)
+
+    output_config = make_output_config(
+        cfg.sensor_output.rate_hz, cfg.sensor_output.content
+    )
+
+    ingest_config = make_ingest_config(
+        cfg.ingest_process.enabled,
+        cfg.ingest_process.ring_capacity,
+        cfg.ingest_process.poll_interval_sec,
+    )
+
+    connection_pool = None
+    # The ingest process owns the connections itself
+    if cfg.connection_pool.enabled and ingest_config is None:
+        # Bands stay connected and subscribed between authentications
+        connection_pool = DeviceConnectionPool(
+            [device1_address, device2_address],
+            cfg.connection_pool.health_check_interval_sec,
+            cfg.connection_pool.stale_timeout_sec,
+            output_config,
+        )
+        connection_pool.start(cfg.connection_pool.connect_timeout_sec)
 
     sampler = PairDataSampler(
         user1_name,
@@ -90,36 +121,142 @@ def main(cfg: DictConfig):
         mode=SamplingMode.DEMO,
         on_update=on_device_update,
         on_terminated=on_device_terminate,
+        connection_pool=connection_pool,
+        output_config=output_config,
+        ingest_config=ingest_config,
     )
 
-    thread = Thread(target=authorize, args=(cfg, sampler, on_authorization_complete))
+    registry = ModelRegistry(
+        cfg.model_registry.model_dir,
+        cfg.model.modelname,
+        cfg.model_registry.memory_budget_mb,
+        cfg.model_registry.mmap_mode,
+    )
+    pair = ModelRegistry.pair_key(user1_name, user2_name)
+    if cfg.model.param_dict_path:
+        registry.register(pair, cfg.model.param_dict_path)
+    # The pair is expected to authenticate soon, so load its model while sampling
+    registry.preload([pair])
+
+    thread = Thread(
+        target=authorize,
+        args=(cfg, sampler, registry, pair, on_authorization_complete),
+    )
     thread.start()
     visualizer.run()
 
+    if connection_pool is not None:
+        connection_pool.stop()
+
 
 def authorize(
-    cfg: DictConfig, sampler: PairDataSampler, on_authorization_complete: callable
+    cfg: DictConfig,
+    sampler: PairDataSampler,
+    registry: ModelRegistry,
+    pair: tuple[str, str],
+    on_authorization_complete: callable,
 ):
 
-    sampler.run()
-    device1_data, device2_data = sampler.get_data()
+    # Only the features the model of the pair splits on are calculated
+    feature_set = registry.get_feature_set(pair)
+    used_features = None if feature_set is None else feature_set[1]
 
-    preprocessed_device1_data, preprocessed_device2_data = preprocessing(
-        device1_data, device2_data
-    )
-    feat = feature_extraction(preprocessed_device1_data, preprocessed_device2_data)
+    classifier = registry.get(pair)
+
+    def score(feat: pd.DataFrame) -> float:
+        if feature_set is not None:
+            feat = feat.loc[:, feature_set[0]]
+        return classifier.predict_proba(feat)[0][1]
+
+    online_features = None
+    # The lag is estimated from the whole segments,
+    # so alignment needs the segments first
+    if cfg.online_features.enabled and not cfg.alignment.enabled:
+        online_features = OnlinePairFeatures(used_features)
+        sampler.set_online_features(online_features)
+
+    pipelined_features = None
+    # Without online features, each device is
+    # still processed as soon as its segment ends
+    if (
+        online_features is None
+        and cfg.pipelined_features.enabled
+        and not cfg.alignment.enabled
+    ):
+        pipelined_features = PipelinedPairFeatures(
+            used_features, cfg.pipelined_features.max_workers
+        )
+        sampler.set_pipelined_features(pipelined_features)
+
+    early_decision = None
+    if online_features is not None and cfg.early_decision.enabled:
+        # Prefixes of the handshake are scored while sampling continues
+        early_decision = EarlyDecisionSession(
+            online_features,
+            score,
+            list(cfg.early_decision.checkpoints),
+            CheckpointBounds(
+                cfg.early_decision.false_accept_rate,
+                cfg.early_decision.false_reject_rate,
+                len(cfg.early_decision.checkpoints),
+            ),
+        )
+
+    sampling_thread = Thread(target=sampler.run)
+    sampling_thread.start()
+    if early_decision is not None:
+        while sampling_thread.is_alive():
+            checkpoint = early_decision.poll()
+            if checkpoint is not None:
+                auth_result = checkpoint.decision == Decision.ACCEPT
+                on_authorization_complete(auth_result)
+                print(
+                    f"early decision: {checkpoint.decision.name} "
+                    f"after {checkpoint.n_samples} samples, "
+                    f"score={checkpoint.score:.3f}"
+                )
+                break
+            time.sleep(cfg.early_decision.poll_interval_sec)
+    sampling_thread.join()
 
-    classifier = load_model(cfg.model.param_dict_path, cfg.model.modelname)
-    pred = classifier.predict_proba(feat)[0]
-    other_pred, target_pred = pred
+    feat = None
+    if online_features is not None:
+        feat = online_features.result()
+    elif pipelined_features is not None:
+        feat = pipelined_features.result()
+        pipelined_features.close()
+    if feat is None:
+        device1_data, device2_data = sampler.get_data()
+        feat, lag = authentication_features(
+            device1_data,
+            device2_data,
+            used_features,
+            cfg.alignment.max_lag if cfg.alignment.enabled else None,
+        )
+        if cfg.alignment.enabled:
+            print(f"estimated lag between devices: {lag} samples")
+    target_pred = score(feat)
 
-    auth_result = target_pred >= cfg.pred_threshold
-    on_authorization_complete(auth_result)
-    if auth_result:
-        print(f"authrized!")
+    # Use the threshold calibrated for the pair if the model bundle has one
+    auth_result = target_pred >= registry.get_threshold(pair, cfg.pred_threshold)
+    if early_decision is not None and early_decision.decision is not None:
+        time_saved = early_decision.time_saved_sec()
+        if time_saved is not None:
+            print(f"time saved by the early decision: {time_saved:.2f}s")
+        print(
+            f"decision on the whole handshake: {'ACCEPT' if auth_result else 'REJECT'}"
+        )
     else:
-        print(f"unauthrized...")
-    print(pred)
+        on_authorization_complete(auth_result)
+        if auth_result:
+            print(f"authrized!")
+        else:
+            print(f"unauthrized...")
+    print([1 - target_pred, target_pred])
+    print(
+        f"model registry: hits={registry.stats.hits}, misses={registry.stats.misses}, "
+        f"mean load time={registry.stats.mean_load_time:.3f}s"
+    )
 
 
 if __name__ == "__main__":
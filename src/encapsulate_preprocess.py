@@ -1,98 +1,412 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from omegaconf import DictConfig
 
-from preprocess.pair_data_extraction import pair_extraction
-from feature.fusion import FusionMode, calculate_extract_fusion_futures
-from preprocess.util import removal_gravitational_acceleration
-from feature.extract import standardization, triaxial_attributes_l2norm
+from preprocess.alignment import align_pair
+from preprocess.arrays import (
+    SensorArray,
+    append_l2norm,
+    pair_extraction_arrays,
+    removal_gravitational_acceleration_array,
+    standardize_array,
+)
+from preprocess.batch import (
+    SegmentBatch,
+    append_l2norm_batch,
+    removal_gravitational_acceleration_batch,
+    standardize_batch,
+)
+from feature.fusion import FusionMode, fuse_arrays, wrap_extract_features
+from feature.workers import configure_feature_workers
+from feature.stats import extract_stats
+from feature.batch import extract_stats_batch
+from preprocess.pair_data_extraction import extraction_idx, pair_extraction_idx
+from preprocess.pipeline import Pipeline, Stage, StageMemo
 from dataset.sensordata import MaeSoDatasetMode, MaeSoIndivisualDataset, PairDataDataset
+from dataset.archive import PackedPairDataset
+from dataset.prefetch import PrefetchIterator
+from dataset.cache import file_key, get_shared_cache
 from sampling.device_handler import MotionSegmentDeterminator
 
 
+def _align(
+    device1_data: pd.DataFrame, device2_data: pd.DataFrame, align_max_lag: int = None
+) -> tuple[pd.DataFrame, pd.DataFrame, int]:
+    if align_max_lag is None:
+        return device1_data, device2_data, 0
+    # Shift device2 by the estimated lag before the overlapping range is trimmed
+    return align_pair(device1_data, device2_data, align_max_lag)
+
+
+def _as_sensor_array(data) -> SensorArray:
+    if isinstance(data, SensorArray):
+        return data
+    return SensorArray.from_dataframe(data)
+
+
+def _pair_extraction(device1_data, device2_data) -> tuple[SensorArray, SensorArray]:
+    # The stages after pair extraction work on SensorArray instead of DataFrame
+    return pair_extraction_arrays(
+        _as_sensor_array(device1_data), _as_sensor_array(device2_data)
+    )
+
+
+def _device_features(
+    data: SensorArray, used_features: list[str] = None, feature_backend: str = None
+) -> tuple[list[str], np.ndarray]:
+    # feature_backend "tsfresh" calculates the same
+    # statistics with tsfresh on the feature workers
+    if feature_backend == "tsfresh":
+        df = pd.DataFrame(data.values.T, columns=data.channels)
+        df.insert(0, "id", 0)
+        feature = wrap_extract_features(df, used_features)
+        return list(feature.columns), feature.to_numpy(dtype=float)[0]
+    if feature_backend not in (None, "numpy"):
+        raise ValueError(f"Unknown feature backend {feature_backend}")
+    return extract_stats(data.values, data.channels, used_features)
+
+
+def _fuse_feature_mean(
+    feature1: tuple[list[str], np.ndarray], feature2: tuple[list[str], np.ndarray]
+) -> pd.DataFrame:
+    names, values1 = feature1
+    _, values2 = feature2
+    return pd.DataFrame(
+        fuse_arrays(values1, values2, FusionMode.FEATURE_MEAN)[None, :], columns=names
+    )
+
+
+def _device_stages(device: str, stages: list[tuple]) -> list[Stage]:
+    # (name, func, input suffix, output suffix, params) for one device
+    return [
+        Stage(
+            f"{name}_{device}",
+            func,
+            [f"{device}_{input_name}"],
+            [f"{device}_{output_name}"],
+            params,
+        )
+        for name, func, input_name, output_name, params in stages
+    ]
+
+
+# Authentication: pair extraction -> gravity removal -> l2 norm -> features -> fusion.
+# The standardized data is not used by the features, so its stage never runs.
+AUTHENTICATION_PIPELINE = Pipeline(
+    "authentication",
+    [
+        Stage(
+            "alignment",
+            _align,
+            ["device1_raw", "device2_raw"],
+            ["device1_aligned", "device2_aligned", "lag"],
+            ["align_max_lag"],
+        ),
+        Stage(
+            "pair_extraction",
+            _pair_extraction,
+            ["device1_aligned", "device2_aligned"],
+            ["device1_trimmed", "device2_trimmed"],
+        ),
+        *[
+            stage
+            for device in ["device1", "device2"]
+            for stage in _device_stages(
+                device,
+                [
+                    (
+                        "gravity_removal",
+                        removal_gravitational_acceleration_array,
+                        "trimmed",
+                        "filtered",
+                        [],
+                    ),
+                    ("l2norm", append_l2norm, "filtered", "middle", []),
+                    ("standardization", standardize_array, "middle", "standard", []),
+                    (
+                        "features",
+                        _device_features,
+                        "middle",
+                        "features",
+                        ["used_features", "feature_backend"],
+                    ),
+                ],
+            )
+        ],
+        # Only the fused feature row is memoized,
+        # the intermediate recordings are not kept
+        Stage(
+            "fusion",
+            _fuse_feature_mean,
+            ["device1_features", "device2_features"],
+            ["feature"],
+            memoize=True,
+        ),
+    ],
+)
+
+# Training on the old data: pair extraction -> standardization -> features -> fusion
+TRAINING_PIPELINE = Pipeline(
+    "training",
+    [
+        AUTHENTICATION_PIPELINE.stages["alignment"],
+        AUTHENTICATION_PIPELINE.stages["pair_extraction"],
+        *[
+            stage
+            for device in ["device1", "device2"]
+            for stage in _device_stages(
+                device,
+                [
+                    ("standardization", standardize_array, "trimmed", "standard", []),
+                    (
+                        "features",
+                        _device_features,
+                        "standard",
+                        "features",
+                        ["used_features", "feature_backend"],
+                    ),
+                ],
+            )
+        ],
+        AUTHENTICATION_PIPELINE.stages["fusion"],
+    ],
+)
+
+# Stage outputs per recording,
+# shared by all datasets and hydra multirun jobs in the process
+stage_memo = StageMemo()
+
+
 def preprocessing(
     device1_data: pd.DataFrame, device2_data: pd.DataFrame
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
-    extracted_device1_data, extracted_device2_data = pair_extraction(
-        device1_data, device2_data
+    outputs = AUTHENTICATION_PIPELINE.run(
+        {"device1_raw": device1_data, "device2_raw": device2_data},
+        ["device1_filtered", "device2_filtered"],
+    )
+    return (
+        outputs["device1_filtered"].to_dataframe(),
+        outputs["device2_filtered"].to_dataframe(),
     )
-    rm_gravity_device1_data = removal_gravitational_acceleration(extracted_device1_data)
-    rm_gravity_device2_data = removal_gravitational_acceleration(extracted_device2_data)
-    return rm_gravity_device1_data, rm_gravity_device2_data
 
 
 def feature_extraction(
-    device1_data: pd.DataFrame, device2_data: pd.DataFrame
-) -> tuple[pd.DataFrame, pd.DataFrame]:
+    device1_data: pd.DataFrame,
+    device2_data: pd.DataFrame,
+    used_features: list[str] = None,
+) -> pd.DataFrame:
+    # device1_data and device2_data are outputs of preprocessing()
+    # Features that are not in used_features are not calculated and set to 0
+    return AUTHENTICATION_PIPELINE.run(
+        {
+            "device1_filtered": _as_sensor_array(device1_data),
+            "device2_filtered": _as_sensor_array(device2_data),
+        },
+        ["feature"],
+        {"used_features": used_features},
+    )["feature"]
+
 
-    l2norm_device1_data = triaxial_attributes_l2norm(device1_data)
-    l2norm_device2_data = triaxial_attributes_l2norm(device2_data)
-
-    # index列を揃えてconcat
-    device1_middle_feat = pd.concat(
-        [device1_data.reset_index(), l2norm_device1_data], axis=1
-    ).iloc[:, 1:]
-    device2_middle_feat = pd.concat(
-        [device2_data.reset_index(), l2norm_device2_data], axis=1
-    ).iloc[:, 1:]
-
-    # Calculation of mid-level features
-    standard_device1_data = standardization(device1_middle_feat.drop("time", axis=1))
-    standard_device2_data = standardization(device2_middle_feat.drop("time", axis=1))
-    standard_device1_data.columns = device1_middle_feat.columns[1:]
-    standard_device2_data.columns = device2_middle_feat.columns[1:]
-
-    # groupbyで特徴量算出するため参照列を追加する
-    # 別々に特徴量算出するためidはダミー列
-    device1_middle_feat["id"] = 0
-    device2_middle_feat["id"] = 1
-    # Calculation of final features
-    feat = calculate_extract_fusion_futures(
-        device1_middle_feat, device2_middle_feat, FusionMode.FEATURE_MEAN
+def authentication_features(
+    device1_data: pd.DataFrame,
+    device2_data: pd.DataFrame,
+    used_features: list[str] = None,
+    align_max_lag: int = None,
+) -> tuple[pd.DataFrame, int]:
+    # preprocessing() and feature_extraction() in one pass,
+    # returns the features and the lag
+    outputs = AUTHENTICATION_PIPELINE.run(
+        {"device1_raw": device1_data, "device2_raw": device2_data},
+        ["feature", "lag"],
+        {"used_features": used_features, "align_max_lag": align_max_lag},
     )
+    return outputs["feature"], outputs["lag"]
 
-    return feat
 
+class PipelinedPairFeatures:
+    """
+    デバイスごとに動作区間が終わった時点で、そのデバイスの前処理と特徴量計算をワーカーで始めるクラス
 
-def extract_feature_from_old_data(cfg: DictConfig, is_train=True):
+    相手のデバイスが動作中の間は相手の開始時刻だけで切り出し範囲を予測し、
+    両デバイスの終了後に正確な範囲と異なったデバイスだけを計算し直す
+    位置合わせは両デバイスの動作区間が必要なため扱わない
+    """
 
-    dataset = MaeSoIndivisualDataset(
-        cfg.dataset_path,
-        (cfg.correct_user1, cfg.correct_user2),
-        MaeSoDatasetMode.NORMAL,
-        is_train,
-    )
+    def __init__(self, used_features: list[str] = None, max_workers: int = 2):
+        self.used_features = used_features
+        self.data: list[SensorArray] = [None, None]
+        # (predicted (start_idx, end_idx), features of the predicted range)
+        # of each device
+        self.jobs: list[tuple[tuple[int, int], Future]] = [None, None]
+        self.recomputed_devices = 0
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="device-features"
+        )
 
-    feat_df = pd.DataFrame()
-    label_list = list()
-    pair_list = list()
-    for device1_data, device2_data, label, data_info in tqdm(dataset):
-        # Calculation of statistical features
-        device1_extracted_data, device2_extracted_data = pair_extraction(
-            device1_data=device1_data, device2_data=device2_data
+    def finish(
+        self, device_idx: int, data: pd.DataFrame, other_start_time_ns: int = None
+    ):
+        # other_start_time_ns is the first time of
+        # the motion segment of the other device,
+        # None until its motion starts
+        array = SensorArray.from_dataframe(data)
+        if len(array.time) == 0:
+            return
+        with self._lock:
+            self.data[device_idx] = array
+            other = self.data[1 - device_idx]
+        if other is not None:
+            idx = extraction_idx(array.time, other.time[0], other.time[-1])
+        else:
+            # The other device is still moving, so its end is assumed to be later
+            idx = extraction_idx(array.time, other_start_time_ns)
+        self.jobs[device_idx] = (
+            idx,
+            self._executor.submit(self._device_features, device_idx, array.slice(*idx)),
         )
 
-        # Calculation of mid-level features
-        standard_device1_data = standardization(
-            device1_extracted_data.drop("time", axis=1).drop("id", axis=1)
+    def _device_features(
+        self, device_idx: int, trimmed: SensorArray
+    ) -> tuple[list[str], np.ndarray]:
+        device = f"device{device_idx + 1}"
+        return AUTHENTICATION_PIPELINE.run(
+            {f"{device}_trimmed": trimmed},
+            [f"{device}_features"],
+            {"used_features": self.used_features},
+        )[f"{device}_features"]
+
+    def result(self) -> pd.DataFrame:
+        # Fused features of the pair, None if a device has no motion segment
+        if any(job is None for job in self.jobs):
+            return None
+        exact_idx = pair_extraction_idx(self.data[0].time, self.data[1].time)
+        sources = {}
+        for device_idx, (idx, future) in enumerate(self.jobs):
+            device = f"device{device_idx + 1}"
+            exact_range = exact_idx[2 * device_idx : 2 * device_idx + 2]
+            if idx == exact_range:
+                sources[f"{device}_features"] = future.result()
+            else:
+                self.recomputed_devices += 1
+                sources[f"{device}_trimmed"] = self.data[device_idx].slice(*exact_range)
+        return AUTHENTICATION_PIPELINE.run(
+            sources, ["feature"], {"used_features": self.used_features}
+        )["feature"]
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _features_batch(
+    pairs: list[tuple],
+    stages: list,
+    used_features: list[str] = None,
+    align_max_lag: int = None,
+) -> pd.DataFrame:
+    trimmed_pairs = [
+        _pair_extraction(*_align(device1_data, device2_data, align_max_lag)[:2])
+        for device1_data, device2_data in pairs
+    ]
+    device_features = []
+    for device_idx in range(2):
+        batch = SegmentBatch.from_arrays([pair[device_idx] for pair in trimmed_pairs])
+        for stage in stages:
+            batch = stage(batch)
+        names, feature = extract_stats_batch(
+            batch.values, batch.offsets, batch.channels, used_features
         )
-        standard_device2_data = standardization(
-            device2_extracted_data.drop("time", axis=1).drop("id", axis=1)
+        device_features.append(feature)
+    return pd.DataFrame(
+        fuse_arrays(*device_features, FusionMode.FEATURE_MEAN), columns=names
+    )
+
+
+def authentication_features_batch(
+    pairs: list[tuple],
+    used_features: list[str] = None,
+    align_max_lag: int = None,
+) -> pd.DataFrame:
+    # authentication_features() for many pairs at once, one row per pair.
+    # The segments of every device are processed as one ragged batch.
+    return _features_batch(
+        pairs,
+        [removal_gravitational_acceleration_batch, append_l2norm_batch],
+        used_features,
+        align_max_lag,
+    )
+
+
+def training_features_batch(
+    pairs: list[tuple],
+    used_features: list[str] = None,
+    align_max_lag: int = None,
+) -> pd.DataFrame:
+    # TRAINING_PIPELINE for many pairs at once, one row per pair
+    return _features_batch(pairs, [standardize_batch], used_features, align_max_lag)
+
+
+def _recording_key(data_path: str) -> tuple:
+    # Members of a packed archive are named "{archive path}:{member}"
+    if os.path.exists(data_path):
+        return file_key(data_path)
+    archive_path, _, member = data_path.rpartition(":")
+    return file_key(archive_path) + (member,)
+
+
+def extract_feature_from_old_data(cfg: DictConfig, is_train=True, pair_ids=None):
+
+    if cfg.dataset_archive is not None:
+        # Packed by src/pack_dataset.py, read with mmap instead of the CSV files
+        dataset = PackedPairDataset(
+            cfg.dataset_archive,
+            (cfg.correct_user1, cfg.correct_user2),
+            MaeSoDatasetMode.NORMAL.name.lower(),
+            is_train,
+            pair_ids,
         )
-        standard_device1_data.columns = [
-            c for c in device1_extracted_data.columns if (c != "time") and (c != "id")
-        ]
-        standard_device2_data.columns = [
-            c for c in device2_extracted_data.columns if (c != "time") and (c != "id")
-        ]
-        # groupbyで特徴量算出するため参照列を追加する
-        # 別々に特徴量算出するためidはダミー列
-        standard_device1_data["id"] = 0
-        standard_device2_data["id"] = 0
-
-        feat = calculate_extract_fusion_futures(
-            standard_device1_data, standard_device2_data, FusionMode.FEATURE_MEAN
+    else:
+        dataset = MaeSoIndivisualDataset(
+            cfg.dataset_path,
+            (cfg.correct_user1, cfg.correct_user2),
+            MaeSoDatasetMode.NORMAL,
+            is_train,
+            pair_ids,
+            get_shared_cache(cfg.cache.memory_budget_mb) if cfg.cache.enabled else None,
         )
+
+    feat_df = pd.DataFrame()
+    label_list = list()
+    pair_list = list()
+    # CSV files of the following pairs are read while the current pair is processed
+    prefetch_iterator = PrefetchIterator(
+        dataset, cfg.prefetch.depth, cfg.prefetch.workers
+    )
+    configure_feature_workers(
+        cfg.feature_extraction.n_jobs, cfg.feature_extraction.chunk_size
+    )
+    params = {
+        "align_max_lag": cfg.alignment.max_lag if cfg.alignment.enabled else None,
+        "feature_backend": cfg.feature_extraction.backend,
+    }
+    stage_memo.max_entries = cfg.memo.max_entries
+    for device1_data, device2_data, label, data_info in tqdm(prefetch_iterator):
+        # Repeated passes over the same recordings reuse the memoized stage outputs
+        feat = TRAINING_PIPELINE.run(
+            {"device1_raw": device1_data, "device2_raw": device2_data},
+            ["feature"],
+            params,
+            stage_memo if cfg.memo.enabled else None,
+            (
+                _recording_key(data_info["user1_data_path"]),
+                _recording_key(data_info["user2_data_path"]),
+            ),
+        )["feature"]
         feat_df = pd.concat([feat_df, feat], axis=0)
         label_list.append(label)
         pair_list.append((data_info["user1_id"], data_info["user2_id"]))
@@ -102,25 +416,36 @@ def extract_feature_from_old_data(cfg: DictConfig, is_train=True):
 
 
 def extract_feature(cfg: DictConfig):
-    dataset = PairDataDataset(cfg.dataset_path, [cfg.correct_user1, cfg.correct_user2])
+    dataset = PairDataDataset(
+        cfg.dataset_path,
+        [cfg.correct_user1, cfg.correct_user2],
+        get_shared_cache(cfg.cache.memory_budget_mb) if cfg.cache.enabled else None,
+    )
 
-    def split_sensor_data(sensor_data: pd.DataFrame) -> list[pd.DataFrame]:
-        df_list = []
+    def split_sensor_data(sensor_data: pd.DataFrame) -> list[SensorArray]:
+        # The recording is converted once and the motion segments are views of it
+        sensor_array = SensorArray.from_dataframe(sensor_data)
+        gyro = sensor_array.values[
+            [sensor_array.channel_index(c) for c in ["gyroX", "gyroY", "gyroZ"]]
+        ].T
+        segment_list = []
         segment_determinator = MotionSegmentDeterminator()
-        for i in range(len(sensor_data)):
-            current_gyro = sensor_data.loc[i, ["gyroX", "gyroY", "gyroZ"]]
-            segment_determinator.updateData(current_gyro, i)
+        for i in range(len(sensor_array)):
+            segment_determinator.updateData(gyro[i], i)
             if segment_determinator.finished:
                 start_idx = segment_determinator.start_idx
                 end_idx = segment_determinator.end_idx
-                df_list.append(sensor_data.iloc[start_idx:end_idx])
+                segment_list.append(sensor_array.slice(start_idx, end_idx))
                 segment_determinator.clear()
-        return df_list
+        return segment_list
 
     feat_df = pd.DataFrame()
     label_list = list()
     pair_list = list()
-    for device1_data, device2_data, label, data_info in tqdm(dataset):
+    prefetch_iterator = PrefetchIterator(
+        dataset, cfg.prefetch.depth, cfg.prefetch.workers
+    )
+    for device1_data, device2_data, label, data_info in tqdm(prefetch_iterator):
         # Calculation of statistical features
         device1_motion_data_list = split_sensor_data(device1_data)
         device2_motion_data_list = split_sensor_data(device2_data)
@@ -129,18 +454,17 @@ def extract_feature(cfg: DictConfig):
         device1_motion_data_list = device1_motion_data_list[:min_length]
         device2_motion_data_list = device2_motion_data_list[:min_length]
 
-        for device1_motion_data, device2_motion_data in zip(
-            device1_motion_data_list, device2_motion_data_list
-        ):
-            preprocessed_device1_data, preprocessed_device2_data = preprocessing(
-                device1_motion_data, device2_motion_data
-            )
-            feat = feature_extraction(
-                preprocessed_device1_data, preprocessed_device2_data
-            )
-            feat_df = pd.concat([feat_df, feat], axis=0)
-            label_list.append(label)
-            pair_list.append((data_info["user1_name"], data_info["user2_name"]))
+        if min_length == 0:
+            continue
+        # All motion segments of the recording pair are featurized in one batch
+        feat = authentication_features_batch(
+            list(zip(device1_motion_data_list, device2_motion_data_list))
+        )
+        feat_df = pd.concat([feat_df, feat], axis=0)
+        label_list.extend([label] * min_length)
+        pair_list.extend(
+            [(data_info["user1_name"], data_info["user2_name"])] * min_length
+        )
 
     feat_df = feat_df.reset_index().drop("index", axis=1)
     return feat_df, label_list, pair_list
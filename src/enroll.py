@@ -0,0 +1,56 @@
+import hydra
+from omegaconf import DictConfig
+
+from feature.store import FeatureStore
+from model.bundle import ModelBundle
+from model.enrollment import enroll_pair
+from encapsulate_preprocess import extract_feature_from_old_data
+
+
+def pair_key(pair_id) -> tuple[str, str]:
+    # User ids in the dataset are {pair_id}_{user_number}
+    return (f"{pair_id}_0", f"{pair_id}_1")
+
+
+def store_pair_features(
+    feature_store: FeatureStore, feat_df, label_list, exclude_pair_id=None
+):
+    for pair_id in sorted(set(label_list), key=str):
+        if str(pair_id) == str(exclude_pair_id):
+            continue
+        mask = [label == pair_id for label in label_list]
+        feature_store.save(pair_key(pair_id), feat_df[mask])
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="enroll")
+def enroll(cfg: DictConfig):
+    assert (
+        cfg.pair_id is not None
+    ), "Please specify pair_id to enroll. how to use: pair_id=xxx"
+
+    feature_store = FeatureStore(cfg.feature_store_dir)
+    bundle = ModelBundle(cfg.bundle_dir, cfg.model.modelname)
+    pair = pair_key(cfg.pair_id)
+
+    if len(feature_store) == 0:
+        # Features of the existing pairs are extracted only once and reused afterwards
+        print("feature store is empty. extract features of all pairs")
+        feat_df, label_list, _ = extract_feature_from_old_data(cfg)
+        store_pair_features(feature_store, feat_df, label_list, cfg.pair_id)
+
+    feat_df, _, _ = extract_feature_from_old_data(cfg, pair_ids=[cfg.pair_id])
+    updated_pairs = enroll_pair(
+        pair,
+        feat_df,
+        feature_store,
+        bundle,
+        cfg.additional_estimators,
+        cfg.update_existing,
+        cfg.threshold.target_far,
+        cfg.threshold.cv_folds,
+    )
+    print(f"enrolled pair: {pair}, updated models: {updated_pairs}")
+
+
+if __name__ == "__main__":
+    enroll()
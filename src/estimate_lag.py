@@ -0,0 +1,28 @@
+import os
+
+import hydra
+from omegaconf import DictConfig
+
+from dataset.sensordata import MaeSoDatasetMode, MaeSoIndivisualDataset
+from preprocess.alignment import estimate_dataset_lags
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="estimate_lag")
+def estimate_lag(cfg: DictConfig):
+    output_dir_path = hydra.core.hydra_config.HydraConfig.get().runtime.output_dir
+
+    dataset = MaeSoIndivisualDataset(
+        cfg.dataset_path,
+        (cfg.correct_user1, cfg.correct_user2),
+        MaeSoDatasetMode.NORMAL,
+        cfg.is_train,
+    )
+    lag_df = estimate_dataset_lags(dataset, cfg.max_lag, cfg.batch_size)
+    lag_df.to_csv(os.path.join(output_dir_path, "lag.csv"), index=False)
+
+    print(lag_df["lag"].describe())
+    print(f"pairs at the search limit: {(lag_df['lag'].abs() == cfg.max_lag).sum()}")
+
+
+if __name__ == "__main__":
+    estimate_lag()
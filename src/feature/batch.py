@@ -0,0 +1,149 @@
+import numpy as np
+
+from preprocess.batch import segment_mean, to_padded
+from .stats import SAMPLE_ENTROPY_CHUNK_BYTES, _sample_entropy_1d
+
+# Segment-wise versions of feature/stats.py for a ragged batch.
+# Every function takes (channels, total samples) and
+# the segment offsets and returns (channels, segments).
+# maximum, minimum and median are identical to the per-segment functions, the others
+# are sums over the segments and agree with them to the rounding of the summation order.
+
+
+def maximum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return np.maximum.reduceat(values, offsets[:-1], axis=1)
+
+
+def minimum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return np.minimum.reduceat(values, offsets[:-1], axis=1)
+
+
+def median(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    lengths = np.diff(offsets)
+    # Padding with inf sorts it after the samples of every segment
+    ordered = np.sort(to_padded(values, offsets, np.inf), axis=-1)
+    segments = np.arange(len(lengths))
+    lower = ordered[segments, :, (lengths - 1) // 2]
+    upper = ordered[segments, :, lengths // 2]
+    result = (lower + upper) / 2
+    has_nan = np.add.reduceat(np.isnan(values), offsets[:-1], axis=1).T > 0
+    result[has_nan] = np.nan
+    return result.T
+
+
+def skewness(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    lengths = np.diff(offsets)
+    count = lengths.astype(float)
+    mean = segment_mean(values, offsets)
+    adjusted = values - np.repeat(mean, lengths, axis=1)
+    adjusted2 = adjusted**2
+    m2 = np.add.reduceat(adjusted2, offsets[:-1], axis=1)
+    m3 = np.add.reduceat(adjusted2 * adjusted, offsets[:-1], axis=1)
+
+    max_abs = np.maximum.reduceat(np.abs(values), offsets[:-1], axis=1)
+    eps = np.finfo(np.float64).eps
+    m2 = np.where(np.abs(m2) < ((eps * max_abs) ** 2) * count, 0, m2)
+    m3 = np.where(np.abs(m3) < ((eps * max_abs) ** 3) * count, 0, m3)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2**1.5)
+    result = np.where(m2 == 0, 0, result)
+    result[:, count < 3] = np.nan
+    return result
+
+
+def _sample_entropy_padded(
+    padded: np.ndarray, lengths: np.ndarray, m: int = 2
+) -> np.ndarray:
+    # padded is (rows, samples) padded with nan, which never matches a template
+    n = padded.shape[-1]
+    with np.errstate(invalid="ignore"):
+        variance = np.nanmean(
+            (padded - np.nanmean(padded, axis=1)[:, None]) ** 2, axis=1
+        )
+    tolerance = 0.2 * np.sqrt(variance)
+
+    distance = np.abs(padded[:, :, None] - padded[:, None, :])
+    template_distance = distance[:, : n - m + 1, : n - m + 1]
+    for k in range(1, m):
+        template_distance = np.maximum(
+            template_distance, distance[:, k : n - m + 1 + k, k : n - m + 1 + k]
+        )
+    within = template_distance <= tolerance[:, None, None]
+    b = within.sum(axis=(1, 2)) - np.maximum(lengths - m + 1, 0)
+    template_distance = np.maximum(
+        template_distance[:, : n - m, : n - m], distance[:, m:, m:]
+    )
+    within = template_distance <= tolerance[:, None, None]
+    a = within.sum(axis=(1, 2)) - np.maximum(lengths - m, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return -np.log(a / b)
+
+
+def sample_entropy(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    lengths = np.diff(offsets)
+    n_channels = values.shape[0]
+    # (segments * channels, longest segment)
+    padded = to_padded(values, offsets).reshape(len(lengths) * n_channels, -1)
+    row_lengths = np.repeat(lengths, n_channels)
+    has_nan = np.add.reduceat(np.isnan(values), offsets[:-1], axis=1).T.reshape(-1) > 0
+
+    result = np.full(len(padded), np.nan)
+    # Rows of similar length are calculated together to keep the padding small
+    order = np.argsort(row_lengths, kind="stable")
+    start = 0
+    while start < len(order):
+        row = order[start]
+        length = row_lengths[row]
+        if length * length * 8 > SAMPLE_ENTROPY_CHUNK_BYTES:
+            # A row over the budget on its own is compared a block of templates at a time
+            result[row] = _sample_entropy_1d(padded[row, :length])
+            start += 1
+            continue
+        end = start + 1
+        while end < len(order):
+            # The rows are sorted, so the next row is the longest one of the chunk
+            longest = row_lengths[order[end]]
+            if (end - start + 1) * longest * longest * 8 > SAMPLE_ENTROPY_CHUNK_BYTES:
+                break
+            end += 1
+        rows = order[start:end]
+        result[rows] = _sample_entropy_padded(
+            padded[rows, : row_lengths[rows[-1]]], row_lengths[rows]
+        )
+        start = end
+    result[has_nan] = np.nan
+    return result.reshape(len(lengths), n_channels).T
+
+
+FEATURE_STAT_FUNCTIONS = {
+    "maximum": maximum,
+    "minimum": minimum,
+    "median": median,
+    "sample_entropy": sample_entropy,
+    "skewness": skewness,
+}
+
+
+def extract_stats_batch(
+    values: np.ndarray,
+    offsets: np.ndarray,
+    channels: list[str],
+    used_features: list[str] = None,
+) -> tuple[list[str], np.ndarray]:
+    # Returns the feature names of extract_stats and a (segments, features) array
+    stats = list(FEATURE_STAT_FUNCTIONS.keys())
+    names = [f"{channel}__{stat}" for channel in channels for stat in stats]
+    feature = np.zeros((len(offsets) - 1, len(channels), len(stats)))
+    used = None if used_features is None else set(used_features)
+    for stat_idx, stat in enumerate(stats):
+        channel_idx = [
+            i
+            for i, channel in enumerate(channels)
+            if used is None or f"{channel}__{stat}" in used
+        ]
+        if channel_idx:
+            feature[:, channel_idx, stat_idx] = FEATURE_STAT_FUNCTIONS[stat](
+                values[channel_idx], offsets
+            ).T
+    return names, feature.reshape(len(offsets) - 1, -1)
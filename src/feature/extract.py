@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 
+from preprocess.arrays import TRIAXIAL_LABELS, l2norm_arrays
+
 
 def standardization(df: pd.DataFrame) -> pd.DataFrame:
 
@@ -14,17 +16,17 @@ def standardization(df: pd.DataFrame) -> pd.DataFrame:
 def triaxial_attributes_l2norm(
     df: pd.DataFrame, triaxial_attributes_colnames=["acc", "gyro"]
 ) -> pd.DataFrame:
-    triaxial_label = ["X", "Y", "Z"]
     triaxial_l2norm_labels = [l + "_mag" for l in triaxial_attributes_colnames]
-
-    l2norm = np.zeros((len(triaxial_attributes_colnames), len(df)))
-
-    for att_idx, triaxial_attribute in enumerate(triaxial_attributes_colnames):
-
-        for label in triaxial_label:
-            l2norm[att_idx] += df[triaxial_attribute + label] ** 2
-
-        l2norm[att_idx] = np.sqrt(l2norm[att_idx])
+    channels = [
+        attribute + axis
+        for attribute in triaxial_attributes_colnames
+        for axis in TRIAXIAL_LABELS
+    ]
+    l2norm = l2norm_arrays(
+        df.loc[:, channels].to_numpy(dtype=float).T,
+        channels,
+        triaxial_attributes_colnames,
+    )
 
     l2norm_df = pd.DataFrame(l2norm.T, columns=triaxial_l2norm_labels)
     return l2norm_df
@@ -4,6 +4,9 @@ import numpy as np
 import pandas as pd
 from tsfresh import extract_features
 
+from .stats import extract_stats
+from .workers import get_chunk_size, get_distributor
+
 
 class FusionMode(Enum):
     DATA_MEAN = 0
@@ -12,35 +15,121 @@ class FusionMode(Enum):
     FEATURE_NORM = 3
 
 
-def wrap_extract_features(df: pd.DataFrame):
+FEATURE_STATS = ["maximum", "minimum", "median", "sample_entropy", "skewness"]
+
+
+def split_feature_name(feature_name: str) -> tuple[str, str]:
+    # "{column}__{stat}" -> (column, stat)
+    column, stat = feature_name.rsplit("__", 1)
+    return column, stat
+
+
+def wrap_extract_features(df: pd.DataFrame, used_features: list[str] = None):
+    # When used_features is given,
+    # only these statistics are calculated and the others are 0
     selected_columns = [
         f"{header}__{stat}"
         for header in df.columns
         if header != "id"
-        for stat in ["maximum", "minimum", "median", "sample_entropy", "skewness"]
+        for stat in FEATURE_STATS
     ]
+    kind_to_fc_parameters = None
+    if used_features is not None:
+        kind_to_fc_parameters = {}
+        for feature_name in used_features:
+            column, stat = split_feature_name(feature_name)
+            if column in df.columns and stat in FEATURE_STATS:
+                kind_to_fc_parameters.setdefault(column, {})[stat] = None
+        if not kind_to_fc_parameters:
+            return pd.DataFrame(0.0, index=df["id"].unique(), columns=selected_columns)
+        # Columns without an entry would be calculated with the default parameters
+        df = df.loc[:, ["id"] + list(kind_to_fc_parameters.keys())]
+
     feat = extract_features(
         df,
         column_id="id",
         column_kind=None,
         column_value=None,
-        default_fc_parameters={
-            "maximum": None,
-            "minimum": None,
-            "median": None,
-            "sample_entropy": None,
-            "skewness": None,
-        },
-        kind_to_fc_parameters=None,
+        default_fc_parameters={stat: None for stat in FEATURE_STATS},
+        kind_to_fc_parameters=kind_to_fc_parameters,
         disable_progressbar=True,
+        # The persistent workers of the feature subsystem instead of a new pool per call
+        distributor=get_distributor(),
+        chunksize=get_chunk_size(),
     )
-    return feat[selected_columns]
+    return feat.reindex(columns=selected_columns, fill_value=0.0)
+
+
+def fuse_arrays(
+    values1: np.ndarray, values2: np.ndarray, mode: FusionMode
+) -> np.ndarray:
+    # Element-wise fusion of the data (DATA_*) or
+    # the features (FEATURE_*) of both devices
+    if mode == FusionMode.DATA_MEAN or mode == FusionMode.FEATURE_MEAN:
+        return (values1 + values2) / 2
+    elif mode == FusionMode.DATA_NORM or mode == FusionMode.FEATURE_NORM:
+        return np.sqrt(values1**2 + values2**2)
+    raise ValueError(f"Unknown fusion mode {mode}")
+
+
+def extract_fusion_feature_arrays(
+    values1: np.ndarray,
+    values2: np.ndarray,
+    channels: list[str],
+    mode: FusionMode,
+    used_features: list[str] = None,
+) -> tuple[list[str], np.ndarray]:
+    # values1 and values2 are (channels, samples) arrays of the same length
+    if mode == FusionMode.DATA_MEAN or mode == FusionMode.DATA_NORM:
+        return extract_stats(
+            fuse_arrays(values1, values2, mode), channels, used_features
+        )
+    names, feature1 = extract_stats(values1, channels, used_features)
+    _, feature2 = extract_stats(values2, channels, used_features)
+    return names, fuse_arrays(feature1, feature2, mode)
+
+
+def _single_id_arrays(df: pd.DataFrame) -> tuple[list[str], np.ndarray, float]:
+    channels = [c for c in df.columns if (c != "time") and (c != "id")]
+    values = np.ascontiguousarray(df.loc[:, channels].to_numpy(dtype=float).T)
+    id_value = df["id"].iloc[0] if "id" in df.columns and len(df) > 0 else 0
+    return channels, values, id_value
 
 
 def calculate_extract_fusion_futures(
     pair_data_1: pd.DataFrame,
     pair_data_2: pd.DataFrame,
     mode: FusionMode,
+    used_features: list[str] = None,
+) -> pd.DataFrame:
+    # DataFrame adapter of extract_fusion_feature_arrays.
+    # Several ids in one DataFrame are still calculated by tsfresh for each id.
+    if ("id" in pair_data_1.columns and pair_data_1["id"].nunique() > 1) or (
+        "id" in pair_data_2.columns and pair_data_2["id"].nunique() > 1
+    ):
+        return _calculate_extract_fusion_futures_by_id(
+            pair_data_1, pair_data_2, mode, used_features
+        )
+
+    channels, values1, id1 = _single_id_arrays(pair_data_1)
+    _, values2, id2 = _single_id_arrays(pair_data_2)
+    names, feature = extract_fusion_feature_arrays(
+        values1, values2, channels, mode, used_features
+    )
+    # Same index as the tsfresh path,
+    # the id after the data fusion or 0 after the feature fusion
+    if mode == FusionMode.DATA_MEAN or mode == FusionMode.DATA_NORM:
+        index = fuse_arrays(np.array([id1]), np.array([id2]), mode)
+    else:
+        index = [0]
+    return pd.DataFrame(feature[None, :], index=index, columns=names)
+
+
+def _calculate_extract_fusion_futures_by_id(
+    pair_data_1: pd.DataFrame,
+    pair_data_2: pd.DataFrame,
+    mode: FusionMode,
+    used_features: list[str] = None,
 ) -> pd.DataFrame:
 
     pd1 = pair_data_1.copy()
@@ -51,24 +140,30 @@ def calculate_extract_fusion_futures(
         pd2 = pd2.drop(columns=["time"])
 
     # fusion before feature extraction
-    if mode == FusionMode.DATA_MEAN:
-        fusion_df = (pd1 + pd2) / 2
-    elif mode == FusionMode.DATA_NORM:
-        fusion_df = np.sqrt(pd1.applymap(lambda x: x**2) + pd2.applymap(lambda x: x**2))
-
-    # feature extraction
     if mode == FusionMode.DATA_MEAN or mode == FusionMode.DATA_NORM:
-        feature = wrap_extract_features(fusion_df)
-    elif mode == FusionMode.FEATURE_MEAN or mode == FusionMode.FEATURE_NORM:
-        fusion_df1 = wrap_extract_features(pd1).reset_index().drop("index", axis=1)
-        fusion_df2 = wrap_extract_features(pd2).reset_index().drop("index", axis=1)
+        fusion_df = pd.DataFrame(
+            fuse_arrays(pd1.to_numpy(dtype=float), pd2.to_numpy(dtype=float), mode),
+            index=pd1.index,
+            columns=pd1.columns,
+        )
+        return wrap_extract_features(fusion_df, used_features)
 
     # fusion after feature extraction
-    if mode == FusionMode.FEATURE_MEAN:
-        feature = (fusion_df1 + fusion_df2) / 2
-    elif mode == FusionMode.FEATURE_NORM:
-        feature = np.sqrt(
-            fusion_df1.applymap(lambda x: x**2) + fusion_df2.applymap(lambda x: x**2)
-        )
+    fusion_df1 = wrap_extract_features(pd1, used_features).reset_index(drop=True)
+    fusion_df2 = wrap_extract_features(pd2, used_features).reset_index(drop=True)
+    return fuse_features(fusion_df1, fusion_df2, mode)
 
-    return feature
+
+def fuse_features(
+    feature1: pd.DataFrame, feature2: pd.DataFrame, mode: FusionMode
+) -> pd.DataFrame:
+    # Fusion of the features calculated for each device
+    if mode != FusionMode.FEATURE_MEAN and mode != FusionMode.FEATURE_NORM:
+        raise ValueError(f"{mode} is not a fusion after feature extraction")
+    return pd.DataFrame(
+        fuse_arrays(
+            feature1.to_numpy(dtype=float), feature2.to_numpy(dtype=float), mode
+        ),
+        index=feature1.index,
+        columns=feature1.columns,
+    )
@@ -0,0 +1,377 @@
+import heapq
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from preprocess.arrays import SENSOR_CHANNELS
+from preprocess.pair_data_extraction import pair_extraction_idx, search_near_time_idx_ns
+from .fusion import FEATURE_STATS, FusionMode, fuse_arrays
+
+# Channels of the authentication features, the sensor channels followed by the l2 norms
+ONLINE_FEATURE_CHANNELS = SENSOR_CHANNELS + ["acc_mag", "gyro_mag"]
+
+
+class OnlineStats:
+    """
+    統計量をサンプルが届くたびに更新するクラス
+
+    最大値、最小値、歪度は逐次更新、中央値は2つのヒープで保持し、
+    サンプルエントロピーはテンプレート間の距離を逐次計算して最後に閾値以下の数を数える
+    """
+
+    def __init__(
+        self, n_channels: int, stat_channels: dict[str, list[int]] = None, m: int = 2
+    ):
+        # stat_channels: channel indexes for which each
+        # statistic is needed, all channels if None
+        all_channels = list(range(n_channels))
+        if stat_channels is None:
+            stat_channels = {stat: all_channels for stat in FEATURE_STATS}
+        self.n_channels = n_channels
+        self.stat_channels = stat_channels
+        self.m = m
+        self.count = 0
+
+        self.maximum = np.full(n_channels, -np.inf)
+        self.minimum = np.full(n_channels, np.inf)
+        # Central moment sums, updated with the one-pass formulas of Terriberry
+        self.mean = np.zeros(n_channels)
+        self.m2 = np.zeros(n_channels)
+        self.m3 = np.zeros(n_channels)
+
+        # Lower half as a max heap (negated values) and upper half as a min heap
+        self.median_channels = stat_channels.get("median", [])
+        self.lower_heaps = [[] for _ in self.median_channels]
+        self.upper_heaps = [[] for _ in self.median_channels]
+
+        # Samples of the sample entropy channels and
+        # the Chebyshev distances between templates.
+        # template_distances[s] holds the distances
+        # of the template of length m starting at s
+        # to the earlier templates, longer_distances the same for length m + 1.
+        self.entropy_channels = stat_channels.get("sample_entropy", [])
+        self.samples = np.zeros((len(self.entropy_channels), 256))
+        self.template_distances: list[np.ndarray] = []
+        self.longer_distances: list[np.ndarray] = []
+
+    def push(self, x: np.ndarray):
+        self.count += 1
+        n = self.count
+        np.maximum(self.maximum, x, out=self.maximum)
+        np.minimum(self.minimum, x, out=self.minimum)
+
+        delta = x - self.mean
+        delta_n = delta / n
+        term1 = delta * delta_n * (n - 1)
+        self.mean += delta_n
+        self.m3 += term1 * delta_n * (n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+
+        for heap_idx, channel in enumerate(self.median_channels):
+            self._push_median(heap_idx, x[channel])
+
+        if self.entropy_channels:
+            self._push_entropy(x[self.entropy_channels])
+
+    def _push_median(self, heap_idx: int, value: float):
+        lower = self.lower_heaps[heap_idx]
+        upper = self.upper_heaps[heap_idx]
+        if lower and value > -lower[0]:
+            heapq.heappush(upper, value)
+        else:
+            heapq.heappush(lower, -value)
+        # The lower half has the same number of values as the upper half or one more
+        if len(lower) > len(upper) + 1:
+            heapq.heappush(upper, -heapq.heappop(lower))
+        elif len(upper) > len(lower):
+            heapq.heappush(lower, -heapq.heappop(upper))
+
+    def _push_entropy(self, x: np.ndarray):
+        t = self.count - 1
+        if t >= self.samples.shape[1]:
+            self.samples = np.concatenate(
+                [self.samples, np.zeros_like(self.samples)], axis=1
+            )
+        self.samples[:, t] = x
+        m = self.m
+        samples = self.samples
+        # Template of length m starting at s = t - m + 1 against the templates before it
+        s = t - m + 1
+        if s >= 0:
+            distance = np.abs(samples[:, s : s + 1] - samples[:, :s])
+            for k in range(1, m):
+                distance = np.maximum(
+                    distance,
+                    np.abs(samples[:, s + k : s + k + 1] - samples[:, k : s + k]),
+                )
+            self.template_distances.append(distance)
+        # Template of length m + 1 starting at s = t - m,
+        # one sample longer than the one above
+        s = t - m
+        if s >= 0:
+            self.longer_distances.append(
+                np.maximum(
+                    self.template_distances[s],
+                    np.abs(samples[:, t : t + 1] - samples[:, m : s + m]),
+                )
+            )
+
+    def _median(self) -> np.ndarray:
+        result = np.zeros(len(self.median_channels))
+        for heap_idx in range(len(self.median_channels)):
+            lower = self.lower_heaps[heap_idx]
+            upper = self.upper_heaps[heap_idx]
+            if len(lower) > len(upper):
+                result[heap_idx] = -lower[0]
+            else:
+                result[heap_idx] = np.mean([-lower[0], upper[0]])
+        return result
+
+    def _skewness(self) -> np.ndarray:
+        # Same coefficient and floating point error handling as pandas.Series.skew
+        count = np.float64(self.count)
+        max_abs = np.maximum(np.abs(self.maximum), np.abs(self.minimum))
+        eps = np.finfo(np.float64).eps
+        m2 = np.where(np.abs(self.m2) < ((eps * max_abs) ** 2) * count, 0, self.m2)
+        m3 = np.where(np.abs(self.m3) < ((eps * max_abs) ** 3) * count, 0, self.m3)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2**1.5)
+        result = np.where(m2 == 0, 0, result)
+        if count < 3:
+            result[:] = np.nan
+        return result
+
+    def _sample_entropy(self) -> np.ndarray:
+        samples = self.samples[:, : self.count]
+        tolerance = 0.2 * np.std(samples, axis=1)[:, None]
+
+        def count_matches(distances: list[np.ndarray]) -> np.ndarray:
+            if not distances:
+                return np.zeros(len(self.entropy_channels))
+            # Every pair of templates matches in both directions
+            return 2 * np.sum(np.concatenate(distances, axis=1) <= tolerance, axis=1)
+
+        b = count_matches(self.template_distances)
+        a = count_matches(self.longer_distances)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return -np.log(a / b)
+
+    def result(self) -> dict[str, np.ndarray]:
+        # Statistic -> (channels,), 0 for the channels that were not requested
+        results = {}
+        calculated = {
+            "maximum": lambda: self.maximum,
+            "minimum": lambda: self.minimum,
+            "skewness": self._skewness,
+        }
+        for stat in FEATURE_STATS:
+            values = np.zeros(self.n_channels)
+            channels = self.stat_channels.get(stat, [])
+            if stat in calculated:
+                values[channels] = calculated[stat]()[channels]
+            elif stat == "median" and channels:
+                values[channels] = self._median()
+            elif stat == "sample_entropy" and channels:
+                values[channels] = self._sample_entropy()
+            results[stat] = values
+        return results
+
+
+class OnlineDeviceFeatures:
+    """
+    1デバイス分の認証用特徴量を逐次計算するクラス
+
+    重力加速度の除去とl2ノルムをサンプルごとに行いOnlineStatsに渡す
+    ハイパスフィルタは最後のサンプルを除去しないため、1サンプル遅れて渡す
+    """
+
+    def __init__(self, used_features: list[str] = None, alpha: float = 0.8):
+        self.alpha = alpha
+        self.channels = ONLINE_FEATURE_CHANNELS
+        self.names = [f"{c}__{stat}" for c in self.channels for stat in FEATURE_STATS]
+        stat_channels = None
+        if used_features is not None:
+            used = set(used_features)
+            stat_channels = {
+                stat: [i for i, c in enumerate(self.channels) if f"{c}__{stat}" in used]
+                for stat in FEATURE_STATS
+            }
+        self.stats = OnlineStats(len(self.channels), stat_channels)
+        self.acc_idx = [SENSOR_CHANNELS.index("acc" + axis) for axis in "XYZ"]
+        self.gyro_idx = [SENSOR_CHANNELS.index("gyro" + axis) for axis in "XYZ"]
+        self.offset = None
+        self.pending = None
+
+    def push(self, row: list[float]):
+        x = np.asarray(row, dtype=float)
+        acc = x[self.acc_idx]
+        if self.offset is None:
+            self.offset = acc
+        else:
+            # The previous sample is not the last one, so it is filtered with its offset
+            self._emit(self.pending[0], self.pending[0][self.acc_idx] - self.pending[1])
+            self.offset = self.alpha * self.offset + (1 - self.alpha) * acc
+        self.pending = (x, self.offset)
+
+    def _emit(self, x: np.ndarray, acc: np.ndarray):
+        values = np.empty(len(self.channels))
+        values[: len(SENSOR_CHANNELS)] = x
+        values[self.acc_idx] = acc
+        gyro = x[self.gyro_idx]
+        # Summed in the same order as l2norm_arrays
+        acc_mag = 0.0
+        gyro_mag = 0.0
+        for axis in range(3):
+            acc_mag += acc[axis] ** 2
+            gyro_mag += gyro[axis] ** 2
+        values[len(SENSOR_CHANNELS)] = np.sqrt(acc_mag)
+        values[len(SENSOR_CHANNELS) + 1] = np.sqrt(gyro_mag)
+        self.stats.push(values)
+
+    def features(self) -> np.ndarray:
+        # Features of the samples passed to the statistics so far
+        results = self.stats.result()
+        return np.stack([results[stat] for stat in FEATURE_STATS], axis=1).reshape(-1)
+
+    def finalize(self) -> np.ndarray:
+        # The last sample is not filtered
+        if self.pending is not None:
+            self._emit(self.pending[0], self.pending[0][self.acc_idx])
+            self.pending = None
+        return self.features()
+
+
+class OnlinePairFeatures:
+    """
+    2デバイスの動作区間のサンプルから認証用特徴量を逐次計算するクラス
+
+    pair_extractionと同じ範囲のサンプルのみを統計量に渡すため、
+    範囲に含まれることが確定するまでサンプルを保留する
+    両デバイスの区間が終わった時点で特徴量がほぼ計算済みになる
+    """
+
+    def __init__(self, used_features: list[str] = None, alpha: float = 0.8):
+        self.devices = [OnlineDeviceFeatures(used_features, alpha) for _ in range(2)]
+        self.times: list[list[int]] = [[], []]
+        self.rows: list[list[list[float]]] = [[], []]
+        # Number of samples of each device passed to the statistics,
+        # counted from the segment start
+        self.committed = [0, 0]
+        self.start_idx = [None, None]
+        self.finished = [False, False]
+        self.feature = None
+        self._lock = Lock()
+
+    def push(self, device_idx: int, time_ns: int, row: list[float]):
+        # Samples of the motion segment of a device in order
+        with self._lock:
+            if self.finished[device_idx]:
+                raise ValueError(f"Segment of device {device_idx} is already finished")
+            self.times[device_idx].append(time_ns)
+            self.rows[device_idx].append(row)
+            self._commit()
+
+    def finish(self, device_idx: int):
+        with self._lock:
+            self.finished[device_idx] = True
+            self._commit()
+
+    def _commit_until(self, device_idx: int, end: int):
+        device = self.devices[device_idx]
+        rows = self.rows[device_idx]
+        while self.committed[device_idx] < end:
+            device.push(rows[self.committed[device_idx]])
+            # Committed rows are not needed anymore
+            rows[self.committed[device_idx]] = None
+            self.committed[device_idx] += 1
+
+    def _set_start(self, device_idx: int, start_idx: int):
+        self.start_idx[device_idx] = start_idx
+        self.committed[device_idx] = start_idx
+
+    def _commit(self):
+        if not (self.times[0] and self.times[1]):
+            return
+        if all(self.finished):
+            if self.feature is None:
+                self._finalize()
+            return
+
+        for device_idx, other_idx in [(0, 1), (1, 0)]:
+            times = self.times[device_idx]
+            other_times = self.times[other_idx]
+            if self.start_idx[device_idx] is None:
+                # The later start of both devices is the start of the pair
+                if times[0] >= other_times[0]:
+                    self._set_start(device_idx, 0)
+                elif times[-1] >= other_times[0]:
+                    # The nearest sample does not change once a later sample exists
+                    self._set_start(
+                        device_idx,
+                        search_near_time_idx_ns(other_times[0], np.array(times)),
+                    )
+                else:
+                    continue
+            # The segment of the other device ends at or after its latest sample,
+            # so a sample is in the pair range if a
+            # later timestamp up to that sample exists
+            latest = self.committed[device_idx]
+            while latest + 1 < len(times) and times[latest + 1] <= other_times[-1]:
+                latest += 1
+            end = latest
+            while end > self.committed[device_idx] and times[end - 1] == times[latest]:
+                end -= 1
+            self._commit_until(device_idx, end)
+
+    def _finalize(self):
+        start_idx1, end_idx1, start_idx2, end_idx2 = pair_extraction_idx(
+            np.array(self.times[0]), np.array(self.times[1])
+        )
+        features = []
+        for device_idx, (start, end) in enumerate(
+            [(start_idx1, end_idx1), (start_idx2, end_idx2)]
+        ):
+            if self.start_idx[device_idx] is None:
+                self._set_start(device_idx, start)
+            if self.start_idx[device_idx] != start or self.committed[device_idx] > end:
+                raise RuntimeError("Committed samples are out of the pair range")
+            self._commit_until(device_idx, end)
+            features.append(self.devices[device_idx].finalize())
+        self.feature = pd.DataFrame(
+            fuse_arrays(*features, FusionMode.FEATURE_MEAN)[None, :],
+            columns=self.devices[0].names,
+        )
+
+    def result(self) -> pd.DataFrame:
+        # Same columns as authentication_features, None until both segments are finished
+        with self._lock:
+            return self.feature
+
+    def committed_samples(self) -> int:
+        # Samples of the pair range passed to the statistics,
+        # the smaller count of both devices
+        with self._lock:
+            return min(self.devices[device_idx].stats.count for device_idx in range(2))
+
+    def snapshot(self) -> pd.DataFrame:
+        # Features of the prefix of the pair range passed to the statistics so far
+        with self._lock:
+            if self.feature is not None:
+                return self.feature
+            return pd.DataFrame(
+                fuse_arrays(
+                    self.devices[0].features(),
+                    self.devices[1].features(),
+                    FusionMode.FEATURE_MEAN,
+                )[None, :],
+                columns=self.devices[0].names,
+            )
+
+    def end_time_ns(self) -> int:
+        # Timestamp of the last sample of the pair range,
+        # None until both segments are finished
+        with self._lock:
+            if not all(self.finished):
+                return None
+            return max(times[-1] for times in self.times)
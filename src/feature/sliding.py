@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from preprocess.pair_data_extraction import search_near_time_idxs_ns
+from preprocess.batch import (
+    SegmentBatch,
+    append_l2norm_batch,
+    removal_gravitational_acceleration_batch,
+)
+from .batch import extract_stats_batch
+from .fusion import FusionMode, fuse_arrays
+
+
+def window_starts(
+    time1_ns: np.ndarray, time2_ns: np.ndarray, window: int, hop: int
+) -> tuple[np.ndarray, np.ndarray]:
+    # Windows of device1 every hop samples and the
+    # device2 samples nearest to their starts.
+    # Windows that are not covered by both devices are left out.
+    if len(time1_ns) < window or len(time2_ns) < window:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts1 = np.arange(0, len(time1_ns) - window + 1, hop)
+    ref_times = time1_ns[starts1]
+    starts2 = search_near_time_idxs_ns(ref_times, time2_ns)
+    valid = (
+        (ref_times >= time2_ns[0])
+        & (ref_times <= time2_ns[-1])
+        & (starts2 + window <= len(time2_ns))
+    )
+    return starts1[valid], starts2[valid]
+
+
+def _window_batch(values: np.ndarray, starts: np.ndarray, window: int) -> np.ndarray:
+    # (channels, samples) -> (channels, windows * window)
+    # without copying the samples per window first
+    windows = sliding_window_view(values, window, axis=1)[:, starts]
+    return windows.reshape(values.shape[0], -1)
+
+
+def window_pair_features(
+    values1: np.ndarray,
+    values2: np.ndarray,
+    starts1: np.ndarray,
+    starts2: np.ndarray,
+    window: int,
+    channels: list[str],
+    used_features: list[str] = None,
+) -> tuple[list[str], np.ndarray]:
+    # Authentication features
+    # (gravity removal, l2 norm, FEATURE_MEAN) of every window pair.
+    # Every window is preprocessed on its own
+    # like a motion segment, as one ragged batch.
+    offsets = np.arange(len(starts1) + 1, dtype=np.int64) * window
+    device_features = []
+    for values, starts in [(values1, starts1), (values2, starts2)]:
+        batch = SegmentBatch(_window_batch(values, starts, window), offsets, channels)
+        batch = append_l2norm_batch(removal_gravitational_acceleration_batch(batch))
+        names, feature = extract_stats_batch(
+            batch.values, batch.offsets, batch.channels, used_features
+        )
+        device_features.append(feature)
+    return names, fuse_arrays(*device_features, FusionMode.FEATURE_MEAN)
+
+
+def sliding_window_features(
+    time1_ns: np.ndarray,
+    values1: np.ndarray,
+    time2_ns: np.ndarray,
+    values2: np.ndarray,
+    channels: list[str],
+    window: int,
+    hop: int,
+    used_features: list[str] = None,
+    chunk_windows: int = 256,
+):
+    # Yields (start time, end time, feature DataFrame)
+    # for chunks of at most chunk_windows windows,
+    # so that the memory does not grow with the length of the recording
+    starts1, starts2 = window_starts(time1_ns, time2_ns, window, hop)
+    for chunk_start in range(0, len(starts1), chunk_windows):
+        chunk1 = starts1[chunk_start : chunk_start + chunk_windows]
+        chunk2 = starts2[chunk_start : chunk_start + chunk_windows]
+        names, feature = window_pair_features(
+            values1, values2, chunk1, chunk2, window, channels, used_features
+        )
+        yield (
+            time1_ns[chunk1],
+            time1_ns[chunk1 + window - 1],
+            pd.DataFrame(feature, columns=names),
+        )
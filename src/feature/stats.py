@@ -0,0 +1,130 @@
+import numpy as np
+
+# Same statistics as the tsfresh feature calculators used by wrap_extract_features.
+# Every function takes (channels, samples) and returns (channels,).
+
+# Upper bound of the distance matrices of sample_entropy calculated at once
+SAMPLE_ENTROPY_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def maximum(values: np.ndarray) -> np.ndarray:
+    return values.max(axis=-1)
+
+
+def minimum(values: np.ndarray) -> np.ndarray:
+    return values.min(axis=-1)
+
+
+def median(values: np.ndarray) -> np.ndarray:
+    return np.median(values, axis=-1)
+
+
+def skewness(values: np.ndarray) -> np.ndarray:
+    # Adjusted Fisher-Pearson coefficient, computed like pandas.Series.skew
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    count = float(values.shape[-1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = values.sum(axis=-1, dtype=np.float64) / count
+    adjusted = values - mean[:, None]
+    adjusted2 = adjusted**2
+    adjusted3 = adjusted2 * adjusted
+    m2 = adjusted2.sum(axis=-1, dtype=np.float64)
+    m3 = adjusted3.sum(axis=-1, dtype=np.float64)
+
+    # Moments within the floating point error of a constant series are 0
+    max_abs = np.abs(values).max(axis=-1, initial=0.0)
+    eps = np.finfo(np.float64).eps
+    m2 = np.where(np.abs(m2) < ((eps * max_abs) ** 2) * count, 0, m2)
+    m3 = np.where(np.abs(m3) < ((eps * max_abs) ** 3) * count, 0, m3)
+
+    # The vectorized power differs from the scalar one in the last bit,
+    # so the coefficient is calculated per channel like pandas does for a Series
+    count = np.float64(count)
+    result = np.empty(len(m2))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i in range(len(m2)):
+            result[i] = (count * (count - 1) ** 0.5 / (count - 2)) * (
+                m3[i] / m2[i] ** 1.5
+            )
+    result = np.where(m2 == 0, 0, result)
+    if count < 3:
+        result[:] = np.nan
+    return result
+
+
+def _sample_entropy_1d(x: np.ndarray, m: int = 2) -> float:
+    n = len(x)
+    # A series of at most m samples has no pair of templates of length m + 1
+    if n <= m or np.isnan(x).any():
+        return np.nan
+    tolerance = 0.2 * np.std(x)
+    # Templates are compared a block of rows at a time, so that the distance matrix
+    # stays within SAMPLE_ENTROPY_CHUNK_BYTES for long recordings
+    rows_per_chunk = max(1, SAMPLE_ENTROPY_CHUNK_BYTES // (8 * n))
+    b = 0
+    a = 0
+    for lo in range(0, n - m + 1, rows_per_chunk):
+        hi = min(lo + rows_per_chunk, n - m + 1)
+        # Chebyshev distance of templates of length m,
+        # then m + 1, from shifted differences
+        template_distance = np.abs(x[lo:hi, None] - x[None, : n - m + 1])
+        for k in range(1, m):
+            template_distance = np.maximum(
+                template_distance,
+                np.abs(x[lo + k : hi + k, None] - x[None, k : n - m + 1 + k]),
+            )
+        b += np.sum(template_distance <= tolerance)
+        hi = min(hi, n - m)
+        if lo < hi:
+            template_distance = np.maximum(
+                template_distance[: hi - lo, : n - m],
+                np.abs(x[lo + m : hi + m, None] - x[None, m:]),
+            )
+            a += np.sum(template_distance <= tolerance)
+    # Self matches on the diagonal are not counted
+    b -= n - m + 1
+    a -= n - m
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return -np.log(a / b)
+
+
+def sample_entropy(values: np.ndarray) -> np.ndarray:
+    return np.array([_sample_entropy_1d(row) for row in values], dtype=float)
+
+
+FEATURE_STAT_FUNCTIONS = {
+    "maximum": maximum,
+    "minimum": minimum,
+    "median": median,
+    "sample_entropy": sample_entropy,
+    "skewness": skewness,
+}
+
+
+def extract_stats(
+    values: np.ndarray,
+    channels: list[str],
+    used_features: list[str] = None,
+) -> tuple[list[str], np.ndarray]:
+    # Returns feature names "{channel}__{stat}" in the
+    # order of wrap_extract_features and their values.
+    # When used_features is given,
+    # only these features are calculated and the others are 0.
+    stats = list(FEATURE_STAT_FUNCTIONS.keys())
+    names = [f"{channel}__{stat}" for channel in channels for stat in stats]
+    feature = np.zeros((len(channels), len(stats)))
+    if used_features is None:
+        for stat_idx, stat in enumerate(stats):
+            feature[:, stat_idx] = FEATURE_STAT_FUNCTIONS[stat](values)
+        return names, feature.reshape(-1)
+
+    used = set(used_features)
+    for stat_idx, stat in enumerate(stats):
+        channel_idx = [
+            i for i, channel in enumerate(channels) if f"{channel}__{stat}" in used
+        ]
+        if channel_idx:
+            feature[channel_idx, stat_idx] = FEATURE_STAT_FUNCTIONS[stat](
+                values[channel_idx]
+            )
+    return names, feature.reshape(-1)
@@ -0,0 +1,61 @@
+import os
+from glob import glob
+
+import pandas as pd
+
+from util.file import atomic_write
+
+PairKey = tuple[str, str]
+
+
+class FeatureStore:
+    """
+    ペアごとの特徴量を永続化するクラス
+
+    追加登録時に既存ペアの特徴量を再抽出せずに済むようにする
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def path(self, pair: PairKey) -> str:
+        return os.path.join(self.store_dir, f"{pair[0]}_and_{pair[1]}{self.suffix}")
+
+    def pairs(self) -> list[PairKey]:
+        pairs = []
+        for path in sorted(glob(os.path.join(self.store_dir, "*" + self.suffix))):
+            name = os.path.basename(path)[: -len(self.suffix)]
+            user1_name, user2_name = name.split("_and_")
+            pairs.append((user1_name, user2_name))
+        return pairs
+
+    def __contains__(self, pair: PairKey) -> bool:
+        return os.path.exists(self.path(pair))
+
+    def __len__(self) -> int:
+        return len(self.pairs())
+
+    def save(self, pair: PairKey, feat: pd.DataFrame):
+        with atomic_write(self.path(pair)) as f:
+            feat.reset_index(drop=True).to_pickle(f)
+
+    def load(self, pair: PairKey) -> pd.DataFrame:
+        if pair not in self:
+            raise KeyError(f"Features of pair {pair} are not stored")
+        return pd.read_pickle(self.path(pair))
+
+    def load_all(self, exclude: list[PairKey] = ()) -> tuple[pd.DataFrame, list]:
+        feat_list = []
+        pair_list = []
+        for pair in self.pairs():
+            if pair in exclude:
+                continue
+            feat = self.load(pair)
+            feat_list.append(feat)
+            pair_list += [pair] * len(feat)
+        if not feat_list:
+            return pd.DataFrame(), pair_list
+        return pd.concat(feat_list, axis=0, ignore_index=True), pair_list
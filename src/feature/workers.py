@@ -0,0 +1,79 @@
+import atexit
+from threading import Lock
+
+from tsfresh.utilities.distribution import (
+    DistributorBaseClass,
+    MapDistributor,
+    MultiprocessingDistributor,
+)
+
+
+class PersistentDistributor(MultiprocessingDistributor):
+    """
+    tsfreshの呼び出しごとに閉じずに使い回すマルチプロセスの分散器
+
+    tsfreshはmap_reduceの最後にclose()を呼ぶため、プールはshutdown()でのみ終了する
+    """
+
+    def __init__(self, n_workers: int):
+        super().__init__(n_workers, disable_progressbar=True, show_warnings=False)
+        # Wait until every worker process is up so
+        # that the first call does not pay for it
+        self.pool.map(abs, range(n_workers))
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+# Workers of the tsfresh feature extraction, shared by every call in the process.
+# n_jobs 0 or 1 calculates in the calling process without a pool.
+_n_jobs = 0
+_chunk_size = None
+_distributor: DistributorBaseClass = None
+_lock = Lock()
+
+
+def configure_feature_workers(
+    n_jobs: int = 0, chunk_size: int = None, warm: bool = True
+):
+    # The previous pool is shut down, the new one is started now if warm is True.
+    # With the same settings the running pool is kept.
+    global _n_jobs, _chunk_size
+    if _distributor is not None and (n_jobs, chunk_size) == (_n_jobs, _chunk_size):
+        return
+    shutdown_feature_workers()
+    with _lock:
+        _n_jobs = n_jobs
+        _chunk_size = chunk_size
+    if warm:
+        get_distributor()
+
+
+def get_distributor() -> DistributorBaseClass:
+    global _distributor
+    with _lock:
+        if _distributor is None:
+            if _n_jobs > 1:
+                _distributor = PersistentDistributor(_n_jobs)
+            else:
+                _distributor = MapDistributor(disable_progressbar=True)
+        return _distributor
+
+
+def get_chunk_size() -> int:
+    # Number of time series handed to a worker at once, None lets tsfresh decide
+    return _chunk_size
+
+
+def shutdown_feature_workers():
+    global _distributor
+    with _lock:
+        distributor, _distributor = _distributor, None
+    if isinstance(distributor, PersistentDistributor):
+        distributor.shutdown()
+
+
+atexit.register(shutdown_feature_workers)
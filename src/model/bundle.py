@@ -0,0 +1,107 @@
+import os
+import json
+from typing import Optional
+
+import joblib
+
+from util.file import atomic_write
+from .load import load_model_file, model_filename
+
+PairKey = tuple[str, str]
+FeatureSet = tuple[list[str], list[str]]
+
+
+class ModelBundle:
+    """
+    ペアごとのモデルをまとめて管理するディレクトリ
+
+    モデルファイルはmodel_filename()の命名規則で保存されるため、ModelRegistryのmodel_dirとしてそのまま使える
+    """
+
+    manifest_filename = "bundle.json"
+
+    def __init__(self, bundle_dir: str, modelname: str):
+        self.bundle_dir = bundle_dir
+        self.modelname = modelname
+        self.manifest_path = os.path.join(bundle_dir, self.manifest_filename)
+        self.entries: dict[PairKey, dict] = {}
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest["modelname"] != modelname:
+                raise ValueError(
+                    "Bundle model type does not match: "
+                    f"bundle: {manifest['modelname']}, requested: {modelname}"
+                )
+            for entry in manifest["pairs"]:
+                self.entries[(entry["user1"], entry["user2"])] = entry
+
+    def pairs(self) -> list[PairKey]:
+        return list(self.entries.keys())
+
+    def __contains__(self, pair: PairKey) -> bool:
+        return pair in self.entries
+
+    def model_path(self, pair: PairKey) -> str:
+        return os.path.join(self.bundle_dir, model_filename(self.modelname, *pair))
+
+    def load(self, pair: PairKey, mmap_mode: str = None) -> object:
+        if pair not in self.entries:
+            raise KeyError(f"Pair {pair} is not enrolled in the bundle")
+        return load_model_file(self.model_path(pair), mmap_mode)
+
+    def threshold(self, pair: PairKey, default: float = None) -> float:
+        return self.entries.get(pair, {}).get("threshold", default)
+
+    def thresholds(self) -> dict[PairKey, float]:
+        return {
+            pair: entry["threshold"]
+            for pair, entry in self.entries.items()
+            if entry.get("threshold") is not None
+        }
+
+    def feature_set(self, pair: PairKey) -> Optional[FeatureSet]:
+        # (input columns of the model, columns the model actually splits on)
+        entry = self.entries.get(pair, {})
+        if entry.get("features") is None:
+            return None
+        return entry["features"], entry["used_features"]
+
+    def feature_sets(self) -> dict[PairKey, FeatureSet]:
+        return {
+            pair: self.feature_set(pair)
+            for pair in self.entries
+            if self.feature_set(pair) is not None
+        }
+
+    def save(
+        self,
+        models: dict[PairKey, object],
+        thresholds: dict[PairKey, float] = None,
+        feature_sets: dict[PairKey, FeatureSet] = None,
+    ):
+        # Every model file is replaced atomically and the manifest is written last,
+        # so a reader never sees a pair whose model file is incomplete
+        thresholds = thresholds or {}
+        feature_sets = feature_sets or {}
+        for pair, classifier in models.items():
+            with atomic_write(self.model_path(pair)) as f:
+                joblib.dump(classifier, f)
+            entry = self.entries.get(pair, {"user1": pair[0], "user2": pair[1]})
+            entry["file"] = model_filename(self.modelname, *pair)
+            if pair in thresholds:
+                entry["threshold"] = float(thresholds[pair])
+            if pair in feature_sets:
+                entry["features"] = list(feature_sets[pair][0])
+                entry["used_features"] = list(feature_sets[pair][1])
+            self.entries[pair] = entry
+        self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            "modelname": self.modelname,
+            "pairs": list(self.entries.values()),
+        }
+        with atomic_write(self.manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
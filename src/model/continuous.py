@@ -0,0 +1,224 @@
+import queue
+from threading import Lock, Thread
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from preprocess.arrays import SENSOR_CHANNELS, SensorArray
+from preprocess.pair_data_extraction import search_near_time_idx_ns
+from feature.sliding import sliding_window_features, window_pair_features
+
+
+def make_score_func(
+    classifier: object, feature_set: tuple[list[str], list[str]] = None
+) -> Callable[[pd.DataFrame], np.ndarray]:
+    # Probability of the target pair for every feature row,
+    # in the column order of the model
+    def score_func(feature: pd.DataFrame) -> np.ndarray:
+        if feature_set is not None:
+            feature = feature.loc[:, feature_set[0]]
+        return classifier.predict_proba(feature)[:, 1]
+
+    return score_func
+
+
+def score_recording(
+    device1_data: pd.DataFrame,
+    device2_data: pd.DataFrame,
+    score_func: Callable[[pd.DataFrame], np.ndarray],
+    window: int,
+    hop: int,
+    used_features: list[str] = None,
+    chunk_windows: int = 256,
+) -> pd.DataFrame:
+    # Score of every window of a recorded pair,
+    # score_func returns the scores of feature rows
+    device1_array = SensorArray.from_dataframe(device1_data)
+    device2_array = SensorArray.from_dataframe(device2_data)
+    results = []
+    for start_time, end_time, feature in sliding_window_features(
+        device1_array.time,
+        device1_array.values,
+        device2_array.time,
+        device2_array.values,
+        device1_array.channels,
+        window,
+        hop,
+        used_features,
+        chunk_windows,
+    ):
+        results.append(
+            pd.DataFrame(
+                {
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "score": score_func(feature),
+                }
+            )
+        )
+    if not results:
+        return pd.DataFrame(columns=["start_time", "end_time", "score"])
+    return pd.concat(results, ignore_index=True)
+
+
+class _SampleRing:
+    """
+    最新のサンプルを固定長で保持するリングバッファ
+    """
+
+    def __init__(self, capacity: int, n_channels: int):
+        self.capacity = capacity
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((n_channels, capacity))
+        # Number of samples appended so far,
+        # sample i is at i % capacity while it is kept
+        self.count = 0
+
+    def append(self, time_ns: int, row: list[float]):
+        position = self.count % self.capacity
+        self.time[position] = time_ns
+        self.values[:, position] = row
+        self.count += 1
+
+    @property
+    def oldest(self) -> int:
+        return max(self.count - self.capacity, 0)
+
+    def times(self, start: int, end: int) -> np.ndarray:
+        return self.time[np.arange(start, end) % self.capacity]
+
+    def window(self, start: int, window: int) -> np.ndarray:
+        return self.values[:, np.arange(start, start + window) % self.capacity]
+
+
+class SlidingWindowAuthenticator:
+    """
+    2デバイスのサンプル列に窓をずらしながら認証スコアを出し続けるクラス
+
+    device1の窓をhopサンプルごとに切り出し、開始時刻が最も近いdevice2の窓と組にする
+    サンプルはリングバッファに、未処理の窓は上限付きのキューに保持するためメモリは一定で、
+    スコア計算が追いつかない場合は古い窓から捨てる
+    スコア計算は別スレッドでキューに溜まった窓をまとめて行う
+    """
+
+    def __init__(
+        self,
+        score_func: Callable[[pd.DataFrame], np.ndarray],
+        on_score: Callable[[int, int, float], None],
+        window: int,
+        hop: int,
+        used_features: list[str] = None,
+        max_pending_windows: int = 8,
+        channels: list[str] = SENSOR_CHANNELS,
+    ):
+        # on_score(window start time, window end time, score) with times of device1
+        self.score_func = score_func
+        self.on_score = on_score
+        self.window = window
+        self.hop = hop
+        self.used_features = used_features
+        self.channels = channels
+        # device2 may run ahead of or behind device1 by up to one window
+        capacity = 2 * window + hop
+        self.rings = [_SampleRing(capacity, len(channels)) for _ in range(2)]
+        self.next_start = 0
+        self.pending = queue.Queue(maxsize=max_pending_windows)
+        self.dropped_windows = 0
+        self.skipped_windows = 0
+        self._lock = Lock()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._stopped = False
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._put(None)
+        self._thread.join()
+
+    def push(self, device_idx: int, time_ns: int, row: list[float]):
+        with self._lock:
+            self.rings[device_idx].append(time_ns, row)
+            self._cut_windows()
+
+    def _cut_windows(self):
+        ring1, ring2 = self.rings
+        while ring1.count >= self.next_start + self.window:
+            start1 = self.next_start
+            if start1 < ring1.oldest:
+                # device2 lagged so long that the samples of device1 were overwritten
+                self.skipped_windows += 1
+                self.next_start += self.hop
+                continue
+            ref_time = ring1.times(start1, start1 + 1)[0]
+            if (
+                ring2.count == 0
+                or ring2.times(ring2.count - 1, ring2.count)[0] < ref_time
+            ):
+                # The nearest sample of device2 is not decided yet
+                return
+            oldest2 = ring2.oldest
+            times2 = ring2.times(oldest2, ring2.count)
+            if ref_time < times2[0]:
+                self.skipped_windows += 1
+                self.next_start += self.hop
+                continue
+            start2 = oldest2 + search_near_time_idx_ns(ref_time, times2)
+            if ring2.count < start2 + self.window:
+                return
+            self._put(
+                (
+                    ref_time,
+                    ring1.times(start1 + self.window - 1, start1 + self.window)[0],
+                    ring1.window(start1, self.window),
+                    ring2.window(start2, self.window),
+                )
+            )
+            self.next_start += self.hop
+
+    def _put(self, item):
+        while True:
+            try:
+                self.pending.put_nowait(item)
+                return
+            except queue.Full:
+                # The oldest window is dropped to keep the latency bounded
+                try:
+                    self.pending.get_nowait()
+                    self.dropped_windows += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            items = [self.pending.get()]
+            # Windows that piled up while scoring are scored in one batch
+            while True:
+                try:
+                    items.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            windows = [item for item in items if item is not None]
+            if windows:
+                self._score(windows)
+            if self._stopped and None in items:
+                return
+
+    def _score(self, windows: list[tuple]):
+        window_starts = np.arange(len(windows)) * self.window
+        values1 = np.concatenate([w[2] for w in windows], axis=1)
+        values2 = np.concatenate([w[3] for w in windows], axis=1)
+        names, feature = window_pair_features(
+            values1,
+            values2,
+            window_starts,
+            window_starts,
+            self.window,
+            self.channels,
+            self.used_features,
+        )
+        scores = self.score_func(pd.DataFrame(feature, columns=names))
+        for (start_time, end_time, _, _), score in zip(windows, scores):
+            self.on_score(int(start_time), int(end_time), float(score))
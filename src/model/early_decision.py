@@ -0,0 +1,117 @@
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class Decision(Enum):
+    ACCEPT = 0
+    REJECT = 1
+    CONTINUE = 2
+
+
+@dataclass
+class CheckpointBounds:
+    """
+    チェックポイントごとの受理・棄却境界
+
+    各チェックポイントのスコアpの対数オッズlog(p / (1 - p))を、
+    log((1 - β_k) / α_k)以上で受理、log(β_k / (1 - α_k))以下で棄却する
+    複数回判定するため、α_k = α / n_checkpoints、β_k = β / n_checkpointsとして誤り率を分配する
+    スコアは較正されておらず、途中までの特徴量は学習時の分布と異なるため、
+    αとβは目安であり、実際の他人受理率・本人拒否率を保証しない
+    """
+
+    false_accept_rate: float = 0.01
+    false_reject_rate: float = 0.05
+    n_checkpoints: int = 1
+
+    def __post_init__(self):
+        alpha = self.false_accept_rate
+        beta = self.false_reject_rate
+        if not (0 < alpha < 1 and 0 < beta < 1 and alpha + beta < 1):
+            raise ValueError(f"Invalid error rates: alpha={alpha}, beta={beta}")
+        if self.n_checkpoints < 1:
+            raise ValueError(f"Invalid number of checkpoints: {self.n_checkpoints}")
+        # Union bound over the looks, each checkpoint gets an equal share of the rates
+        alpha /= self.n_checkpoints
+        beta /= self.n_checkpoints
+        self.accept_log_odds = np.log((1 - beta) / alpha)
+        self.reject_log_odds = np.log(beta / (1 - alpha))
+
+    def decide(self, score: float) -> Decision:
+        # Only the score of this checkpoint is compared, nothing is accumulated
+        score = float(np.clip(score, 1e-12, 1 - 1e-12))
+        log_odds = np.log(score / (1 - score))
+        if log_odds >= self.accept_log_odds:
+            return Decision.ACCEPT
+        if log_odds <= self.reject_log_odds:
+            return Decision.REJECT
+        return Decision.CONTINUE
+
+
+@dataclass
+class Checkpoint:
+    n_samples: int
+    score: float
+    decision: Decision
+    decided_at_ns: int
+
+
+@dataclass
+class EarlyDecisionSession:
+    """
+    動作区間の途中までの特徴量でチェックポイントごとに認証スコアを計算し、
+    境界を越えた時点で判定を確定するクラス
+
+    モデルは動作区間全体の特徴量で学習されているため、境界は通常の閾値より厳しく設定する
+    """
+
+    # online_features: feature.online.OnlinePairFeatures that is fed during sampling
+    online_features: object
+    score_func: Callable[[pd.DataFrame], float]
+    checkpoints: list[int]
+    bounds: CheckpointBounds = field(default_factory=CheckpointBounds)
+    history: list[Checkpoint] = field(default_factory=list)
+    decision: Optional[Checkpoint] = None
+
+    def __post_init__(self):
+        self.checkpoints = sorted(self.checkpoints)
+        self._next_checkpoint = 0
+
+    def poll(self) -> Optional[Checkpoint]:
+        # Scores the prefix when a checkpoint is reached
+        # and returns the checkpoint once decided
+        if self.decision is not None:
+            return self.decision
+        n_samples = self.online_features.committed_samples()
+        if (
+            self._next_checkpoint >= len(self.checkpoints)
+            or n_samples < self.checkpoints[self._next_checkpoint]
+        ):
+            return None
+        # Checkpoints that were passed between two polls are scored once
+        while (
+            self._next_checkpoint < len(self.checkpoints)
+            and n_samples >= self.checkpoints[self._next_checkpoint]
+        ):
+            self._next_checkpoint += 1
+
+        score = self.score_func(self.online_features.snapshot())
+        checkpoint = Checkpoint(
+            n_samples, score, self.bounds.decide(score), time.monotonic_ns()
+        )
+        self.history.append(checkpoint)
+        if checkpoint.decision != Decision.CONTINUE:
+            self.decision = checkpoint
+        return self.decision
+
+    def time_saved_sec(self) -> Optional[float]:
+        # Time between the early decision and the end of the handshake
+        end_time_ns = self.online_features.end_time_ns()
+        if self.decision is None or end_time_ns is None:
+            return None
+        return max(end_time_ns - self.decision.decided_at_ns, 0) / 1e9
@@ -0,0 +1,179 @@
+import copy
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+from sklearn.ensemble import RandomForestClassifier
+from lightgbm import LGBMClassifier
+from xgboost import XGBClassifier
+
+from feature.store import FeatureStore
+from .bundle import ModelBundle
+from .load import ModelType, load_model
+from .threshold import calibrate_threshold, fit_with_held_out_scores
+from .importance import used_features
+
+PairKey = tuple[str, str]
+
+
+def continue_training(
+    classifier: object,
+    feat: pd.DataFrame,
+    label_list: list[int],
+    additional_estimators: int = 50,
+) -> object:
+    # Add estimators fitted on the new data to an already trained model.
+    # Returns None when the model type cannot be trained incrementally.
+    if isinstance(classifier, LGBMClassifier):
+        updated = LGBMClassifier(**classifier.get_params())
+        updated.set_params(n_estimators=additional_estimators)
+        updated.fit(feat, label_list, init_model=classifier.booster_)
+        return updated
+    elif isinstance(classifier, XGBClassifier):
+        updated = XGBClassifier(**classifier.get_params())
+        updated.set_params(n_estimators=additional_estimators)
+        updated.fit(feat, label_list, xgb_model=classifier.get_booster())
+        return updated
+    elif isinstance(classifier, RandomForestClassifier):
+        # Keep the original model intact because it may still be cached for inference
+        updated = copy.deepcopy(classifier)
+        updated.set_params(
+            warm_start=True,
+            n_estimators=classifier.n_estimators + additional_estimators,
+        )
+        updated.fit(feat, label_list)
+        return updated
+    return None
+
+
+def _held_out_update_scores(
+    classifier: object,
+    feat: pd.DataFrame,
+    label_list: list[int],
+    additional_estimators: int = 50,
+    cv_folds: int = 5,
+) -> np.ndarray:
+    # Scores of every sample from continue_training on the other folds.
+    # The base model has seen the stored samples, only the update is held out.
+    label_array = np.asarray(label_list)
+    scores = np.empty(len(label_array))
+    cv = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=0)
+    for train_idx, test_idx in cv.split(feat, label_array):
+        updated = continue_training(
+            classifier,
+            feat.iloc[train_idx],
+            label_array[train_idx].tolist(),
+            additional_estimators,
+        )
+        scores[test_idx] = updated.predict_proba(feat.iloc[test_idx])[:, 1]
+    return scores
+
+
+def _fit_new_model(
+    modelname: Union[str, ModelType],
+    positive_feat: pd.DataFrame,
+    negative_feat: pd.DataFrame,
+    target_far: float = None,
+    cv_folds: int = 5,
+) -> tuple[object, float]:
+    feat = pd.concat([positive_feat, negative_feat], axis=0, ignore_index=True)
+    label_list = [1] * len(positive_feat) + [0] * len(negative_feat)
+    classifier, held_out_scores, held_out_labels = fit_with_held_out_scores(
+        load_model(None, modelname), feat, label_list, cv_folds
+    )
+    threshold = calibrate_threshold(held_out_labels, held_out_scores, target_far)
+    return classifier, threshold
+
+
+def enroll_pair(
+    pair: PairKey,
+    feat: pd.DataFrame,
+    feature_store: FeatureStore,
+    bundle: ModelBundle,
+    additional_estimators: int = 50,
+    update_existing: bool = True,
+    target_far: float = None,
+    cv_folds: int = 5,
+) -> list[PairKey]:
+    """
+    ペアを追加登録する
+
+    新しいペアのモデルのみを学習し、
+    既存ペアのモデルは新しいペアを含む他の全ペアのデータを他人として追加学習する
+    追加学習したモデルの閾値は、追加学習を交差検証したスコアで再調整する
+    戻り値は更新されたモデルのペア一覧
+    """
+    negative_feat, _ = feature_store.load_all(exclude=[pair])
+    if negative_feat.empty:
+        raise ValueError(
+            "The feature store has no other pairs. "
+            "Please store features of at least one other pair first"
+        )
+    negative_feat = negative_feat.reindex(columns=feat.columns)
+
+    classifier, threshold = _fit_new_model(
+        bundle.modelname, feat, negative_feat, target_far, cv_folds
+    )
+    updated_models = {pair: classifier}
+    thresholds = {pair: threshold}
+
+    if update_existing:
+        for existing_pair in bundle.pairs():
+            if existing_pair == pair:
+                continue
+            existing_feat = feature_store.load(existing_pair).reindex(
+                columns=feat.columns
+            )
+            # All other pairs are impostors, the new pair's sessions included
+            other_feat, other_pair_list = feature_store.load_all(
+                exclude=[existing_pair]
+            )
+            other_feat = pd.concat(
+                [other_feat.reindex(columns=feat.columns)]
+                + ([] if pair in other_pair_list else [feat]),
+                axis=0,
+                ignore_index=True,
+            )
+            update_feat = pd.concat(
+                [existing_feat, other_feat], axis=0, ignore_index=True
+            )
+            update_label_list = [1] * len(existing_feat) + [0] * len(other_feat)
+            base_classifier = bundle.load(existing_pair)
+            updated = continue_training(
+                base_classifier,
+                update_feat,
+                update_label_list,
+                additional_estimators,
+            )
+            if updated is None:
+                # e.g. SVM has no warm start, so it is refitted on the whole store
+                updated, thresholds[existing_pair] = _fit_new_model(
+                    bundle.modelname,
+                    existing_feat,
+                    other_feat,
+                    target_far,
+                    cv_folds,
+                )
+            else:
+                # The added estimators change the score distribution
+                thresholds[existing_pair] = calibrate_threshold(
+                    update_label_list,
+                    _held_out_update_scores(
+                        base_classifier,
+                        update_feat,
+                        update_label_list,
+                        additional_estimators,
+                        cv_folds,
+                    ),
+                    target_far,
+                )
+            updated_models[existing_pair] = updated
+
+    feature_sets = {
+        updated_pair: (list(feat.columns), used_features(model, feat.columns))
+        for updated_pair, model in updated_models.items()
+    }
+    bundle.save(updated_models, thresholds, feature_sets)
+    feature_store.save(pair, feat)
+    return list(updated_models.keys())
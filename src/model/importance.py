@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from lightgbm import LGBMClassifier
+from xgboost import XGBClassifier
+
+from .threshold import fit_with_held_out_scores
+
+
+def used_features(classifier: object, feature_names: list[str]) -> list[str]:
+    # Features that appear in at least one split of the trained model.
+    # Predictions do not depend on the other features, so they can be left at any value.
+    feature_names = list(feature_names)
+    if isinstance(classifier, LGBMClassifier):
+        split_count = classifier.booster_.feature_importance(importance_type="split")
+        used_idx = np.flatnonzero(split_count > 0)
+    elif isinstance(classifier, XGBClassifier):
+        booster = classifier.get_booster()
+        score = booster.get_score(importance_type="weight")
+        booster_names = booster.feature_names or [
+            f"f{i}" for i in range(len(feature_names))
+        ]
+        used_idx = [i for i, name in enumerate(booster_names) if name in score]
+    elif hasattr(classifier, "estimators_") and hasattr(
+        classifier.estimators_[0], "tree_"
+    ):
+        # Random forest: leaves are marked with a negative feature index
+        used = set()
+        for estimator in classifier.estimators_:
+            split_features = estimator.tree_.feature
+            used.update(split_features[split_features >= 0].tolist())
+        used_idx = sorted(used)
+    else:
+        # e.g. SVM uses every feature
+        return feature_names
+    return [feature_names[i] for i in used_idx]
+
+
+def prune_and_refit(
+    classifier: object,
+    feat: pd.DataFrame,
+    label_list: list[int],
+    cv_folds: int = 5,
+) -> tuple[object, np.ndarray, np.ndarray, list[str]]:
+    # Refit the model on the features the first model used.
+    # Returns the same values as fit_with_held_out_scores
+    # and the pruned feature columns.
+    feature_columns = used_features(classifier, feat.columns)
+    pruned_classifier, held_out_scores, held_out_labels = fit_with_held_out_scores(
+        clone(classifier),
+        feat.loc[:, feature_columns],
+        label_list,
+        cv_folds,
+    )
+    return pruned_classifier, held_out_scores, held_out_labels, feature_columns
@@ -1,7 +1,7 @@
 from enum import Enum
 from typing import Union
 
-import pickle
+import joblib
 from sklearn.svm import SVC
 from sklearn.ensemble import RandomForestClassifier
 from lightgbm import LGBMClassifier
@@ -25,17 +25,30 @@ def validate_modeltype(modelname: str):
         raise ValueError("Invalid model type")
 
 
+def model_filename(modelname: str, user1_name: str, user2_name: str) -> str:
+    return f"{modelname}_{user1_name}_and_{user2_name}.pickle"
+
+
+def load_model_file(model_path: str, mmap_mode: str = None) -> object:
+    # joblib can also read plain pickle files.
+    # numpy arrays are memory-mapped only if the file was written by joblib.dump
+    try:
+        classifer = joblib.load(model_path, mmap_mode=mmap_mode)
+    except FileNotFoundError:
+        raise FileNotFoundError("The parameter dictionary file does not exist")
+
+    # libsvm cannot predict from read-only memory-mapped arrays
+    if mmap_mode is not None and isinstance(classifer, SVC):
+        classifer = joblib.load(model_path)
+    return classifer
+
+
 def load_model(
     model_path: str, target_modelname: Union[str, ModelType] = "svm"
 ) -> object:
 
     if model_path:
-        try:
-            with open(model_path, "rb") as f:
-                classifer = pickle.load(f)
-                return classifer
-        except FileNotFoundError:
-            raise FileNotFoundError("The parameter dictionary file does not exist")
+        return load_model_file(model_path)
 
     if type(target_modelname) != ModelType:
         model_type = convert_modeltype(target_modelname)
@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from .bundle import FeatureSet, ModelBundle
+from .load import load_model_file, model_filename
+
+PairKey = tuple[str, str]
+
+
+@dataclass
+class RegistryStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    loads: int = 0
+    total_load_time: float = 0.0
+    max_load_time: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    @property
+    def mean_load_time(self) -> float:
+        return self.total_load_time / self.loads if self.loads else 0.0
+
+
+class _Entry:
+    def __init__(self, model: object, size: int):
+        self.model = model
+        self.size = size
+
+
+class ModelRegistry:
+    """
+    ペアごとの学習済みモデルを管理するクラス
+
+    モデルは初回アクセス時に読み込まれ、メモリ予算を超えた場合は最も長く使われていないものから破棄される
+    """
+
+    def __init__(
+        self,
+        model_dir: str = None,
+        modelname: str = "rf",
+        memory_budget_mb: float = 512,
+        mmap_mode: Optional[str] = "r",
+        preload_workers: int = 1,
+    ):
+        self.model_dir = model_dir
+        self.modelname = modelname
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.mmap_mode = mmap_mode
+        self.stats = RegistryStats()
+
+        self._paths: dict[PairKey, str] = {}
+        self._thresholds: dict[PairKey, float] = {}
+        self._feature_sets: dict[PairKey, FeatureSet] = {}
+        self._cache: OrderedDict[PairKey, _Entry] = OrderedDict()
+        self._loading: dict[PairKey, Future] = {}
+        # Bumped by register() and invalidate(),
+        # a load started before that is not cached
+        self._generations: dict[PairKey, int] = {}
+        self._resident_size = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=preload_workers, thread_name_prefix="model-preload"
+        )
+
+        # Decision thresholds calibrated at training
+        # time are stored in the bundle manifest
+        if model_dir is not None and os.path.exists(
+            os.path.join(model_dir, ModelBundle.manifest_filename)
+        ):
+            bundle = ModelBundle(model_dir, modelname)
+            self._thresholds.update(bundle.thresholds())
+            self._feature_sets.update(bundle.feature_sets())
+
+    @staticmethod
+    def pair_key(user1_name: str, user2_name: str) -> PairKey:
+        return (str(user1_name), str(user2_name))
+
+    def register(self, pair: PairKey, model_path: str, threshold: float = None):
+        with self._lock:
+            self._paths[pair] = model_path
+            if threshold is not None:
+                self._thresholds[pair] = threshold
+            self._discard(pair)
+            self._next_generation(pair)
+
+    def get_threshold(self, pair: PairKey, default: float = None) -> float:
+        return self._thresholds.get(pair, default)
+
+    def get_feature_set(self, pair: PairKey) -> Optional[FeatureSet]:
+        # None when the features used by the model were not recorded at training time
+        return self._feature_sets.get(pair)
+
+    def model_path(self, pair: PairKey) -> str:
+        if pair in self._paths:
+            return self._paths[pair]
+        if self.model_dir is None:
+            raise KeyError(f"No model registered for pair {pair}")
+        return os.path.join(self.model_dir, model_filename(self.modelname, *pair))
+
+    def __contains__(self, pair: PairKey) -> bool:
+        with self._lock:
+            return pair in self._cache
+
+    @property
+    def resident_size(self) -> int:
+        return self._resident_size
+
+    def get(self, pair: PairKey) -> object:
+        with self._lock:
+            entry = self._cache.get(pair)
+            if entry is not None:
+                self._cache.move_to_end(pair)
+                self.stats.hits += 1
+                return entry.model
+            self.stats.misses += 1
+            future = self._loading.get(pair)
+            if future is None:
+                future = Future()
+                self._loading[pair] = future
+                generation = self._generations.get(pair, 0)
+                owner = True
+            else:
+                # A preload is already in flight, wait for it instead of reading twice
+                owner = False
+
+        if owner:
+            self._load(pair, future, generation)
+        return future.result()
+
+    def preload(self, pairs: Iterable[PairKey]) -> list[Future]:
+        # Load models of pairs expected to authenticate soon in the background
+        futures = []
+        for pair in pairs:
+            with self._lock:
+                if pair in self._cache:
+                    continue
+                future = self._loading.get(pair)
+                if future is None:
+                    future = Future()
+                    self._loading[pair] = future
+                    self._executor.submit(
+                        self._load, pair, future, self._generations.get(pair, 0)
+                    )
+            futures.append(future)
+        return futures
+
+    def invalidate(self, pair: PairKey):
+        # Drop a cached model, e.g. after the model file was updated
+        with self._lock:
+            self._discard(pair)
+            self._next_generation(pair)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._resident_size = 0
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.clear()
+
+    def _load(self, pair: PairKey, future: Future, generation: int):
+        try:
+            model_path = self.model_path(pair)
+            start = time.perf_counter()
+            model = load_model_file(model_path, self.mmap_mode)
+            elapsed = time.perf_counter() - start
+            # The on-disk size of a pickle approximates its resident size
+            size = os.path.getsize(model_path)
+        except BaseException as e:
+            with self._lock:
+                self._finish_loading(pair, future)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self.stats.loads += 1
+            self.stats.total_load_time += elapsed
+            self.stats.max_load_time = max(self.stats.max_load_time, elapsed)
+            # The callers waiting for this load still get the model,
+            # but it is not cached when the pair was registered again meanwhile
+            if self._generations.get(pair, 0) == generation:
+                self._discard(pair)
+                self._cache[pair] = _Entry(model, size)
+                self._resident_size += size
+                self._evict()
+            self._finish_loading(pair, future)
+        future.set_result(model)
+
+    def _finish_loading(self, pair: PairKey, future: Future):
+        # A newer load of the pair may have replaced this one
+        if self._loading.get(pair) is future:
+            del self._loading[pair]
+
+    def _next_generation(self, pair: PairKey):
+        self._generations[pair] = self._generations.get(pair, 0) + 1
+        # Later requests start a new load instead of waiting for the outdated one
+        self._loading.pop(pair, None)
+
+    def _evict(self):
+        # Keep at least the most recently used model even if it exceeds the budget
+        while self._resident_size > self.memory_budget and len(self._cache) > 1:
+            _, entry = self._cache.popitem(last=False)
+            self._resident_size -= entry.size
+            self.stats.evictions += 1
+
+    def _discard(self, pair: PairKey):
+        entry = self._cache.pop(pair, None)
+        if entry is not None:
+            self._resident_size -= entry.size
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_curve
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+
+def calibrate_threshold(
+    label_list: list[int], pred_proba: np.ndarray, target_far: float = None
+) -> float:
+    # target_far is None: threshold at the equal error rate
+    # otherwise: the lowest threshold whose false
+    # acceptance rate does not exceed target_far
+    fpr, tpr, thresholds = roc_curve(label_list, pred_proba)
+    # The first threshold of roc_curve is inf, which rejects everything and cannot be
+    # stored in the bundle manifest. The largest score rejects all but the top scores.
+    thresholds = np.minimum(thresholds, np.max(thresholds[np.isfinite(thresholds)]))
+    if target_far is None:
+        eer_idx = np.argmin(np.abs(fpr - (1 - tpr)))
+        return float(thresholds[eer_idx])
+
+    # fpr is non-decreasing, so the last index
+    # within the target is the most permissive one
+    far_idx = np.searchsorted(fpr, target_far, side="right") - 1
+    return float(thresholds[max(far_idx, 0)])
+
+
+def fit_with_held_out_scores(
+    classifier: object,
+    feat: pd.DataFrame,
+    label_list: list[int],
+    cv_folds: int = 5,
+) -> tuple[object, np.ndarray, np.ndarray]:
+    # Fit the classifier and return scores of samples that were held out from the
+    # model scoring them, together with their labels.
+    # Random forests provide them for free as out-of-bag scores.
+    label_array = np.asarray(label_list)
+    if isinstance(classifier, RandomForestClassifier) and classifier.bootstrap:
+        classifier.set_params(oob_score=True)
+        classifier.fit(feat, label_list)
+        oob_decision = classifier.oob_decision_function_
+        # Samples that were never out of bag get all-zero rows instead of probabilities
+        # that sum to 1, they have no score
+        valid = oob_decision.sum(axis=1) > 0
+        return classifier, oob_decision[valid, 1], label_array[valid]
+
+    cv = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=0)
+    held_out_scores = cross_val_predict(
+        clone(classifier), feat, label_list, cv=cv, method="predict_proba"
+    )[:, 1]
+    classifier.fit(feat, label_list)
+    return classifier, held_out_scores, label_array
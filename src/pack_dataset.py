@@ -0,0 +1,57 @@
+import os
+
+import hydra
+import pandas as pd
+from tqdm import tqdm
+from omegaconf import DictConfig
+
+from dataset.archive import DatasetArchive
+from dataset.sensordata import MaeSoDatasetMode, MaeSoIndivisualDataset
+
+
+@hydra.main(version_base=None, config_path="../conf", config_name="pack_dataset")
+def pack_dataset(cfg: DictConfig):
+    archive = DatasetArchive(cfg.archive_path)
+    # Recordings that are already packed are skipped, so the archive can be extended
+    packed_keys = archive.keys()
+
+    id_file = pd.read_csv(os.path.join(cfg.dataset_path, "id.csv"))
+    ids = [{"id": row["id"], "name": row["name"]} for _, row in id_file.iterrows()]
+
+    entries = []
+    for mode_name in cfg.scenario_modes:
+        for is_train in [True, False]:
+            dataset = MaeSoIndivisualDataset(
+                cfg.dataset_path,
+                None,
+                MaeSoDatasetMode[mode_name.upper()],
+                is_train,
+            )
+            for idx in tqdm(range(len(dataset))):
+                name = os.path.basename(dataset.user1_file_path_list[idx])
+                key = (mode_name.lower(), dataset.pair_id_list[idx], name)
+                if key in packed_keys:
+                    continue
+                user1_data, user2_data, _, data_info = dataset[idx]
+                entries.append(
+                    {
+                        "mode": key[0],
+                        "pair_id": key[1],
+                        "user1_id": data_info["user1_id"],
+                        "user2_id": data_info["user2_id"],
+                        "name": name,
+                        "split": "train" if is_train else "test",
+                        "user1_data": user1_data,
+                        "user2_data": user2_data,
+                    }
+                )
+                packed_keys.add(key)
+                if len(entries) >= cfg.chunk_size:
+                    archive.append(entries, ids)
+                    entries = []
+    archive.append(entries, ids)
+    print(f"{len(archive)} recordings in {cfg.archive_path}")
+
+
+if __name__ == "__main__":
+    pack_dataset()
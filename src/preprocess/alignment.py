@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from .pair_data_extraction import pair_extraction, time_to_ns
+
+
+def gyro_l2norm(df: pd.DataFrame) -> np.ndarray:
+    gyro = df.loc[:, ["gyroX", "gyroY", "gyroZ"]].to_numpy(dtype=float)
+    return np.sqrt(np.sum(gyro**2, axis=1))
+
+
+def estimate_lags(
+    signals1: list[np.ndarray], signals2: list[np.ndarray], max_lag: int
+) -> np.ndarray:
+    # Estimate for each pair how many samples signal2 is delayed against signal1,
+    # i.e. signal2[n] ~ signal1[n - lag], from the FFT based cross-correlation.
+    # All pairs are zero padded to one length and processed in one batch.
+    if len(signals1) != len(signals2):
+        raise ValueError("The number of signals does not match")
+    if len(signals1) == 0:
+        return np.empty(0, dtype=int)
+
+    max_length = max(max(len(s) for s in signals1), max(len(s) for s in signals2))
+    fft_length = 1 << int(np.ceil(np.log2(2 * max_length)))
+
+    def to_batch(signals):
+        batch = np.zeros((len(signals), fft_length))
+        mask = np.zeros((len(signals), fft_length))
+        for i, signal in enumerate(signals):
+            signal = np.asarray(signal, dtype=float)
+            std = signal.std()
+            batch[i, : len(signal)] = (signal - signal.mean()) / (std if std > 0 else 1)
+            mask[i, : len(signal)] = 1
+        return batch, mask
+
+    batch1, mask1 = to_batch(signals1)
+    batch2, mask2 = to_batch(signals2)
+
+    spectrum1 = np.fft.rfft(batch1, axis=1)
+    spectrum2 = np.fft.rfft(batch2, axis=1)
+    # correlation[k] = sum_n signal2[n + k] * signal1[n]
+    correlation = np.fft.irfft(spectrum2 * np.conj(spectrum1), n=fft_length, axis=1)
+    # Number of overlapping samples at each lag, to avoid favouring small lags
+    overlap = np.fft.irfft(
+        np.fft.rfft(mask2, axis=1) * np.conj(np.fft.rfft(mask1, axis=1)),
+        n=fft_length,
+        axis=1,
+    )
+    overlap = np.maximum(np.rint(overlap), 1)
+
+    lags = np.arange(-max_lag, max_lag + 1)
+    lag_idx = lags % fft_length
+    score = correlation[:, lag_idx] / overlap[:, lag_idx]
+    return lags[np.argmax(score, axis=1)]
+
+
+def sampling_period_ns(df: pd.DataFrame) -> float:
+    return float(np.median(np.diff(time_to_ns(df.loc[:, "time"]))))
+
+
+def apply_lag(
+    device1_data: pd.DataFrame, device2_data: pd.DataFrame, lag: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Shift the timestamps of device2 so that pair_extraction trims the aligned ranges
+    if lag == 0:
+        return device1_data, device2_data
+    offset_ns = int(round(lag * sampling_period_ns(device2_data)))
+    shifted_device2_data = device2_data.copy()
+    shifted_device2_data["time"] = time_to_ns(device2_data.loc[:, "time"]) - offset_ns
+    shifted_device1_data = device1_data.copy()
+    shifted_device1_data["time"] = time_to_ns(device1_data.loc[:, "time"])
+    return shifted_device1_data, shifted_device2_data
+
+
+def overlapping_gyro_l2norms(
+    device1_data: pd.DataFrame, device2_data: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    # The signals are cross-correlated by sample index, so they are trimmed to the
+    # common time range first. Otherwise the difference of the start times would be
+    # estimated as a part of the lag.
+    trimmed_device1_data, trimmed_device2_data = pair_extraction(
+        device1_data, device2_data
+    )
+    return gyro_l2norm(trimmed_device1_data), gyro_l2norm(trimmed_device2_data)
+
+
+def align_pair(
+    device1_data: pd.DataFrame, device2_data: pd.DataFrame, max_lag: int
+) -> tuple[pd.DataFrame, pd.DataFrame, int]:
+    signal1, signal2 = overlapping_gyro_l2norms(device1_data, device2_data)
+    lag = int(estimate_lags([signal1], [signal2], max_lag)[0])
+    device1_data, device2_data = apply_lag(device1_data, device2_data, lag)
+    return device1_data, device2_data, lag
+
+
+def estimate_dataset_lags(dataset, max_lag: int, batch_size: int = 64) -> pd.DataFrame:
+    # Estimate the lag of every pair in a dataset, batch_size pairs per FFT call
+    lag_list = []
+    info_list = []
+    signals1 = []
+    signals2 = []
+
+    def flush():
+        lag_list.extend(estimate_lags(signals1, signals2, max_lag).tolist())
+        signals1.clear()
+        signals2.clear()
+
+    for device1_data, device2_data, label, data_info in dataset:
+        signal1, signal2 = overlapping_gyro_l2norms(device1_data, device2_data)
+        signals1.append(signal1)
+        signals2.append(signal2)
+        info_list.append(data_info)
+        if len(signals1) == batch_size:
+            flush()
+    flush()
+
+    lag_df = pd.DataFrame(info_list).reset_index(drop=True)
+    lag_df["lag"] = lag_list
+    return lag_df
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from sklearn.preprocessing import StandardScaler
+
+from .pair_data_extraction import pair_extraction_idx, time_to_ns
+
+TRIAXIAL_LABELS = ["X", "Y", "Z"]
+# Column order of the sampled data (BaseDeviceHandler.sensor_data_labels)
+SENSOR_CHANNELS = [
+    attribute + axis
+    for attribute in ["acc", "gyro", "mag", "angle"]
+    for axis in TRIAXIAL_LABELS
+]
+
+
+@dataclass
+class SensorArray:
+    """
+    1デバイス分の計測データ
+
+    timeはint64のナノ秒、valuesはチャンネルごとに連続した(チャンネル数, サンプル数)の配列
+    """
+
+    time: np.ndarray
+    values: np.ndarray
+    channels: list[str]
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, dtype=np.float64) -> "SensorArray":
+        # Every column except time and id is a channel
+        channels = [c for c in df.columns if (c != "time") and (c != "id")]
+        if "time" in df.columns:
+            time = time_to_ns(df.loc[:, "time"])
+        else:
+            time = np.zeros(len(df), dtype=np.int64)
+        values = np.ascontiguousarray(df.loc[:, channels].to_numpy(dtype=dtype).T)
+        return cls(time, values, channels)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.values.T, columns=self.channels)
+        df.insert(0, "time", self.time)
+        return df
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def channel_index(self, channel: str) -> int:
+        return self.channels.index(channel)
+
+    def slice(self, start: int, end: int) -> "SensorArray":
+        return SensorArray(
+            self.time[start:end], self.values[:, start:end], self.channels
+        )
+
+    def with_values(
+        self, values: np.ndarray, channels: list[str] = None
+    ) -> "SensorArray":
+        return SensorArray(
+            self.time, values, self.channels if channels is None else channels
+        )
+
+
+def pair_extraction_arrays(
+    device1_data: SensorArray, device2_data: SensorArray
+) -> tuple[SensorArray, SensorArray]:
+    start_idx1, end_idx1, start_idx2, end_idx2 = pair_extraction_idx(
+        device1_data.time, device2_data.time
+    )
+    return (
+        device1_data.slice(start_idx1, end_idx1),
+        device2_data.slice(start_idx2, end_idx2),
+    )
+
+
+def high_pass_filter_array(values: np.ndarray, alpha: float = 0.8) -> np.ndarray:
+    # The offset follows offset[i] = alpha * offset[i - 1]
+    # + (1 - alpha) * x[i] from offset[0] = x[0],
+    # and the filtered value is x[i] - offset[i]. The last sample is left as it is.
+    # values is (channels, samples) or (samples,)
+    values = np.asarray(values, dtype=float)
+    if values.shape[-1] < 2:
+        return values.copy()
+    first = values[..., :1]
+    offset = lfilter(
+        [1 - alpha], [1, -alpha], values[..., 1:], axis=-1, zi=alpha * first
+    )[0]
+    offset = np.concatenate([first, offset], axis=-1)
+    filtered = values.copy()
+    filtered[..., :-1] -= offset[..., :-1]
+    return filtered
+
+
+def removal_gravitational_acceleration_array(
+    data: SensorArray, alpha: float = 0.8
+) -> SensorArray:
+    acc_idx = [data.channel_index("acc" + axis) for axis in TRIAXIAL_LABELS]
+    values = data.values.copy()
+    values[acc_idx] = high_pass_filter_array(data.values[acc_idx], alpha)
+    return data.with_values(values)
+
+
+def l2norm_arrays(
+    values: np.ndarray,
+    channels: list[str],
+    triaxial_attributes: list[str] = ["acc", "gyro"],
+) -> np.ndarray:
+    # (attributes, samples)
+    l2norm = np.zeros((len(triaxial_attributes), values.shape[-1]))
+    for att_idx, attribute in enumerate(triaxial_attributes):
+        for axis in TRIAXIAL_LABELS:
+            l2norm[att_idx] += values[channels.index(attribute + axis)] ** 2
+    return np.sqrt(l2norm)
+
+
+def append_l2norm(
+    data: SensorArray, triaxial_attributes: list[str] = ["acc", "gyro"]
+) -> SensorArray:
+    return data.with_values(
+        np.concatenate(
+            [
+                data.values,
+                l2norm_arrays(data.values, data.channels, triaxial_attributes),
+            ]
+        ),
+        data.channels + [attribute + "_mag" for attribute in triaxial_attributes],
+    )
+
+
+def standardize_array(data: SensorArray) -> SensorArray:
+    # StandardScaler sees the same memory layout as with a DataFrame input,
+    # which keeps the results identical to standardization()
+    standard = StandardScaler().fit_transform(data.values.T)
+    return data.with_values(np.ascontiguousarray(standard.T))
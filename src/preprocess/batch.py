@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.signal import lfilter
+
+from .arrays import TRIAXIAL_LABELS, SensorArray, l2norm_arrays
+
+
+@dataclass
+class SegmentBatch:
+    """
+    長さの異なる複数セグメントをまとめた計測データ
+
+    valuesは全セグメントを時間方向に連結した(チャンネル数, 総サンプル数)の配列で、
+    セグメントiはvalues[:, offsets[i]:offsets[i + 1]]
+    """
+
+    values: np.ndarray
+    offsets: np.ndarray
+    channels: list[str]
+
+    @classmethod
+    def from_arrays(cls, segments: list[SensorArray]) -> "SegmentBatch":
+        if not segments:
+            raise ValueError("SegmentBatch needs at least one segment")
+        channels = segments[0].channels
+        for segment in segments:
+            if segment.channels != channels:
+                raise ValueError("Every segment of a batch must have the same channels")
+            if len(segment) == 0:
+                raise ValueError("Empty segments cannot be batched")
+        lengths = [len(segment) for segment in segments]
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.concatenate([segment.values for segment in segments], axis=1)
+        return cls(values, offsets, channels)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.offsets[:-1]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def segment_ids(self) -> np.ndarray:
+        # Segment index of every sample
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def segment(self, i: int) -> np.ndarray:
+        return self.values[:, self.offsets[i] : self.offsets[i + 1]]
+
+    def with_values(
+        self, values: np.ndarray, channels: list[str] = None
+    ) -> "SegmentBatch":
+        return SegmentBatch(
+            values, self.offsets, self.channels if channels is None else channels
+        )
+
+
+def to_padded(
+    values: np.ndarray, offsets: np.ndarray, fill_value: float = np.nan
+) -> np.ndarray:
+    # (channels, total samples) -> (segments, channels, longest segment)
+    lengths = np.diff(offsets)
+    segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    padded = np.full(
+        (len(lengths), values.shape[0], lengths.max(initial=0)), fill_value
+    )
+    padded[segment_ids, :, positions] = values.T
+    return padded
+
+
+def from_padded(padded: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    lengths = np.diff(offsets)
+    segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    return np.ascontiguousarray(padded[segment_ids, :, positions].T)
+
+
+def high_pass_filter_batch(
+    values: np.ndarray, offsets: np.ndarray, alpha: float = 0.8
+) -> np.ndarray:
+    # high_pass_filter_array for every segment,
+    # as one lfilter call over the padded segments.
+    # The filter only looks back, so the padding after a segment does not change it.
+    padded = to_padded(values, offsets, 0.0)
+    if padded.shape[-1] < 2:
+        return values.copy()
+    lengths = np.diff(offsets)
+    first = padded[..., :1]
+    offset = lfilter(
+        [1 - alpha], [1, -alpha], padded[..., 1:], axis=-1, zi=alpha * first
+    )[0]
+    offset = np.concatenate([first, offset], axis=-1)
+    # The last sample of every segment is left as it is
+    last = np.arange(padded.shape[-1])[None, None, :] >= (lengths - 1)[:, None, None]
+    filtered = np.where(last, padded, padded - offset)
+    return from_padded(filtered, offsets)
+
+
+def removal_gravitational_acceleration_batch(
+    batch: SegmentBatch, alpha: float = 0.8
+) -> SegmentBatch:
+    acc_idx = [batch.channels.index("acc" + axis) for axis in TRIAXIAL_LABELS]
+    values = batch.values.copy()
+    values[acc_idx] = high_pass_filter_batch(
+        batch.values[acc_idx], batch.offsets, alpha
+    )
+    return batch.with_values(values)
+
+
+def append_l2norm_batch(
+    batch: SegmentBatch, triaxial_attributes: list[str] = ["acc", "gyro"]
+) -> SegmentBatch:
+    # The l2 norm is per sample, so the segments need no special handling
+    return batch.with_values(
+        np.concatenate(
+            [
+                batch.values,
+                l2norm_arrays(batch.values, batch.channels, triaxial_attributes),
+            ]
+        ),
+        batch.channels + [attribute + "_mag" for attribute in triaxial_attributes],
+    )
+
+
+def segment_mean(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    # (channels, segments)
+    return np.add.reduceat(values, offsets[:-1], axis=1) / np.diff(offsets)
+
+
+def standardize_batch(batch: SegmentBatch) -> SegmentBatch:
+    # standardize_array for every segment,
+    # the mean and the variance are segment-wise reductions
+    lengths = batch.lengths
+    mean = segment_mean(batch.values, batch.offsets)
+    centered = batch.values - np.repeat(mean, lengths, axis=1)
+    var = segment_mean(centered**2, batch.offsets)
+    # Near constant channels are not scaled, as in StandardScaler
+    eps = np.finfo(np.float64).eps
+    constant = var <= lengths * eps * var + (lengths * mean * eps) ** 2
+    scale = np.where(constant, 1.0, np.sqrt(var))
+    return batch.with_values(centered / np.repeat(scale, lengths, axis=1))
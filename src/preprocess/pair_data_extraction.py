@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -14,46 +15,87 @@ def str2datetime(time: str) -> datetime:
     return datetime.strptime(time, "%Y-%m-%d %H:%M:%S.%f")
 
 
-def search_near_time_idx(ref_time: datetime, df: pd.DataFrame) -> int:
-    near_time_idx = 0
-    min_time_diff = None
-    for df_idx in range(0, df.shape[0]):
-        target_time = str2datetime(df["time"].iloc[df_idx])
+def time_to_ns(time: pd.Series) -> np.ndarray:
+    # Recorded timestamps are int64 nanoseconds and used as they are.
+    # Older recordings have datetime strings, which are parsed in one vectorized call.
+    if pd.api.types.is_integer_dtype(time):
+        return time.to_numpy(dtype=np.int64)
+    return (
+        pd.to_datetime(time, format="ISO8601")
+        .to_numpy(dtype="datetime64[ns]")
+        .view(np.int64)
+    )
 
-        time_diff = abs(target_time - ref_time)
-        if (min_time_diff is None) or (time_diff < min_time_diff):
-            min_time_diff = time_diff
-            near_time_idx = df_idx
-        else:
-            break
-    return near_time_idx
 
+def search_near_time_idx_ns(ref_time: int, time_ns: np.ndarray) -> int:
+    # Index of the timestamp nearest to ref_time in a sorted array.
+    # On ties and duplicated timestamps the first index is returned.
+    idx = np.searchsorted(time_ns, ref_time, side="left")
+    if idx == 0:
+        return 0
+    lower_idx = np.searchsorted(time_ns, time_ns[idx - 1], side="left")
+    if idx == len(time_ns):
+        return int(lower_idx)
+    if ref_time - time_ns[idx - 1] <= time_ns[idx] - ref_time:
+        return int(lower_idx)
+    return int(idx)
 
-def pair_extraction(
-    device1_data: pd.DataFrame, device2_data: pd.DataFrame
-) -> tuple[pd.DataFrame, pd.DataFrame]:
 
-    start_idx1 = 0
-    start_idx2 = 0
-    end_idx1 = device1_data.shape[0]
-    end_idx2 = device2_data.shape[0]
+def search_near_time_idxs_ns(ref_times: np.ndarray, time_ns: np.ndarray) -> np.ndarray:
+    # search_near_time_idx_ns for many reference times at once
+    ref_times = np.asarray(ref_times, dtype=np.int64)
+    idx = np.searchsorted(time_ns, ref_times, side="left")
+    lower = np.clip(idx - 1, 0, len(time_ns) - 1)
+    upper = np.clip(idx, 0, len(time_ns) - 1)
+    lower_idx = np.searchsorted(time_ns, time_ns[lower], side="left")
+    use_lower = (idx == len(time_ns)) | (
+        ref_times - time_ns[lower] <= time_ns[upper] - ref_times
+    )
+    return np.where(idx == 0, 0, np.where(use_lower, lower_idx, idx))
 
-    start_time1 = str2datetime(device1_data.loc[:, "time"].iloc[0])
-    start_time2 = str2datetime(device2_data.loc[:, "time"].iloc[0])
-    end_time1 = str2datetime(device1_data.loc[:, "time"].iloc[-1])
-    end_time2 = str2datetime(device2_data.loc[:, "time"].iloc[-1])
+
+def search_near_time_idx(ref_time: datetime, df: pd.DataFrame) -> int:
+    ref_time_ns = pd.Timestamp(ref_time).value
+    return search_near_time_idx_ns(ref_time_ns, time_to_ns(df["time"]))
+
+
+def extraction_idx(
+    time_ns: np.ndarray, other_start_ns: int = None, other_end_ns: int = None
+) -> tuple[int, int]:
+    # Range of one device that overlaps the other device,
+    # given the start and end times of the other.
+    # None leaves the side as it is,
+    # e.g. the end while the other device is still sampling.
+    start_idx = 0
+    end_idx = len(time_ns)
 
     # 開始時間を遅い方のデバイスに合わせる
-    if start_time1 > start_time2:
-        start_idx2 = search_near_time_idx(start_time1, device2_data)
-    elif start_time1 < start_time2:
-        start_idx1 = search_near_time_idx(start_time2, device1_data)
+    if other_start_ns is not None and time_ns[0] < other_start_ns:
+        start_idx = search_near_time_idx_ns(other_start_ns, time_ns)
 
     # 終了時間を早い方のデバイスに合わせる
-    if end_time1 > end_time2:
-        end_idx1 = search_near_time_idx(end_time2, device1_data)
-    elif end_time1 < end_time2:
-        end_idx2 = search_near_time_idx(end_time1, device2_data)
+    if other_end_ns is not None and time_ns[-1] > other_end_ns:
+        end_idx = search_near_time_idx_ns(other_end_ns, time_ns)
+
+    return start_idx, end_idx
+
+
+def pair_extraction_idx(
+    time1_ns: np.ndarray, time2_ns: np.ndarray
+) -> tuple[int, int, int, int]:
+    start_idx1, end_idx1 = extraction_idx(time1_ns, time2_ns[0], time2_ns[-1])
+    start_idx2, end_idx2 = extraction_idx(time2_ns, time1_ns[0], time1_ns[-1])
+    return start_idx1, end_idx1, start_idx2, end_idx2
+
+
+def pair_extraction(
+    device1_data: pd.DataFrame, device2_data: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+
+    start_idx1, end_idx1, start_idx2, end_idx2 = pair_extraction_idx(
+        time_to_ns(device1_data.loc[:, "time"]),
+        time_to_ns(device2_data.loc[:, "time"]),
+    )
 
     extracted_device1_data = device1_data.iloc[start_idx1:end_idx1,]
     extracted_device2_data = device2_data.iloc[start_idx2:end_idx2,]
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+
+@dataclass
+class Stage:
+    """
+    パイプラインの処理単位
+
+    inputsの値を位置引数、paramsの値をキーワード引数としてfuncを呼び、戻り値をoutputsの名前で公開する
+    outputsが複数の場合、funcはoutputsと同じ長さのタプルを返す
+    memoizeがTrueのステージのみ出力をStageMemoに保持する
+    """
+
+    name: str
+    func: Callable
+    inputs: list[str]
+    outputs: list[str]
+    params: list[str] = field(default_factory=list)
+    memoize: bool = False
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class StageMemo:
+    """
+    ステージの出力を計測データごとに保持するキャッシュ
+
+    最も長く使われていない出力から破棄する
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Hashable, tuple] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: tuple):
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+class Pipeline:
+    """
+    ステージの依存関係から必要な処理だけを実行するパイプライン
+
+    要求された出力から入力側へ辿り、到達しないステージは実行しない
+    memoとrecording_keyが与えられた場合、memoizeが指定されたステージの出力を計測データごとに再利用する
+    """
+
+    def __init__(self, name: str, stages: list[Stage]):
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        self.producers: dict[str, Stage] = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"Output {output} is produced by several stages")
+                self.producers[output] = stage
+        # A memoized output depends on the parameters of every stage before it.
+        # This also raises ValueError on a cycle.
+        self.upstream_params: dict[str, list[str]] = {
+            stage.name: sorted(
+                {p for s in self.required_stages(stage.outputs) for p in s.params}
+            )
+            for stage in stages
+        }
+
+    def required_stages(
+        self, targets: list[str], sources: list[str] = ()
+    ) -> list[Stage]:
+        # Stages needed for targets in execution order, given the values in sources
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(name: str):
+            # Names no stage produces are inputs of the pipeline
+            if name in sources or name not in self.producers:
+                return
+            stage = self.producers[name]
+            if stage.name in visited:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Pipeline has a cycle at stage {stage.name}")
+            visiting.add(stage.name)
+            for input_name in stage.inputs:
+                visit(input_name)
+            visiting.discard(stage.name)
+            visited.add(stage.name)
+            order.append(stage)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def run(
+        self,
+        sources: dict[str, Any],
+        targets: list[str],
+        params: dict[str, Any] = None,
+        memo: StageMemo = None,
+        recording_key: Hashable = None,
+    ) -> dict[str, Any]:
+        params = params or {}
+        values = dict(sources)
+        use_memo = memo is not None and recording_key is not None
+
+        def resolve(name: str):
+            if name in values:
+                return
+            if name not in self.producers:
+                raise ValueError(f"{name} is neither given nor produced by a stage")
+            stage = self.producers[name]
+            # Parameters that are not given are passed as None
+            stage_params = {p: params.get(p) for p in stage.params}
+
+            memo_key = None
+            outputs = None
+            if use_memo and stage.memoize:
+                memo_key = (
+                    self.name,
+                    recording_key,
+                    stage.name,
+                    _freeze(
+                        {p: params.get(p) for p in self.upstream_params[stage.name]}
+                    ),
+                )
+                outputs = memo.get(memo_key)
+            if outputs is None:
+                # Inputs are resolved only when the output is not memoized
+                for input_name in stage.inputs:
+                    resolve(input_name)
+                result = stage.func(
+                    *[values[input_name] for input_name in stage.inputs],
+                    **stage_params,
+                )
+                outputs = result if len(stage.outputs) > 1 else (result,)
+                if memo_key is not None:
+                    memo.put(memo_key, outputs)
+            values.update(zip(stage.outputs, outputs))
+
+        for target in targets:
+            resolve(target)
+        return {target: values[target] for target in targets}
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from .arrays import high_pass_filter_array
+
 
 def removal_gravitational_acceleration(
     df: pd.DataFrame, alpha: float = 0.8
@@ -10,23 +12,16 @@ def removal_gravitational_acceleration(
     acc_column_names = [acc_label + s for s in ["X", "Y", "Z"]]
 
     removed_df = df.copy()
-
-    for acc_column_name in acc_column_names:
-        removed_df.loc[:, acc_column_name] = high_pass_filter(
-            removed_df[acc_column_name].to_numpy(), alpha
-        )
+    # The three axes are filtered at once as (axes, samples)
+    filtered = high_pass_filter_array(
+        df.loc[:, acc_column_names].to_numpy(dtype=float).T, alpha
+    )
+    for acc_idx, acc_column_name in enumerate(acc_column_names):
+        removed_df[acc_column_name] = filtered[acc_idx]
     return removed_df
 
 
 def high_pass_filter(
     time_series_data: np.typing.ArrayLike, alpha: float = 0.8
 ) -> np.typing.ArrayLike:
-
-    filtered_data = time_series_data.copy()
-    offset = time_series_data[0]
-
-    for i in range(0, len(time_series_data) - 1):
-        filtered_data[i] -= offset
-        offset = alpha * offset + (1 - alpha) * filtered_data[i + 1]
-
-    return filtered_data
+    return high_pass_filter_array(time_series_data, alpha)
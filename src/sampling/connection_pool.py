@@ -0,0 +1,266 @@
+import asyncio
+import time
+from concurrent.futures import Future
+from logging import getLogger
+from threading import Event, Lock, Thread
+from typing import Callable, Coroutine, Optional
+
+import bleak
+
+from .device_model import DeviceModel
+
+default_logger = getLogger(__name__)
+
+
+class PooledConnection:
+    def __init__(self, address: str):
+        self.address = address
+        self.client: Optional[bleak.BleakClient] = None
+        # Characteristics are discovered once and reused after reconnection
+        self.notify_characteristic = None
+        self.writer_characteristic = None
+        self.listener: Optional[Callable] = None
+        # DeviceModel of the lease,
+        # attached again to the new client after a reconnection
+        self.device: Optional[DeviceModel] = None
+        self.last_notification_time = None
+        self.reconnect_count = 0
+        # The output is configured on the first successful connection only
+        self.configured = False
+        self.sample_rate_hz = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.client is not None and self.client.is_connected
+
+    def dispatch(self, sender, data):
+        self.last_notification_time = time.monotonic()
+        listener = self.listener
+        if listener is not None:
+            listener(sender, data)
+
+
+class DeviceLease:
+    def __init__(self, pool: "DeviceConnectionPool", connection: PooledConnection):
+        self.pool = pool
+        self.connection = connection
+
+    @property
+    def client(self) -> bleak.BleakClient:
+        return self.connection.client
+
+    @property
+    def writer_characteristic(self):
+        return self.connection.writer_characteristic
+
+    @property
+    def sample_rate_hz(self):
+        return self.connection.sample_rate_hz
+
+    def release(self):
+        self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class DeviceConnectionPool:
+    """
+    BLEデバイスとの接続を保持するクラス
+
+    接続と通知の購読は認証をまたいで維持し、認証セッションはlease()で接続を借りる
+    """
+
+    def __init__(
+        self,
+        addresses: list[str],
+        health_check_interval: float = 5.0,
+        stale_timeout: float = 3.0,
+        output_config: dict = None,
+        logger=default_logger,
+    ):
+        self.logger = logger
+        # {"rate_hz": ..., "content": OutputContent}
+        # written once when a device is connected
+        self.output_config = output_config
+        self.health_check_interval = health_check_interval
+        self.stale_timeout = stale_timeout
+        self.connections = {address: PooledConnection(address) for address in addresses}
+        self._leased: set[str] = set()
+        self._lock = Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run_loop, daemon=True)
+        self._ready = Event()
+        self._finished = False
+
+    def start(self, timeout: float = None):
+        # Connect to all devices in the background, wait until all of them are connected
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._connect_all(), self._loop)
+        asyncio.run_coroutine_threadsafe(self._health_check(), self._loop)
+        self._ready.wait(timeout)
+
+    def stop(self):
+        self._finished = True
+        future = asyncio.run_coroutine_threadsafe(self._disconnect_all(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def run(self, coroutine: Coroutine) -> Future:
+        # BleakClient must be used from the loop it was connected on
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def lease(
+        self, address: str, listener: Callable, device: DeviceModel = None
+    ) -> DeviceLease:
+        # When device is given, it is attached to
+        # the connection until the lease is released
+        if address not in self.connections:
+            raise ValueError(f"Device {address} is not managed by the pool")
+        with self._lock:
+            if address in self._leased:
+                raise ValueError(f"Device {address} is already leased")
+            self._leased.add(address)
+        connection = self.connections[address]
+        connection.device = device
+        if device is not None:
+            device.attachConnection(connection.client, connection.writer_characteristic)
+        connection.listener = listener
+        return DeviceLease(self, connection)
+
+    def lease_pair(
+        self,
+        address1: str,
+        listener1: Callable,
+        address2: str,
+        listener2: Callable,
+    ) -> tuple[DeviceLease, DeviceLease]:
+        lease1 = self.lease(address1, listener1)
+        try:
+            lease2 = self.lease(address2, listener2)
+        except Exception:
+            lease1.release()
+            raise
+        return lease1, lease2
+
+    def release(self, lease: DeviceLease):
+        # The connection stays open, only the notifications are no longer forwarded
+        lease.connection.listener = None
+        lease.connection.device = None
+        with self._lock:
+            self._leased.discard(lease.connection.address)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _connect_all(self):
+        connections = list(self.connections.values())
+        results = await asyncio.gather(
+            *[self._connect(connection) for connection in connections],
+            return_exceptions=True,
+        )
+        # A failed device is left to the health check, which keeps trying to reconnect
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Connection failed: {connection.address}: {result}")
+        self._ready.set()
+
+    async def _connect(self, connection: PooledConnection):
+        # Only the target service is resolved, which shortens the discovery
+        client = bleak.BleakClient(
+            connection.address, services=[DeviceModel.SERVICE_UUID]
+        )
+        await client.connect()
+        connection.client = client
+
+        if connection.notify_characteristic is None:
+            for service in client.services:
+                if service.uuid != DeviceModel.SERVICE_UUID:
+                    continue
+                for characteristic in service.characteristics:
+                    if characteristic.uuid == DeviceModel.CHARACTERISTIC_UUID_READ:
+                        connection.notify_characteristic = characteristic
+                    if characteristic.uuid == DeviceModel.CHARACTERISTIC_UUID_WRITE:
+                        connection.writer_characteristic = characteristic
+            if connection.notify_characteristic is None:
+                await client.disconnect()
+                raise ValueError(
+                    "No matching services or characteristic found: "
+                    f"{connection.address}"
+                )
+
+        await client.start_notify(
+            connection.notify_characteristic.handle, connection.dispatch
+        )
+        if not connection.configured:
+            await self._configure(connection)
+        if connection.device is not None:
+            # The leased model still holds the client of the broken connection
+            connection.device.attachConnection(client, connection.writer_characteristic)
+            connection.device.sample_rate_hz = connection.sample_rate_hz
+        connection.last_notification_time = time.monotonic()
+        self.logger.info(f"Pooled connection is ready: {connection.address}")
+
+    async def _configure(self, connection: PooledConnection):
+        # Register replies arrive as notifications,
+        # so they are routed to a temporary model
+        device = DeviceModel(
+            connection.address,
+            connection.address,
+            lambda _: None,
+            self.logger,
+            output_config=self.output_config,
+        )
+        device.attachConnection(connection.client, connection.writer_characteristic)
+        listener, connection.listener = connection.listener, device.onDataReceived
+        try:
+            await device.setupOutput()
+            connection.sample_rate_hz = device.sample_rate_hz
+            connection.configured = True
+        finally:
+            connection.listener = listener
+            device.isOpen = False
+
+    async def _reconnect(self, connection: PooledConnection):
+        connection.reconnect_count += 1
+        try:
+            if connection.client is not None and connection.client.is_connected:
+                await connection.client.disconnect()
+            await self._connect(connection)
+        except Exception as ex:
+            self.logger.warning(f"Reconnection failed: {connection.address}: {ex}")
+
+    async def _health_check(self):
+        while not self._finished:
+            await asyncio.sleep(self.health_check_interval)
+            now = time.monotonic()
+            for connection in self.connections.values():
+                if self._finished:
+                    break
+                # A connection that no longer delivers
+                # notifications is treated as broken
+                stale = (
+                    connection.last_notification_time is not None
+                    and now - connection.last_notification_time > self.stale_timeout
+                )
+                if not connection.is_connected or stale:
+                    self.logger.warning(f"Reconnecting device: {connection.address}")
+                    await self._reconnect(connection)
+
+    async def _disconnect_all(self):
+        for connection in self.connections.values():
+            if not connection.is_connected:
+                continue
+            try:
+                await connection.client.stop_notify(
+                    connection.notify_characteristic.handle
+                )
+                await connection.client.disconnect()
+            except Exception as ex:
+                self.logger.warning(f"Disconnection failed: {connection.address}: {ex}")
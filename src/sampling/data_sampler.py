@@ -1,5 +1,5 @@
 import os
-from typing import List, Callable
+from typing import List, Callable, Union
 from enum import Enum
 from datetime import datetime
 
@@ -7,6 +7,10 @@ import pandas as pd
 
 from .util.app import App
 from .device_handler import BaseDeviceHandler, DemoDeviceHandler
+from .connection_pool import DeviceConnectionPool
+from .recorder import StreamingRecorder
+from .raw_store import RawCaptureWriter
+from .session_log import SessionLog
 
 
 class SamplingMode(Enum):
@@ -32,6 +36,12 @@ class PairDataSampler:
             None,
         ] = None,
         on_terminated: Callable[[], None] = None,
+        connection_pool: DeviceConnectionPool = None,
+        output_config: dict = None,
+        recording_dir_path: str = None,
+        recorder_config: dict = None,
+        raw_capture: bool = False,
+        ingest_config: dict = None,
     ):
         self.app = App()
         self.device1_name = device1_name
@@ -44,8 +54,27 @@ class PairDataSampler:
 
         self.start_date = None
 
+        # When recording_dir_path is given,
+        # samples are streamed to disk during sampling.
+        # recorder_config holds the keyword arguments of StreamingRecorder.
+        self.recording_dir_path = recording_dir_path
+        self.recorder_config = recorder_config or {}
+        # In the raw capture mode, undecoded sensor
+        # codes are stored instead of CSV files
+        self.raw_capture = raw_capture
+        if raw_capture and recording_dir_path is None:
+            raise ValueError("Raw capture mode needs recording_dir_path")
+        self.recorders: list[Union[StreamingRecorder, RawCaptureWriter]] = []
+        # With ingest_config (keyword arguments of SensorIngest),
+        # each device is received
+        # and decoded in its own process and the samples are read from shared memory
+        if raw_capture and ingest_config is not None:
+            raise ValueError("Raw capture mode does not work with the ingest process")
+
         self.device1_finished = False
         self.device2_finished = False
+        # Processes each device as soon as its segment ends, see set_pipelined_features
+        self.pipelined_features = None
 
         if mode == SamplingMode.DEMO:
             handler = DemoDeviceHandler
@@ -60,6 +89,9 @@ class PairDataSampler:
             device1_address,
             self.on_sensor_update,
             self.on_device1_terminated,
+            connection_pool,
+            output_config,
+            ingest_config,
         )
         self.device2_handler = handler(
             self.app,
@@ -67,11 +99,51 @@ class PairDataSampler:
             device2_address,
             self.on_sensor_update,
             self.on_device2_terminated,
+            connection_pool,
+            output_config,
+            ingest_config,
         )
 
+    def set_online_features(self, online_features):
+        # Motion segments are passed to online_features
+        # (feature.online.OnlinePairFeatures)
+        # while sampling, device1 as index 0 and device2 as index 1
+        if self.mode != SamplingMode.DEMO:
+            raise ValueError("Online features need the demo sampling mode")
+        for device_idx, handler in enumerate(
+            [self.device1_handler, self.device2_handler]
+        ):
+            handler.online_features = online_features
+            handler.online_device_idx = device_idx
+            handler.online_pushed = 0
+
+    def set_pipelined_features(self, pipelined_features):
+        # The motion segment of each device is passed to pipelined_features
+        # (encapsulate_preprocess.PipelinedPairFeatures) when the device terminates
+        if self.mode != SamplingMode.DEMO:
+            raise ValueError("Pipelined features need the demo sampling mode")
+        self.pipelined_features = pipelined_features
+
+    def set_sample_listener(self, listener: Callable[[int, int, List[float]], None]):
+        # listener(device index, monotonic time, row)
+        # is called for every sample of both devices
+        if self.raw_capture:
+            # Raw frames are stored undecoded, so no decoded sample is ever produced
+            raise ValueError("Sample listener does not work with the raw capture mode")
+        for device_idx, handler in enumerate(
+            [self.device1_handler, self.device2_handler]
+        ):
+            handler.sample_listener = (
+                lambda time_ns, row, device_idx=device_idx: listener(
+                    device_idx, time_ns, row
+                )
+            )
+
     def run(self):
         try:
             self.start_date = datetime.now()
+            if self.recording_dir_path is not None:
+                self._start_recording()
             self.device1_handler.start()
             self.device2_handler.start()
             self.app.add_event(self._check_finished)
@@ -89,10 +161,45 @@ class PairDataSampler:
                 self.device1_handler.stop()
             if not self.device2_finished:
                 self.device2_handler.stop()
+            # Also on an abnormal termination, the samples received so far are kept
+            self._finalize_recording()
 
         if self.on_terminated is not None:
             self.on_terminated()
 
+    def _start_recording(self):
+        for handler, (_, data_filename) in zip(
+            [self.device1_handler, self.device2_handler], self._data_filenames()
+        ):
+            output_path = os.path.join(self.recording_dir_path, data_filename)
+            if self.raw_capture:
+                recorder = RawCaptureWriter(output_path, handler.wall_clock_anchor)
+                handler.device.raw_writer = recorder
+            else:
+                recorder = StreamingRecorder(
+                    output_path, handler.sensor_data_labels, **self.recorder_config
+                )
+                recorder.start()
+                handler.recorder = recorder
+            self.recorders.append(recorder)
+
+    def _finalize_recording(self):
+        for recorder in self.recorders:
+            try:
+                recorder.finalize()
+            except Exception as ex:
+                print(f"Recording could not be finalized: {recorder.output_path}: {ex}")
+
+    def _data_filenames(self) -> list[tuple[str, str]]:
+        # (device name, path relative to the output directory)
+        formatted_date = self.start_date.strftime("%Y%m%d%H%M%S")
+        pair_dir_name = f"{formatted_date}_{self.device1_name}_{self.device2_name}"
+        extension = "raw" if self.raw_capture else "csv"
+        return [
+            (name, os.path.join(pair_dir_name, f"{formatted_date}_{name}.{extension}"))
+            for name in [self.device1_name, self.device2_name]
+        ]
+
     def _check_finished(self):
         # Check if two devices are terminated
         if self.device1_finished and self.device2_finished:
@@ -103,7 +210,7 @@ class PairDataSampler:
     def on_sensor_update(
         self,
         sensor_name: str,
-        time: datetime,
+        time: int,
         acc: list[float],
         gyro: list[float],
         angle: list[float],
@@ -113,11 +220,24 @@ class PairDataSampler:
             self.on_update(sensor_name, time, acc, gyro, angle, mag)
 
     def on_device1_terminated(self, sensor_name: str):
+        self._finish_pipelined_features(0)
         self.device1_finished = True
 
     def on_device2_terminated(self, sensor_name: str):
+        self._finish_pipelined_features(1)
         self.device2_finished = True
 
+    def _finish_pipelined_features(self, device_idx: int):
+        # Called before the finished flag is set, so the job exists when sampling ends
+        if self.pipelined_features is None:
+            return
+        handlers = [self.device1_handler, self.device2_handler]
+        self.pipelined_features.finish(
+            device_idx,
+            handlers[device_idx].get_sensor_data(),
+            handlers[1 - device_idx].segment_start_time(),
+        )
+
     def get_data(self) -> tuple[pd.DataFrame, pd.DataFrame]:
         if not (self.device1_finished and self.device2_finished):
             raise ValueError("Data sampling is not finished")
@@ -135,47 +255,44 @@ class PairDataSampler:
         if not (self.device1_finished and self.device2_finished):
             raise ValueError("Data sampling is not finished")
 
-        if not os.path.exists(output_dir_path):
-            os.makedirs(output_dir_path)
-
         formatted_date = self.start_date.strftime("%Y%m%d%H%M%S")
-
-        pair_dir_name = f"{formatted_date}_{self.device1_name}_{self.device2_name}"
-        if not os.path.exists(os.path.join(output_dir_path, pair_dir_name)):
-            os.makedirs(os.path.join(output_dir_path, pair_dir_name))
-
-        device1_data_filename = f"{formatted_date}_{self.device1_name}.csv"
-        device1_data_filename = os.path.join(pair_dir_name, device1_data_filename)
-        device2_data_filename = f"{formatted_date}_{self.device2_name}.csv"
-        device2_data_filename = os.path.join(pair_dir_name, device2_data_filename)
-
+        (_, device1_data_filename), (_, device2_data_filename) = self._data_filenames()
         print("output_dir_path: ", output_dir_path)
-        device1_data_output_path = os.path.join(output_dir_path, device1_data_filename)
-        device2_data_output_path = os.path.join(output_dir_path, device2_data_filename)
-
-        device1_data = self.device1_handler.get_sensor_data()
-        device2_data = self.device2_handler.get_sensor_data()
-        device1_data.to_csv(device1_data_output_path, index=False)
-        device2_data.to_csv(device2_data_output_path, index=False)
-
-        info_filename = "sensor_data_info.csv"
-        column = [
-            "start_date",
-            "user1_name",
-            "user1_data_path",
-            "user1_device_address",
-            "user2_name",
-            "user2_data_path",
-            "user2_device_address",
-            "remark",
-        ]
-        infofile_output_path = os.path.join(output_dir_path, info_filename)
 
-        info_text = f"{formatted_date},{self.device1_name},{device1_data_filename},{self.device1_address},{self.device2_name},{device2_data_filename},{self.device2_address},{remark}\n"
-        if os.path.exists(infofile_output_path):
-            with open(infofile_output_path, "a") as f:
-                f.write(info_text)
+        if self.recorders:
+            # Already written by the recorders during sampling
+            if os.path.abspath(self.recording_dir_path) != os.path.abspath(
+                output_dir_path
+            ):
+                raise ValueError(
+                    f"Data was recorded to {self.recording_dir_path}, "
+                    f"not to {output_dir_path}"
+                )
         else:
-            with open(infofile_output_path, "w") as f:
-                f.write(",".join(column) + "\n")
-                f.write(info_text)
+            device1_data_output_path = os.path.join(
+                output_dir_path, device1_data_filename
+            )
+            device2_data_output_path = os.path.join(
+                output_dir_path, device2_data_filename
+            )
+            os.makedirs(os.path.dirname(device1_data_output_path), exist_ok=True)
+
+            # Saved timestamps are epoch nanoseconds
+            device1_data = self.device1_handler.get_sensor_data(wall_clock=True)
+            device2_data = self.device2_handler.get_sensor_data(wall_clock=True)
+            device1_data.to_csv(device1_data_output_path, index=False)
+            device2_data.to_csv(device2_data_output_path, index=False)
+
+        # Sessions are appended to the session log instead of sensor_data_info.csv
+        SessionLog(output_dir_path).append(
+            {
+                "start_date": formatted_date,
+                "user1_name": self.device1_name,
+                "user1_data_path": device1_data_filename,
+                "user1_device_address": self.device1_address,
+                "user2_name": self.device2_name,
+                "user2_data_path": device2_data_filename,
+                "user2_device_address": self.device2_address,
+                "remark": remark,
+            }
+        )
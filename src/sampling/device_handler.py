@@ -3,15 +3,19 @@ from threading import Thread
 
 from itertools import product
 
+import time
+
 import numpy as np
 import pandas as pd
-import datetime
 
 from typing import List, Callable
 
 from .util.app import App
 from .util.app_notifier import AppNotifierBase
 from .device_model import DeviceModel
+from .connection_pool import DeviceConnectionPool
+from .ingest import SensorIngest
+from .recorder import StreamingRecorder
 
 
 class MotionSegmentDeterminator:
@@ -69,13 +73,37 @@ class BaseDeviceHandler(AppNotifierBase):
             None,
         ],
         on_terminated: Callable[[], None],
+        connection_pool: DeviceConnectionPool = None,
+        output_config: dict = None,
+        ingest_config: dict = None,
     ) -> None:
         super().__init__(app)
         # TODO: Check address
         self.name = name
-        self.device = DeviceModel(name, device_adress, self.updateData)
+        self.device_adress = device_adress
+        # A pooled device is configured by the pool when it connects
+        self.device = DeviceModel(
+            name,
+            device_adress,
+            self.updateData,
+            output_config=None if connection_pool is not None else output_config,
+        )
         self.on_update = on_update
         self.on_terminated = on_terminated
+        # When a connection pool is given,
+        # the device is leased instead of being connected
+        self.connection_pool = connection_pool
+        self.lease = None
+        # When ingest_config is given,
+        # a separate process owns the connection and the decoding.
+        # ingest_config holds the keyword arguments of SensorIngest.
+        self.ingest = None
+        if ingest_config is not None:
+            if connection_pool is not None:
+                raise ValueError("The ingest process does not use the connection pool")
+            self.ingest = SensorIngest(
+                name, device_adress, output_config, **ingest_config
+            )
 
         self.thread = Thread(target=self._run_thread)
 
@@ -92,10 +120,21 @@ class BaseDeviceHandler(AppNotifierBase):
             "".join(pair)
             for pair in product(self.sensor_data_triaxial_labels, ["X", "Y", "Z"])
         ]
-        self.sensor_data = np.empty((0, len(self.sensor_data_labels)))
-
-        # "{}-{}-{} {}:{}:{}:{}".format(year, mon, day, hour, minute, sec, mils),
-        self.current_time: str = ""  # Date and time of sensor data acquisition
+        # Timestamps and sensor values are kept in separate lists,
+        # so that the int64 timestamps do not lose precision by being cast to float
+        self.time_data: List[int] = []
+        self.sensor_data: List[List[float]] = []
+        # When a recorder is set, samples are streamed
+        # to disk instead of being kept in memory
+        self.recorder: StreamingRecorder = None
+        # Called with (monotonic time, row) for every sample,
+        # e.g. for continuous authentication
+        self.sample_listener: Callable[[int, List[float]], None] = None
+
+        # Timestamps are time.monotonic_ns() values.
+        # The wall clock anchor converts them to epoch nanoseconds once per session.
+        self.wall_clock_anchor = (time.time_ns(), time.monotonic_ns())
+        self.current_time: int = 0  # monotonic time of sensor data acquisition [ns]
 
         # (x,y,z)
         self.current_acc: List[float] = [0, 0, 0]  # acceleration
@@ -134,7 +173,7 @@ class BaseDeviceHandler(AppNotifierBase):
             print("Missing data !")
             return
 
-        self.current_time = datetime.datetime.now()
+        self.current_time = device.sampleTime
 
         # Update currently acquired data
         for i in range(len(xyz_key)):
@@ -147,37 +186,70 @@ class BaseDeviceHandler(AppNotifierBase):
 
         # Binding to time series data
         # print(f"Sensor name: {sensor_name}, time: {time}")
-        row = np.array([])
+        row = []
         # Combine by label order
-        for basic_label in self.sensor_data_basic_labels:
-            if basic_label == "time":
-                row = np.append(row, self.current_time)
         for triaxial_label in self.sensor_data_triaxial_labels:
             if triaxial_label == "acc":
-                row = np.append(row, self.current_acc)
+                row += self.current_acc
             elif triaxial_label == "gyro":
-                row = np.append(row, self.current_gyro)
+                row += self.current_gyro
             elif triaxial_label == "angle":
-                row = np.append(row, self.current_angle)
+                row += self.current_angle
             elif triaxial_label == "mag":
-                row = np.append(row, self.current_mag)
-        self.sensor_data = np.vstack([self.sensor_data, row])
-
-    def get_sensor_data(self):
-        time_data = self.sensor_data[:, 0]
-        float_data = self.sensor_data[:, 1:].astype(float)
-        # self.sensor_dataはdatetime型とfloat型が混在しているため、float型がobject型にキャストされてしまう
-        # よってdataframe変換時にリキャストする
+                row += self.current_mag
+        if self.sample_listener is not None:
+            self.sample_listener(self.current_time, row)
+        if self.recorder is not None:
+            self.recorder.append(self.to_wall_clock_ns(self.current_time), row)
+            return
+        self.time_data.append(self.current_time)
+        self.sensor_data.append(row)
+
+    def to_wall_clock_ns(self, monotonic_ns: np.ndarray) -> np.ndarray:
+        wall_clock_ns, anchor_monotonic_ns = self.wall_clock_anchor
+        return monotonic_ns - anchor_monotonic_ns + wall_clock_ns
+
+    def get_sensor_data(self, wall_clock: bool = False):
+        # time column is int64 nanoseconds,
+        # monotonic clock or epoch if wall_clock is True
+        for recorder in [self.recorder, self.device.raw_writer]:
+            if recorder is not None:
+                raise ValueError(
+                    f"Sensor data is streamed to {recorder.output_path} "
+                    "and not kept in memory"
+                )
+        float_data = np.array(self.sensor_data, dtype=float).reshape(
+            len(self.sensor_data), len(self.sensor_data_labels) - 1
+        )
+        time_data = np.array(self.time_data, dtype=np.int64)
+        if wall_clock:
+            time_data = self.to_wall_clock_ns(time_data)
         df = pd.DataFrame(float_data, columns=self.sensor_data_labels[1:])
         df.insert(0, self.sensor_data_basic_labels[0], time_data)
         return df
 
     def start(self):
         super().start()
-        self.thread.start()
+        if self.ingest is not None:
+            self.ingest.start(self.device)
+        elif self.connection_pool is not None:
+            self.lease = self.connection_pool.lease(
+                self.device_adress, self.device.onDataReceived, self.device
+            )
+            self.device.sample_rate_hz = self.lease.sample_rate_hz
+        else:
+            self.thread.start()
 
     def stop(self):
-        self.device.closeDevice()
+        if self.ingest is not None:
+            self.ingest.stop()
+        elif self.lease is not None:
+            # Keep the pooled connection open for the next session
+            self.lease.release()
+            self.lease = None
+            self.device.isOpen = False
+        else:
+            self.device.closeDevice()
         self.on_terminated(self.name)
 
     def _run_thread(self):
@@ -203,10 +275,28 @@ class DemoDeviceHandler(BaseDeviceHandler):
             None,
         ],
         on_terminated: Callable[[], None],
+        connection_pool: DeviceConnectionPool = None,
+        output_config: dict = None,
+        ingest_config: dict = None,
     ) -> None:
-        super().__init__(app, name, device_adress, on_update, on_terminated)
+        super().__init__(
+            app,
+            name,
+            device_adress,
+            on_update,
+            on_terminated,
+            connection_pool,
+            output_config,
+            ingest_config,
+        )
         # Variables for Individual Motion Interval Extraction
         self.motion_segment_determinator = MotionSegmentDeterminator()
+        # When set, samples of the motion segment are
+        # passed to the accumulator as they arrive.
+        # online_features has push(device_idx, time, row) and finish(device_idx).
+        self.online_features = None
+        self.online_device_idx = None
+        self.online_pushed = 0
 
     def updateData(self, device: DeviceModel):
         if self.motion_segment_determinator.finished:
@@ -219,11 +309,40 @@ class DemoDeviceHandler(BaseDeviceHandler):
             self.current_gyro, len(self.sensor_data) - 1
         )
 
+        if self.online_features is not None:
+            self._push_online_features()
+
         if self.motion_segment_determinator.finished:
             self.stop()
 
-    def get_sensor_data(self):
-        df = super().get_sensor_data()
+    def _push_online_features(self):
+        start_idx = self.motion_segment_determinator.start_idx
+        if start_idx is None:
+            return
+        start_idx = max(start_idx, 0)
+        # The sample at end_idx is not a part of the segment
+        if self.motion_segment_determinator.finished:
+            end_idx = self.motion_segment_determinator.end_idx
+        else:
+            end_idx = len(self.sensor_data)
+        while start_idx + self.online_pushed < end_idx:
+            idx = start_idx + self.online_pushed
+            self.online_features.push(
+                self.online_device_idx, self.time_data[idx], self.sensor_data[idx]
+            )
+            self.online_pushed += 1
+        if self.motion_segment_determinator.finished:
+            self.online_features.finish(self.online_device_idx)
+
+    def segment_start_time(self) -> int:
+        # Time of the first sample of the motion segment, None until the motion starts
+        start_idx = self.motion_segment_determinator.start_idx
+        if start_idx is None:
+            return None
+        return self.time_data[max(start_idx, 0)]
+
+    def get_sensor_data(self, wall_clock: bool = False):
+        df = super().get_sensor_data(wall_clock)
         extract_df = df.iloc[
             self.motion_segment_determinator.start_idx : self.motion_segment_determinator.end_idx,
             :,
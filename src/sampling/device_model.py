@@ -4,14 +4,66 @@ import time
 import struct
 import bleak
 import asyncio
+from enum import IntFlag
 
 from logging import getLogger
 
+from .raw_store import SENSOR_PACKETS
+
 default_logger = getLogger(__name__)
 
 # https://github.com/WITMOTION/WitBluetooth_BWT901C
 
 
+# 寄存器地址 Register address
+REG_SAVE = 0x00
+REG_RSW = 0x02  # 输出内容 Output content
+REG_RRATE = 0x03  # 输出速率 Output rate
+REG_KEY = 0x69  # 解锁 Unlock
+
+
+# 输出内容 Output content (RSW)
+class OutputContent(IntFlag):
+    TIME = 0x01
+    ACC = 0x02
+    GYRO = 0x04
+    ANGLE = 0x08
+    MAG = 0x10
+
+    @classmethod
+    def from_names(cls, names):
+        content = cls(0)
+        for name in names:
+            content |= cls[name.upper()]
+        return content
+
+
+# 输出速率 Output rate (RRATE), Hz: register value
+OUTPUT_RATES = {
+    0.2: 0x01,
+    0.5: 0x02,
+    1: 0x03,
+    2: 0x04,
+    5: 0x05,
+    10: 0x06,
+    20: 0x07,
+    50: 0x08,
+    100: 0x09,
+    200: 0x0B,
+}
+
+
+def make_output_config(rate_hz=None, content=None):
+    # Build the output_config of DeviceModel from config values,
+    # e.g. content=["acc", "gyro"]
+    output_config = {}
+    if rate_hz is not None:
+        output_config["rate_hz"] = rate_hz
+    if content is not None:
+        output_config["content"] = OutputContent.from_names(content)
+    return output_config or None
+
+
 # 设备实例 Device instance
 class DeviceModel:
     # region 属性 attribute
@@ -27,9 +79,21 @@ class DeviceModel:
     # 临时数组 Temporary array
     TempBytes = []
 
+    # 设备UUID常量 Device UUID constant
+    SERVICE_UUID = "49535343-fe7d-4ae5-8fa9-9fafd205e455"
+    CHARACTERISTIC_UUID_READ = "49535343-1e4d-4bd9-ba61-23c647249616"
+    CHARACTERISTIC_UUID_WRITE = "49535343-8841-43f4-a8d4-ecbe34729bb3"
+
     # endregion
 
-    def __init__(self, deviceName, mac, callback_method, logger=default_logger):
+    def __init__(
+        self,
+        deviceName,
+        mac,
+        callback_method,
+        logger=default_logger,
+        output_config=None,
+    ):
         self.logger = logger
         self.logger.debug("Initialize device model")
 
@@ -41,6 +105,23 @@ class DeviceModel:
         self.isOpen = False
         self.callback_method = callback_method
         self.deviceData = {}
+        # Each device needs its own frame buffer,
+        # otherwise frames of two devices get mixed
+        self.TempBytes = []
+        # Output rate in Hz, None until it is configured or read from the device
+        self.sample_rate_hz = None
+        self.output_content = None
+        # {"rate_hz": ..., "content": OutputContent} applied when the device is opened
+        self.output_config = output_config
+        # time.monotonic_ns() of the latest sample
+        self.sampleTime = None
+        # RawCaptureWriter. When set,
+        # sensor frames are stored undecoded instead of processData
+        self.raw_writer = None
+        # Reply of readReg. The reply does not contain the address,
+        # so only one read runs at a time
+        self._read_future = None
+        self._read_lock = None
 
     # region 获取设备数据 Obtain device data
     # 设置设备数据 Set device data
@@ -70,10 +151,9 @@ class DeviceModel:
         async with bleak.BleakClient(self.mac) as client:
             self.client = client
             self.isOpen = True
-            # 设备UUID常量 Device UUID constant
-            target_service_uuid = "49535343-fe7d-4ae5-8fa9-9fafd205e455"
-            target_characteristic_uuid_read = "49535343-1e4d-4bd9-ba61-23c647249616"
-            target_characteristic_uuid_write = "49535343-8841-43f4-a8d4-ecbe34729bb3"
+            target_service_uuid = self.SERVICE_UUID
+            target_characteristic_uuid_read = self.CHARACTERISTIC_UUID_READ
+            target_characteristic_uuid_write = self.CHARACTERISTIC_UUID_WRITE
             notify_characteristic = None
 
             self.logger.debug("Matching services......")
@@ -100,6 +180,7 @@ class DeviceModel:
                 await client.start_notify(
                     notify_characteristic.uuid, self.onDataReceived
                 )
+                await self.setupOutput()
 
                 # 保持连接打开 Keep connected and open
                 try:
@@ -114,6 +195,15 @@ class DeviceModel:
             else:
                 self.logger.warning("No matching services or characteristic found")
 
+    # 使用已连接的设备 Use a connection opened by DeviceConnectionPool
+    def attachConnection(self, client, writer_characteristic):
+        self.client = client
+        self.writer_characteristic = writer_characteristic
+        self.TempBytes.clear()
+        self.sampleTime = None
+        self.isOpen = True
+        self.logger.info("The device is attached to a pooled connection")
+
     # 关闭设备  close Device
     def closeDevice(self):
         self.isOpen = False
@@ -122,8 +212,10 @@ class DeviceModel:
     # region 数据解析 data analysis
     # 串口数据处理  Serial port data processing
     def onDataReceived(self, sender, data):
-        tempdata = bytes.fromhex(data.hex())
-        for var in tempdata:
+        # A notification may contain several frames, they all share one receive time
+        receive_time_ns = time.monotonic_ns()
+        frames = []
+        for var in data:
             self.TempBytes.append(var)
             # 必须是0x55开头 Must start with 0x55
             if self.TempBytes[0] != 0x55:
@@ -132,12 +224,36 @@ class DeviceModel:
             if len(self.TempBytes) == 11:
                 # 检验和判断 Checksum
                 if (sum(self.TempBytes[:10]) & 0xFF) == self.TempBytes[10]:
-                    self.processData(self.TempBytes)
+                    frames.append(self.TempBytes.copy())
                     self.TempBytes.clear()
                 else:
                     del self.TempBytes[0]
                     continue
 
+        # Acceleration frames mark samples.
+        # The last sample of the notification gets the receive
+        # time and the earlier ones are spaced backwards by the sampling period.
+        sample_count = sum(1 for frame in frames if frame[1] == 0x51)
+        sample_idx = 0
+        for frame in frames:
+            if frame[1] == 0x51:
+                self._updateSampleTime(receive_time_ns, sample_count - 1 - sample_idx)
+                sample_idx += 1
+            if self.raw_writer is not None and frame[1] in SENSOR_PACKETS:
+                self.raw_writer.append(frame, self.sampleTime)
+                continue
+            self.processData(frame)
+
+    def _updateSampleTime(self, receive_time_ns, samples_before_end):
+        sample_time_ns = receive_time_ns
+        if self.sample_rate_hz:
+            sample_time_ns -= int(samples_before_end * 1e9 / self.sample_rate_hz)
+        # Keep the timestamps non-decreasing even
+        # if notifications are delayed irregularly
+        if self.sampleTime is not None and sample_time_ns < self.sampleTime:
+            sample_time_ns = self.sampleTime
+        self.sampleTime = sample_time_ns
+
     # 数据解析 data analysis
     def processData(self, Bytes):
         # なぜか呼ばれない
@@ -188,9 +304,22 @@ class DeviceModel:
             self.set("HX", round(Hx, 3))
             self.set("HY", round(Hy, 3))
             self.set("HZ", round(Hz, 3))
+        # 寄存器值 Register values (reply of readReg)
+        elif Bytes[1] == 0x5F:
+            values = [Bytes[i + 1] << 8 | Bytes[i] for i in range(2, 10, 2)]
+            future = self._read_future
+            if future is not None and not future.done():
+                future.get_loop().call_soon_threadsafe(
+                    self._resolve_read, future, values
+                )
         else:
             pass
 
+    @staticmethod
+    def _resolve_read(future, values):
+        if not future.done():
+            future.set_result(values)
+
     # 获得int16有符号数 Obtain int16 signed number
     @staticmethod
     def getSignInt16(num):
@@ -211,22 +340,93 @@ class DeviceModel:
             self.logger.error(ex)
 
     # 读取寄存器 read register
-    async def readReg(self, regAddr):
-        # 封装读取指令并向串口发送数据 Encapsulate read instructions and send data to the serial port
-        await self.sendData(self.get_readBytes(regAddr))
+    async def readReg(self, regAddr, timeout=1.0):
+        # Returns the values of the 4 registers starting at regAddr
+        if self._read_lock is None:
+            self._read_lock = asyncio.Lock()
+        async with self._read_lock:
+            self._read_future = asyncio.get_running_loop().create_future()
+            try:
+                # 封装读取指令并向串口发送数据 Encapsulate read instructions and send data to the serial port
+                await self.sendData(self.get_readBytes(regAddr))
+                return await asyncio.wait_for(self._read_future, timeout)
+            finally:
+                self._read_future = None
 
     # 写入寄存器 Write Register
     async def writeReg(self, regAddr, sValue):
+        await self.writeRegs({regAddr: sValue}, confirm=False)
+
+    # 批量写入寄存器 Write registers in one unlock/save cycle
+    async def writeRegs(self, values, confirm=True, interval=0.1):
         # 解锁 unlock
-        self.unlock()
+        await self.unlock()
         # 延迟100ms Delay 100ms
-        time.sleep(0.1)
-        # 封装写入指令并向串口发送数据
-        await self.sendData(self.get_writeBytes(regAddr, sValue))
-        # 延迟100ms Delay 100ms
-        time.sleep(0.1)
+        await asyncio.sleep(interval)
+        for regAddr, sValue in values.items():
+            # 封装写入指令并向串口发送数据
+            await self.sendData(self.get_writeBytes(regAddr, sValue))
+            await asyncio.sleep(interval)
         # 保存 save
-        self.save()
+        await self.save()
+        await asyncio.sleep(interval)
+
+        if confirm:
+            # Read the registers back to make sure that the device accepted the values
+            for regAddr, sValue in values.items():
+                actual = (await self.readReg(regAddr))[0]
+                if actual != sValue:
+                    raise ValueError(
+                        f"Register 0x{regAddr:02X} was not written: "
+                        f"expected 0x{sValue:04X}, actual 0x{actual:04X}"
+                    )
+
+    # 设置输出 Configure output rate and content
+    async def configureOutput(self, rate_hz=None, content=None, confirm=True):
+        values = {}
+        if content is not None:
+            values[REG_RSW] = int(content)
+        if rate_hz is not None:
+            if rate_hz not in OUTPUT_RATES:
+                raise ValueError(
+                    f"Invalid output rate: {rate_hz}, available: {list(OUTPUT_RATES)}"
+                )
+            values[REG_RRATE] = OUTPUT_RATES[rate_hz]
+        if not values:
+            return
+
+        await self.writeRegs(values, confirm)
+        if rate_hz is not None:
+            self.sample_rate_hz = rate_hz
+        if content is not None:
+            self.output_content = OutputContent(content)
+
+    # 初始化输出 Configure the output and learn the sample rate
+    async def setupOutput(self):
+        # A failure is logged and the device keeps streaming with its current settings.
+        # Without rate_hz the rate is read back,
+        # timestamps are interpolated only when it is known.
+        try:
+            if self.output_config:
+                await self.configureOutput(**self.output_config)
+            if self.sample_rate_hz is None:
+                await self.readOutputConfig()
+        except (asyncio.TimeoutError, ValueError) as ex:
+            self.logger.error(f"Output configuration of {self.deviceName} failed: {ex}")
+        if self.sample_rate_hz is None:
+            self.logger.warning(
+                f"Sample rate of {self.deviceName} is unknown, "
+                "samples of a packet share its time"
+            )
+
+    # 读取输出设置 Read output rate and content
+    async def readOutputConfig(self):
+        # RSW and RRATE are adjacent, so a single read returns both
+        rsw, rrate = (await self.readReg(REG_RSW))[:2]
+        rates = {v: k for k, v in OUTPUT_RATES.items()}
+        self.output_content = OutputContent(rsw & 0x1F)
+        self.sample_rate_hz = rates.get(rrate)
+        return self.sample_rate_hz, self.output_content
 
     # 读取指令封装 Read instruction encapsulation
     @staticmethod
@@ -253,11 +453,11 @@ class DeviceModel:
         return tempBytes
 
     # 解锁
-    def unlock(self):
-        cmd = self.get_writeBytes(0x69, 0xB588)
-        self.sendData(cmd)
+    async def unlock(self):
+        cmd = self.get_writeBytes(REG_KEY, 0xB588)
+        await self.sendData(cmd)
 
     # 保存
-    def save(self):
-        cmd = self.get_writeBytes(0x00, 0x0000)
-        self.sendData(cmd)
+    async def save(self):
+        cmd = self.get_writeBytes(REG_SAVE, 0x0000)
+        await self.sendData(cmd)
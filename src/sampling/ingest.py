@@ -0,0 +1,245 @@
+import asyncio
+import math
+import multiprocessing
+import time
+from logging import getLogger
+from multiprocessing.shared_memory import SharedMemory
+from threading import Event, Thread, current_thread
+from typing import Optional
+
+import numpy as np
+
+from .device_model import DeviceModel
+
+default_logger = getLogger(__name__)
+
+# deviceData keys of a sample, in the order of the values in the ring
+RING_KEYS = [
+    prefix + axis for prefix in ["Acc", "As", "Angle", "H"] for axis in ["X", "Y", "Z"]
+]
+
+# The write count is alone in the first cache line
+_HEADER_BYTES = 64
+
+
+def make_ingest_config(
+    enabled: bool, ring_capacity: int = 4096, poll_interval_sec: float = 0.005
+) -> Optional[dict]:
+    # Build the ingest_config of the device handlers from config values
+    if not enabled:
+        return None
+    return {"ring_capacity": ring_capacity, "poll_interval_sec": poll_interval_sec}
+
+
+class SharedSampleRing:
+    """
+    共有メモリ上のサンプルのリングバッファ
+
+    書き込みは1プロセス、読み込みは1プロセスのみ
+    書き込み側はスロットを書いてから書き込み数を進め、読み込み側は読んだ後に書き込み数を確認して
+    読んでいる間に上書きされた可能性のあるサンプルを捨てる
+    """
+
+    def __init__(
+        self, capacity: int, name: str = None, n_channels: int = len(RING_KEYS)
+    ):
+        # Creates the block when name is None,
+        # otherwise attaches to the block of the writer
+        self.capacity = capacity
+        self.n_channels = n_channels
+        size = _HEADER_BYTES + capacity * 8 * (1 + n_channels)
+        self.shm = SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self._count = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self._time = np.ndarray(
+            (capacity,), dtype=np.int64, buffer=buf, offset=_HEADER_BYTES
+        )
+        self._values = np.ndarray(
+            (capacity, n_channels),
+            dtype=np.float64,
+            buffer=buf,
+            offset=_HEADER_BYTES + capacity * 8,
+        )
+        if name is None:
+            self._count[0] = 0
+        self._written = int(self._count[0])
+
+    def write(self, time_ns: int, row: list[float]):
+        position = self._written % self.capacity
+        self._time[position] = time_ns
+        self._values[position] = row
+        self._written += 1
+        # Published after the slot, an aligned int64 store is not torn
+        self._count[0] = self._written
+
+    def read(self, start: int) -> tuple[int, list[int], list[list[float]]]:
+        # Samples from index start that are still valid:
+        # (index of the first, times, rows).
+        # The ring is read through views of the shared block,
+        # only the Python lists are new.
+        end = int(self._count[0])
+        first = max(start, end - self.capacity)
+        times = []
+        rows = []
+        for lo, hi in self._slices(first, end):
+            times += self._time[lo:hi].tolist()
+            rows += self._values[lo:hi].tolist()
+        # The sample being written when the count was
+        # read again overwrote index count - capacity
+        valid = int(self._count[0]) - self.capacity + 1
+        if valid > first:
+            drop = min(valid - first, len(times))
+            first += drop
+            times = times[drop:]
+            rows = rows[drop:]
+        return first, times, rows
+
+    def _slices(self, start: int, end: int) -> list[tuple[int, int]]:
+        if start >= end:
+            return []
+        lo = start % self.capacity
+        hi = lo + (end - start)
+        if hi <= self.capacity:
+            return [(lo, hi)]
+        return [(lo, self.capacity), (0, hi - self.capacity)]
+
+    def close(self):
+        # Views of the block must be released before it is closed
+        self._count = self._time = self._values = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _run_ingest(
+    name: str,
+    address: str,
+    ring_name: str,
+    capacity: int,
+    output_config: Optional[dict],
+    stop_event,
+):
+    # Entry point of the ingest process: BLE connection and decoding write to the ring
+    ring = SharedSampleRing(capacity, ring_name)
+
+    def on_sample(device: DeviceModel):
+        ring.write(
+            device.sampleTime,
+            [device.deviceData.get(key, math.nan) for key in RING_KEYS],
+        )
+
+    device = DeviceModel(name, address, on_sample, output_config=output_config)
+
+    def close_on_stop():
+        stop_event.wait()
+        device.closeDevice()
+
+    Thread(target=close_on_stop, daemon=True).start()
+    try:
+        asyncio.run(device.openDevice())
+    finally:
+        ring.close()
+
+
+class SensorIngest:
+    """
+    BLEの接続とデコードを別プロセスで行い、共有メモリのリングバッファ経由でサンプルを受け取るクラス
+
+    推論や画面の更新がGILを握っている間もサンプルの受信と時刻付けが遅れない
+    受け取ったサンプルはメインプロセスのDeviceModelに設定し、通常の受信と同じコールバックを呼ぶ
+    """
+
+    def __init__(
+        self,
+        name: str,
+        address: str,
+        output_config: dict = None,
+        ring_capacity: int = 4096,
+        poll_interval_sec: float = 0.005,
+        logger=default_logger,
+    ):
+        self.name = name
+        self.address = address
+        self.output_config = output_config
+        self.ring_capacity = ring_capacity
+        self.poll_interval_sec = poll_interval_sec
+        self.logger = logger
+        # Samples overwritten before the main process read them
+        self.lost_samples = 0
+        self.ring: SharedSampleRing = None
+        self.process = None
+        self._context = multiprocessing.get_context("spawn")
+        self._process_stop = self._context.Event()
+        self._stop = Event()
+        self._reader: Thread = None
+
+    def start(self, device: DeviceModel):
+        # Samples are passed to device.callback_method as DeviceModel.processData does
+        self.ring = SharedSampleRing(self.ring_capacity)
+        self.process = self._context.Process(
+            target=_run_ingest,
+            args=(
+                self.name,
+                self.address,
+                self.ring.name,
+                self.ring_capacity,
+                self.output_config,
+                self._process_stop,
+            ),
+            name=f"ingest-{self.name}",
+            daemon=True,
+        )
+        self.process.start()
+        self._reader = Thread(target=self._read_loop, args=(device,), daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        # Also called from the reader thread when the motion segment ends
+        self._stop.set()
+        self._process_stop.set()
+        if self._reader is not None and current_thread() is not self._reader:
+            self._reader.join()
+
+    def _read_loop(self, device: DeviceModel):
+        next_idx = 0
+        try:
+            while not self._stop.is_set():
+                first, times, rows = self.ring.read(next_idx)
+                self.lost_samples += first - next_idx
+                next_idx = first + len(times)
+                for time_ns, row in zip(times, rows):
+                    if self._stop.is_set():
+                        break
+                    self._deliver(device, time_ns, row)
+                if times:
+                    continue
+                if not self.process.is_alive():
+                    self.logger.warning(
+                        f"Ingest process of {self.name} "
+                        f"exited with {self.process.exitcode}"
+                    )
+                    break
+                time.sleep(self.poll_interval_sec)
+        finally:
+            self._process_stop.set()
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.ring.close()
+            self.ring.unlink()
+            if self.lost_samples:
+                self.logger.warning(
+                    f"{self.lost_samples} samples of {self.name} "
+                    "were overwritten in the ring"
+                )
+
+    @staticmethod
+    def _deliver(device: DeviceModel, time_ns: int, row: list[float]):
+        # Values not received yet by the ingest process are NaN and left missing
+        for key, value in zip(RING_KEYS, row):
+            if not math.isnan(value):
+                device.set(key, value)
+        device.sampleTime = time_ns
+        device.callback_method(device)
@@ -0,0 +1,155 @@
+import os
+import json
+from array import array
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from util.file import atomic_write
+
+# 数据包类型 Packet type: (column prefix, scale from the raw int16 code)
+PACKET_ACC = 0x51
+PACKET_GYRO = 0x52
+PACKET_ANGLE = 0x53
+PACKET_MAG = 0x54
+SENSOR_PACKETS = {
+    PACKET_ACC: ("acc", 16 / 32768),
+    PACKET_GYRO: ("gyro", 2000 / 32768),
+    PACKET_ANGLE: ("angle", 180 / 32768),
+    PACKET_MAG: ("mag", 1 / 120),
+}
+
+# Same column order as BaseDeviceHandler.sensor_data_labels
+SENSOR_DATA_LABELS = ["time"] + [
+    label + xyz for label in ["acc", "gyro", "mag", "angle"] for xyz in ["X", "Y", "Z"]
+]
+
+HEADER_FILENAME = "header.json"
+TIME_FILENAME = "time.i8"
+TYPE_FILENAME = "type.u1"
+VALUE_FILENAME = "value.i2"
+
+
+class RawCaptureWriter:
+    """
+    センサの生の値(int16)をそのまま保存するカラムストア
+
+    フレームごとにパケット種別(uint8)と3軸の値(int16)を、加速度のフレームごとに時刻(int64)を保存する
+    実数への変換は読み込み時にread_raw_capture()でまとめて行う
+    """
+
+    def __init__(
+        self,
+        capture_dir: str,
+        wall_clock_anchor: tuple[int, int],
+        flush_bytes: int = 64 * 1024,
+    ):
+        self.capture_dir = capture_dir
+        self.output_path = capture_dir
+        self.flush_bytes = flush_bytes
+        os.makedirs(capture_dir, exist_ok=True)
+
+        header = {
+            "version": 1,
+            "packets": {
+                str(packet_type): {"label": label, "scale": scale}
+                for packet_type, (label, scale) in SENSOR_PACKETS.items()
+            },
+            # (time.time_ns(), time.monotonic_ns()) to convert the saved monotonic times
+            "wall_clock_anchor": list(wall_clock_anchor),
+        }
+        with atomic_write(os.path.join(capture_dir, HEADER_FILENAME), "w") as f:
+            json.dump(header, f, indent=2)
+
+        self._time = array("q")
+        self._type = bytearray()
+        self._value = bytearray()
+        self._lock = Lock()
+        self._files = {
+            name: open(os.path.join(capture_dir, name), "ab")
+            for name in [TIME_FILENAME, TYPE_FILENAME, VALUE_FILENAME]
+        }
+        self.closed = False
+
+    def append(self, frame: list[int], sample_time_ns: int = None):
+        # Called from the BLE callback: only the bytes of the frame are copied
+        with self._lock:
+            # Frames arriving after finalize() are dropped
+            if self.closed:
+                return
+            self._type.append(frame[1])
+            self._value += bytes(frame[2:8])
+            if frame[1] == PACKET_ACC:
+                self._time.append(sample_time_ns)
+            if len(self._value) >= self.flush_bytes:
+                self._flush()
+
+    def _flush(self):
+        self._files[TIME_FILENAME].write(self._time.tobytes())
+        self._files[TYPE_FILENAME].write(self._type)
+        self._files[VALUE_FILENAME].write(self._value)
+        for f in self._files.values():
+            f.flush()
+        self._time = array("q")
+        self._type = bytearray()
+        self._value = bytearray()
+
+    def finalize(self) -> str:
+        with self._lock:
+            if not self.closed:
+                self._flush()
+                for f in self._files.values():
+                    os.fsync(f.fileno())
+                    f.close()
+                self.closed = True
+        return self.capture_dir
+
+
+def is_raw_capture(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, HEADER_FILENAME))
+
+
+def read_raw_capture(
+    capture_dir: str,
+    sensor_data_labels: list[str] = None,
+    wall_clock: bool = True,
+) -> pd.DataFrame:
+    # Rebuild the rows that the float pipeline
+    # produces: every acceleration frame is one sample,
+    # combined with the latest frame of the other packet types
+    with open(os.path.join(capture_dir, HEADER_FILENAME), "r") as f:
+        header = json.load(f)
+    time_data = np.fromfile(os.path.join(capture_dir, TIME_FILENAME), dtype="<i8")
+    packet_types = np.fromfile(os.path.join(capture_dir, TYPE_FILENAME), dtype=np.uint8)
+    values = np.fromfile(os.path.join(capture_dir, VALUE_FILENAME), dtype="<i2")
+    # A capture that was interrupted may end in the middle of a flush
+    frame_count = min(len(packet_types), len(values) // 3)
+    packet_types = packet_types[:frame_count]
+    values = values[: frame_count * 3].reshape(frame_count, 3)
+
+    frame_idx = np.arange(frame_count)
+    sample_frames = frame_idx[packet_types == PACKET_ACC][: len(time_data)]
+    time_data = time_data[: len(sample_frames)]
+
+    columns = {}
+    valid = np.ones(len(sample_frames), dtype=bool)
+    for packet_type, packet in header["packets"].items():
+        # Index of the latest frame of this type at each acceleration frame
+        latest = np.where(packet_types == int(packet_type), frame_idx, -1)
+        latest = np.maximum.accumulate(latest)[sample_frames]
+        valid &= latest >= 0
+        decoded = values[np.maximum(latest, 0)] * packet["scale"]
+        for axis, xyz in enumerate(["X", "Y", "Z"]):
+            columns[packet["label"] + xyz] = decoded[:, axis]
+
+    if wall_clock:
+        wall_clock_ns, anchor_monotonic_ns = header["wall_clock_anchor"]
+        time_data = time_data - anchor_monotonic_ns + wall_clock_ns
+
+    df = pd.DataFrame(columns)
+    df.insert(0, "time", time_data)
+    # Samples received before every packet type has
+    # arrived once are skipped, as in updateData
+    df = df[valid].reset_index(drop=True)
+    return df.loc[:, sensor_data_labels or SENSOR_DATA_LABELS]
@@ -0,0 +1,150 @@
+import os
+import time
+import queue
+import shutil
+from logging import getLogger
+from threading import Lock, Thread
+from typing import List
+
+from util.file import atomic_write
+
+default_logger = getLogger(__name__)
+
+
+class StreamingRecorder:
+    """
+    計測中のセンサデータを逐次ファイルに書き出すクラス
+
+    サンプルはchunk_size件ごとに書き込みスレッドへ渡され、メモリ上にはmax_pending_chunks件までしか保持しない
+    rotate_rowsを指定した場合はセグメントファイルに分割して書き込み、finalize()で1つのCSVにまとめる
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        columns: List[str],
+        chunk_size: int = 200,
+        max_pending_chunks: int = 64,
+        fsync_interval_sec: float = 5.0,
+        rotate_rows: int = None,
+        logger=default_logger,
+    ):
+        self.output_path = output_path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.fsync_interval_sec = fsync_interval_sec
+        self.rotate_rows = rotate_rows
+        self.logger = logger
+
+        self.segment_paths: List[str] = []
+        self.row_count = 0
+        self.finalized = False
+
+        self._chunk: List[str] = []
+        # append() runs on the BLE thread while finalize() runs on the sampling thread
+        self._lock = Lock()
+        self._closed = False
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending_chunks)
+        self._thread = Thread(target=self._run_writer, daemon=True)
+        self._error: Exception = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        self._thread.start()
+
+    def append(self, time_ns: int, row: List[float]):
+        # Called from the BLE callback, so only the text formatting is done here
+        line = f"{time_ns},{','.join(map(str, row))}\n"
+        with self._lock:
+            # Samples arriving after finalize() are dropped,
+            # the writer no longer reads the queue
+            if self._closed:
+                return
+            self._chunk.append(line)
+            if len(self._chunk) >= self.chunk_size:
+                self._put_chunk()
+
+    def _put_chunk(self):
+        # Called with self._lock held
+        if self._error is not None:
+            raise self._error
+        chunk, self._chunk = self._chunk, []
+        # Blocks when the writer falls behind, which keeps the memory bounded
+        self._queue.put(chunk)
+
+    def _segment_path(self, segment_idx: int) -> str:
+        if self.rotate_rows is None:
+            return self.output_path + ".partial"
+        return f"{self.output_path}.{segment_idx:04d}.partial"
+
+    def _open_segment(self):
+        path = self._segment_path(len(self.segment_paths))
+        self.segment_paths.append(path)
+        f = open(path, "w")
+        f.write(",".join(self.columns) + "\n")
+        return f
+
+    def _run_writer(self):
+        f = None
+        segment_rows = 0
+        last_fsync = time.monotonic()
+        try:
+            f = self._open_segment()
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if self.rotate_rows is not None and segment_rows >= self.rotate_rows:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    f.close()
+                    f = self._open_segment()
+                    segment_rows = 0
+                f.writelines(chunk)
+                f.flush()
+                segment_rows += len(chunk)
+                self.row_count += len(chunk)
+                if time.monotonic() - last_fsync >= self.fsync_interval_sec:
+                    os.fsync(f.fileno())
+                    last_fsync = time.monotonic()
+        except Exception as ex:
+            self.logger.error(f"Recording failed: {self.output_path}: {ex}")
+            self._error = ex
+            # Keep consuming so that the sampling thread never blocks on a dead writer
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+
+    def finalize(self) -> str:
+        # Write the remaining samples and move the segments to the output path
+        if self.finalized:
+            return self.output_path
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                # After a writer error the sentinel must still reach the draining writer
+                if self._chunk and self._error is None:
+                    self._put_chunk()
+                self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+        if len(self.segment_paths) == 1:
+            os.replace(self.segment_paths[0], self.output_path)
+        else:
+            with atomic_write(self.output_path, "w") as output:
+                for i, segment_path in enumerate(self.segment_paths):
+                    with open(segment_path, "r") as segment:
+                        header = segment.readline()
+                        if i == 0:
+                            output.write(header)
+                        shutil.copyfileobj(segment, output)
+            for segment_path in self.segment_paths:
+                os.remove(segment_path)
+        self.finalized = True
+        return self.output_path
@@ -0,0 +1,124 @@
+import os
+import json
+import socket
+from collections import defaultdict
+from typing import Iterable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SESSION_LOG_FILENAME = "sessions.jsonl"
+
+
+class SessionLog:
+    """
+    計測セッションの追記専用ログ
+
+    1行が1セッションのJSONで、複数の計測端末から同じディレクトリに同時に追記できる
+    """
+
+    def __init__(self, directory_path: str):
+        self.directory_path = directory_path
+        self.path = os.path.join(directory_path, SESSION_LOG_FILENAME)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def append(self, session: dict):
+        session = {"station": socket.gethostname(), **session}
+        line = (json.dumps(session, ensure_ascii=False) + "\n").encode()
+        os.makedirs(self.directory_path, exist_ok=True)
+        # O_APPEND moves every write to the end of the file, and the lock keeps a line
+        # from being interleaved with lines of other
+        # stations on file systems that split writes
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                written = 0
+                while written < len(line):
+                    written += os.write(fd, line[written:])
+                os.fsync(fd)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def read(self, offset: int = 0) -> tuple[list[dict], int]:
+        # Returns the sessions after offset and the offset to continue from.
+        # A line that is still being written is left for the next read.
+        if not self.exists():
+            return [], offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        sessions = [
+            json.loads(line) for line in data[:end].splitlines() if line.strip()
+        ]
+        return sessions, offset + end
+
+    def read_all(self) -> list[dict]:
+        return self.read()[0]
+
+
+class SessionIndex:
+    """
+    セッションをユーザー名、日付、デバイスアドレスで検索するためのインデックス
+    """
+
+    def __init__(self):
+        self.sessions: list[dict] = []
+        self.by_user = defaultdict(list)
+        self.by_date = defaultdict(list)
+        self.by_device = defaultdict(list)
+
+    def add(self, sessions: Iterable[dict]):
+        for session in sessions:
+            position = len(self.sessions)
+            self.sessions.append(session)
+            # start_date is %Y%m%d%H%M%S, the first 8 characters are the date
+            self.by_date[str(session["start_date"])[:8]].append(position)
+            for user in ["user1", "user2"]:
+                self.by_user[session[f"{user}_name"]].append(position)
+                self.by_device[session[f"{user}_device_address"]].append(position)
+
+    def find(
+        self, user: str = None, date: str = None, device: str = None
+    ) -> list[dict]:
+        # date is given as %Y%m%d
+        candidates = None
+        for table, key in [
+            (self.by_user, user),
+            (self.by_date, date),
+            (self.by_device, device),
+        ]:
+            if key is None:
+                continue
+            positions = set(table.get(key, []))
+            candidates = positions if candidates is None else candidates & positions
+        if candidates is None:
+            return list(self.sessions)
+        return [self.sessions[i] for i in sorted(candidates)]
+
+
+class SessionLogReader:
+    """
+    セッションログを追従して読むクラス
+
+    poll()は前回以降に追記されたセッションのみを返し、インデックスにも追加する
+    """
+
+    def __init__(self, session_log: SessionLog):
+        self.session_log = session_log
+        self.offset = 0
+        self.index = SessionIndex()
+
+    def poll(self) -> list[dict]:
+        sessions, self.offset = self.session_log.read(self.offset)
+        self.index.add(sessions)
+        return sessions
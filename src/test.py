@@ -10,6 +10,7 @@ from matplotlib import pyplot as plt
 
 from encapsulate_preprocess import extract_feature_from_old_data
 from model.load import load_model, ModelType
+from model.threshold import calibrate_threshold
 
 
 def calculate_classifier_score(label_list, pred_proba, target_label):
@@ -19,8 +20,7 @@ def calculate_classifier_score(label_list, pred_proba, target_label):
     eer = optimize.brentq(
         lambda x: 1.0 - x - interpolate.interp1d(fpr, tpr)(x), 0.0, 1.0
     )
-    eer_idx = np.argmin(np.abs(fpr - (1 - tpr)))
-    eer_threshold = thresholds[eer_idx]
+    eer_threshold = calibrate_threshold(label_list, pred_proba)
     eer_df["EER"] = eer
 
     return eer_df, fpr, tpr, fnr, eer_threshold, thresholds
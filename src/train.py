@@ -1,11 +1,13 @@
 import os
-import pickle
 
 import pandas as pd
 import hydra
 from omegaconf import DictConfig
 
 from model.load import load_model
+from model.bundle import ModelBundle
+from model.threshold import calibrate_threshold, fit_with_held_out_scores
+from model.importance import prune_and_refit, used_features
 from encapsulate_preprocess import extract_feature_from_old_data
 
 
@@ -28,16 +30,30 @@ def train(cfg: DictConfig):
     pair_list.to_csv(os.path.join(output_dir_path, "pair_list.csv"), index=False)
 
     classifier = load_model(cfg.model.param_dict_path, cfg.model.modelname)
-    classifier.fit(feat, label_list)
-
-    with open(
-        os.path.join(
-            output_dir_path,
-            f"{cfg.model.modelname}_{cfg.correct_user1}_and_{cfg.correct_user2}.pickle",
-        ),
-        "wb",
-    ) as f:
-        pickle.dump(classifier, f)
+    classifier, held_out_scores, held_out_labels = fit_with_held_out_scores(
+        classifier, feat, label_list, cfg.threshold.cv_folds
+    )
+    feature_columns = list(feat.columns)
+    if cfg.feature_selection.prune:
+        # Retrain on the features the first model split on
+        classifier, held_out_scores, held_out_labels, feature_columns = prune_and_refit(
+            classifier, feat, label_list, cfg.threshold.cv_folds
+        )
+    threshold = calibrate_threshold(
+        held_out_labels, held_out_scores, cfg.threshold.target_far
+    )
+    print(f"decision threshold: {threshold}")
+
+    # Only the features the model splits on are calculated at inference
+    feature_set = (feature_columns, used_features(classifier, feature_columns))
+    print(f"used features: {len(feature_set[1])} / {len(feat.columns)}")
+
+    # The classifier is saved as {modelname}_{user1}_and_{user2}.pickle
+    # and its threshold and features are recorded in the bundle manifest
+    pair = (str(cfg.correct_user1), str(cfg.correct_user2))
+    ModelBundle(output_dir_path, cfg.model.modelname).save(
+        {pair: classifier}, {pair: threshold}, {pair: feature_set}
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+// Receives state changes pushed by DemoSite (see visualize/notifier.py)
+// and triggers the Dash callbacks through a hidden button.
+(function () {
+  var source = new EventSource("/demo-events");
+
+  function trigger(retry) {
+    var button = document.getElementById("push-event-trigger");
+    if (button) {
+      button.click();
+    } else if (retry > 0) {
+      // The Dash layout may not be rendered yet right after the page is loaded
+      setTimeout(function () {
+        trigger(retry - 1);
+      }, 200);
+    }
+  }
+
+  // Synchronize once on (re)connection in case a state change was missed
+  source.addEventListener("open", function () {
+    trigger(10);
+  });
+  source.addEventListener("state", function () {
+    trigger(0);
+  });
+  source.addEventListener("result", function () {
+    trigger(0);
+  });
+})();
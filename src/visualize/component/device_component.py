@@ -1,20 +1,28 @@
+import threading
 from collections import deque
 
 import numpy as np
 from dash import dcc
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import plotly.graph_objs as go
 
 
 class DeviceComponent:
-    def __init__(self, device_id: str, parent_interval_id: str):
+    def __init__(
+        self,
+        device_id: str,
+        parent_interval_id: str,
+        history_length: int = 50,
+        max_points_per_update: int = 25,
+    ):
         self.device_id = device_id
         self.interval_id = parent_interval_id
         self.is_updated = False
         # Dashアプリケーションの作成
         # 表示項目やデータの初期化
         self.init_id_data()
-        self.init_view_data()
+        self.init_view_data(history_length, max_points_per_update)
         # レイアウトの設定、データ更新関数の登録
         self.app_layout = self._create_layout()
         # self.register_callbacks()
@@ -23,54 +31,41 @@ class DeviceComponent:
         return self.app_layout
 
     def clear_page(self):
-        self.is_updated = False
-        self.x_data = deque(maxlen=self.max_data_length)
-        self.graph1_data1 = deque(maxlen=self.max_data_length)
-        self.graph1_data2 = deque(maxlen=self.max_data_length)
-        self.graph1_data3 = deque(maxlen=self.max_data_length)
-        self.graph2_data = deque(maxlen=self.max_data_length)
-        for i in range(self.max_data_length):
-            self.x_data.append(i)
-            self.graph1_data1.append(0)
-            self.graph1_data2.append(0)
-            self.graph1_data3.append(0)
-            self.graph2_data.append(0)
-            self.x_data_idx += 1
+        # The graphs start empty again when the layout is rendered next time
+        with self.lock:
+            self.is_updated = False
+            self.pending_samples = deque(maxlen=self.max_pending_samples)
+            self.received_count = 0
 
     def init_id_data(self):
         self.device_name = f"device{self.device_id}"
         self.graph1_id = self.device_name + "-graph1"
         self.graph2_id = self.device_name + "-graph2"
-        self.shared_store_id = self.device_name + "-shared-data-store"
 
-    def init_view_data(self):
+    def init_view_data(self, history_length: int, max_points_per_update: int):
 
-        self.max_data_length = 50
-        self.x_data_idx = 0
+        self.max_data_length = history_length
+        self.max_points_per_update = max_points_per_update
+        self.received_count = 0
+
+        # Samples received since the last graph update.
+        # They are appended from the sensor thread and consumed by the Dash callback.
+        # If no callback consumes them
+        # (e.g. another page is shown), old samples are dropped.
+        self.max_pending_samples = 1000
+        self.pending_samples = deque(maxlen=self.max_pending_samples)
+        self.lock = threading.Lock()
 
-        self.x_data = deque(maxlen=self.max_data_length)
         self.x_axis_label = "time"
 
         self.graph1_title = "Sensor Data"
         self.graph1_y_axis_label = "value"
         self.graph1_data1_label = "acceleration"
-        self.graph1_data1 = deque(maxlen=self.max_data_length)
         self.graph1_data2_label = "angle"
-        self.graph1_data2 = deque(maxlen=self.max_data_length)
         self.graph1_data3_label = "magnetic"
-        self.graph1_data3 = deque(maxlen=self.max_data_length)
 
         self.graph2_title = "L2 norm of triaxial angular velocity"
         self.graph2_y_axis_label = "l2 norm"
-        self.graph2_data = deque(maxlen=self.max_data_length)
-
-        for i in range(self.max_data_length):
-            self.x_data.append(i)
-            self.graph1_data1.append(0)
-            self.graph1_data2.append(0)
-            self.graph1_data3.append(0)
-            self.graph2_data.append(0)
-            self.x_data_idx += 1
 
     def update_data(
         self,
@@ -79,106 +74,101 @@ class DeviceComponent:
         angle: list[float],
         mag: list[float],
     ):
-        if not self.is_updated:
+        # Called for every sample, so only the raw values are kept here.
+        # The lists are reused by the device handler and must be copied.
+        with self.lock:
             self.is_updated = True
-
-        self.x_data.append(self.x_data_idx)
-        acc_l2 = np.linalg.norm(acc)
-        angle_l2 = np.linalg.norm(angle)
-        mag_l2 = np.linalg.norm(mag)
-        gyro_l2 = np.linalg.norm(gyro)
-
-        self.graph1_data1.append(acc_l2)
-        self.graph1_data2.append(angle_l2)
-        self.graph1_data3.append(mag_l2)
-        self.graph2_data.append(gyro_l2)
-
-        self.x_data_idx += 1
+            self.received_count += 1
+            self.pending_samples.append((*acc, *gyro, *angle, *mag))
+
+    def pop_new_points(self) -> tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            samples = list(self.pending_samples)
+            self.pending_samples.clear()
+            x_end = self.received_count
+
+        if not samples:
+            return np.empty(0), np.empty((0, 4))
+
+        # Decimate on the server side so that a callback never sends more than
+        # max_points_per_update points
+        x_data = np.arange(x_end - len(samples), x_end)
+        if len(samples) > self.max_points_per_update:
+            idx = np.linspace(0, len(samples) - 1, self.max_points_per_update)
+            idx = idx.round().astype(int)
+            samples = [samples[i] for i in idx]
+            x_data = x_data[idx]
+
+        # acc, gyro, angle, mag
+        values = np.asarray(samples, dtype=float).reshape(len(samples), 4, 3)
+        l2norm = np.sqrt(np.sum(values**2, axis=2))
+        return x_data, l2norm
 
     def register_callbacks(self, app):
 
         @app.callback(
-            Output(self.shared_store_id, "data"),
+            Output(self.graph1_id, "extendData"),
+            Output(self.graph2_id, "extendData"),
             [Input(self.interval_id, "n_intervals")],
         )
-        def update_data_store(n):
-            return {
-                "x_data": list(self.x_data),
-                "graph1_data1": list(self.graph1_data1),
-                "graph1_data2": list(self.graph1_data2),
-                "graph1_data3": list(self.graph1_data3),
-                "graph2_data": list(self.graph2_data),
-            }
-
-        @app.callback(
-            Output(self.graph1_id, "figure"),
-            [Input(self.shared_store_id, "data")],
-        )
-        def update_graph_1(data):
-            fig = go.Figure()
-            fig.add_trace(
-                go.Scatter(
-                    x=data["x_data"],
-                    y=data["graph1_data1"],
-                    mode="lines",
-                    name=self.graph1_data1_label,
-                )
-            )
-            fig.add_trace(
-                go.Scatter(
-                    x=data["x_data"],
-                    y=data["graph1_data2"],
-                    mode="lines",
-                    name=self.graph1_data2_label,
-                )
+        def extend_graphs(n):
+            x_data, l2norm = self.pop_new_points()
+            if len(x_data) == 0:
+                raise PreventUpdate
+
+            x_data = x_data.tolist()
+            acc_l2, gyro_l2, angle_l2, mag_l2 = l2norm.T.tolist()
+            graph1_update = (
+                {"x": [x_data, x_data, x_data], "y": [acc_l2, angle_l2, mag_l2]},
+                [0, 1, 2],
+                self.max_data_length,
             )
-            fig.add_trace(
-                go.Scatter(
-                    x=data["x_data"],
-                    y=data["graph1_data3"],
-                    mode="lines",
-                    name=self.graph1_data3_label,
-                )
+            graph2_update = (
+                {"x": [x_data], "y": [gyro_l2]},
+                [0],
+                self.max_data_length,
             )
-            fig.update_layout(
-                title=self.graph1_title,
-                xaxis_title=self.x_axis_label,
-                yaxis_title=self.graph1_y_axis_label,
-                margin=dict(l=40, r=40, t=40, b=20),
-            )
-            return fig
-
-        @app.callback(
-            Output(self.graph2_id, "figure"),
-            [Input(self.shared_store_id, "data")],
+            return graph1_update, graph2_update
+
+    def _create_figure1(self):
+        fig = go.Figure()
+        for label in [
+            self.graph1_data1_label,
+            self.graph1_data2_label,
+            self.graph1_data3_label,
+        ]:
+            fig.add_trace(go.Scatter(x=[], y=[], mode="lines", name=label))
+        fig.update_layout(
+            title=self.graph1_title,
+            xaxis_title=self.x_axis_label,
+            yaxis_title=self.graph1_y_axis_label,
+            margin=dict(l=40, r=40, t=40, b=20),
         )
-        def update_graph_2(data):
-            fig = go.Figure()
-            fig.add_trace(
-                go.Scatter(
-                    x=data["x_data"],
-                    y=data["graph2_data"],
-                    mode="lines",
-                    name=self.graph2_title,
-                )
-            )
-            fig.update_layout(
-                title=self.graph2_title,
-                xaxis_title=self.x_axis_label,
-                yaxis_title=self.graph2_y_axis_label,
-                margin=dict(l=40, r=40, t=40, b=20),
-            )
-            return fig
+        return fig
+
+    def _create_figure2(self):
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=[], y=[], mode="lines", name=self.graph2_title))
+        fig.update_layout(
+            title=self.graph2_title,
+            xaxis_title=self.x_axis_label,
+            yaxis_title=self.graph2_y_axis_label,
+            margin=dict(l=40, r=40, t=40, b=20),
+        )
+        return fig
 
     def _create_layout(self):
+        # The figures are built once,
+        # afterwards only new points are sent with extendData
         return (
             dcc.Graph(
                 id=self.graph1_id,
+                figure=self._create_figure1(),
                 config={"responsive": True},
             ),
             dcc.Graph(
                 id=self.graph2_id,
+                figure=self._create_figure2(),
                 config={"responsive": True},
             ),
-            dcc.Store(id=self.shared_store_id),
         )
@@ -1,12 +1,14 @@
 from enum import Enum
 
 import dash
-from dash import dcc, html
+from dash import html
+from flask import Response
 from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 
 from .page_sensor import SensorDataVisualizer
 from .page_authorize_result import AuthrizeResultVisualizer
+from .notifier import StateNotifier
 
 
 class DemoPageStat(Enum):
@@ -15,10 +17,23 @@ class DemoPageStat(Enum):
 
 
 class DemoSite:
-    def __init__(self):
+    def __init__(
+        self,
+        refresh_interval_ms: int = 1000,
+        history_length: int = 50,
+        max_points_per_update: int = 25,
+    ):
         # Dashアプリケーションの作成
-        self.app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
-        self.init_page()
+        # Pages are switched at runtime,
+        # so callbacks may refer to components that are not mounted yet
+        self.app = dash.Dash(
+            __name__,
+            external_stylesheets=[dbc.themes.BOOTSTRAP],
+            suppress_callback_exceptions=True,
+        )
+        self.notifier = StateNotifier()
+        self.push_trigger_id = "push-event-trigger"
+        self.init_page(refresh_interval_ms, history_length, max_points_per_update)
         # レイアウトの設定、データ更新関数の登録
         self.app_layout = self._create_layout()
         self.app.layout = self.app_layout
@@ -28,22 +43,48 @@ class DemoSite:
         # self.app.run_server(debug=True)
         self.app.run_server()
 
-    def init_page(self):
+    def init_page(
+        self,
+        refresh_interval_ms: int = 1000,
+        history_length: int = 50,
+        max_points_per_update: int = 25,
+    ):
         self.state = DemoPageStat.SAMPLING
         self.old_state = self.state
-        self.sampling_page = SensorDataVisualizer()
-        self.authorize_page = AuthrizeResultVisualizer(False)
+        self.sampling_page = SensorDataVisualizer(
+            refresh_interval_ms, history_length, max_points_per_update
+        )
+        self.authorize_page = AuthrizeResultVisualizer(None, self.push_trigger_id)
 
     def clear_page(self):
         self.sampling_page.clear_page()
         self.authorize_page.clear_page()
 
+    def set_state(self, state: DemoPageStat):
+        self.state = state
+        self.notifier.publish("state", {"state": state.name})
+
+    def set_result(self, result: bool):
+        self.authorize_page.result = result
+        self.notifier.publish("result", {"result": bool(result)})
+
     def register_callbacks(self):
         self.sampling_page.register_callbacks(self.app)
         self.authorize_page.register_callbacks(self.app)
 
+        # The browser subscribes to this stream (assets/push_events.js)
+        # and clicks the hidden trigger button whenever an event arrives
+        @self.app.server.route("/demo-events")
+        def stream_events():
+            return Response(
+                self.notifier.stream(),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
         @self.app.callback(
-            Output("page-content", "children"), Input("page_counter", "n_intervals")
+            Output("page-content", "children"),
+            Input(self.push_trigger_id, "n_clicks"),
         )
         def display_page(n):
             if self.state == self.old_state:
@@ -55,7 +96,7 @@ class DemoSite:
                 return self.sampling_page.get_layout()
             elif self.state == DemoPageStat.AUTHORIZE:
                 self.sampling_page.status_message = "Authorization completed"
-                # return self.authorize_page.get_layout()
+                return self.authorize_page.get_layout()
             else:
                 return self.sampling_page.get_layout()
 
@@ -64,7 +105,9 @@ class DemoSite:
         return html.Div(
             [
                 html.Div(id="page-content", children=page_layout),
-                dcc.Interval(id="page_counter", interval=10000, n_intervals=0),
+                html.Button(
+                    id=self.push_trigger_id, n_clicks=0, style={"display": "none"}
+                ),
             ]
         )
 
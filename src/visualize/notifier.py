@@ -0,0 +1,43 @@
+import json
+import queue
+import threading
+from typing import Iterator
+
+
+class StateNotifier:
+    """
+    デモの状態変化をブラウザへプッシュするクラス
+
+    server-sent eventsの購読者ごとにキューを持ち、publish()されたイベントを配信する
+    """
+
+    def __init__(self, keepalive_sec: float = 15.0):
+        self.keepalive_sec = keepalive_sec
+        self._subscribers: list[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    def publish(self, event: str, data: dict = None):
+        message = f"event: {event}\ndata: {json.dumps(data or {})}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def stream(self) -> Iterator[str]:
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.append(subscriber)
+        try:
+            # Send something right away so that the response headers are flushed
+            # and the browser sees the connection as open
+            yield ": connected\n\n"
+            while True:
+                try:
+                    # Blocks until an event is published, nothing runs while idle
+                    yield subscriber.get(timeout=self.keepalive_sec)
+                except queue.Empty:
+                    # Comment line that keeps proxies from closing the connection
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.remove(subscriber)
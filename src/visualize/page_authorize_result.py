@@ -3,23 +3,28 @@ from dash.dependencies import Input, Output
 
 
 class AuthrizeResultVisualizer:
-    def __init__(self, result: bool):
+    def __init__(self, result: bool, push_trigger_id: str):
+        # result is None until the authorization is finished
         self.result = result
+        self.push_trigger_id = push_trigger_id
         self.init_id_data()
-        self.layout = self._create_layout()
 
     def get_layout(self):
-        return self.layout
+        # The layout is created on demand so that it
+        # reflects a result that is already available
+        return self._create_layout()
+
+    def clear_page(self):
+        self.result = None
 
     def init_id_data(self):
         self.shared_store_id = "auth-result-store"
-        self.interval_id = "auth-result-update"
 
     def register_callbacks(self, app):
 
         @app.callback(
             Output(self.shared_store_id, "data"),
-            [Input(self.interval_id, "n_intervals")],
+            [Input(self.push_trigger_id, "n_clicks")],
         )
         def update_data_store(n):
             return {"auth_result": self.result}
@@ -30,7 +35,12 @@ class AuthrizeResultVisualizer:
             [Input(self.shared_store_id, "data")],
         )
         def update_auth_result(data):
-            if data["auth_result"]:
+            if data is None or data["auth_result"] is None:
+                return (
+                    html.Span("Authorizing..."),
+                    "text-secondary display-4",
+                )
+            elif data["auth_result"]:
                 return (
                     html.Span(
                         [
@@ -72,7 +82,6 @@ class AuthrizeResultVisualizer:
                         "width": "100%",  # 幅を100%に設定してテキストを中央揃え
                     },
                 ),
-                dcc.Store(id=self.shared_store_id, data=self.result),
-                dcc.Interval(id=self.interval_id, interval=1000, n_intervals=0),
+                dcc.Store(id=self.shared_store_id, data={"auth_result": self.result}),
             ],
         )
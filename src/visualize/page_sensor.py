@@ -5,12 +5,22 @@ from .component.device_component import DeviceComponent
 
 
 class SensorDataVisualizer:
-    def __init__(self):
+    def __init__(
+        self,
+        refresh_interval_ms: int = 1000,
+        history_length: int = 50,
+        max_points_per_update: int = 25,
+    ):
         self.is_terminated = False
         # 表示項目やデータの初期化
         self.init_view_data()
-        self.device1_graph_component = DeviceComponent("0", self.interval_id)
-        self.device2_graph_component = DeviceComponent("1", self.interval_id)
+        self.refresh_interval_ms = refresh_interval_ms
+        self.device1_graph_component = DeviceComponent(
+            "0", self.interval_id, history_length, max_points_per_update
+        )
+        self.device2_graph_component = DeviceComponent(
+            "1", self.interval_id, history_length, max_points_per_update
+        )
         # レイアウトの設定、データ更新関数の登録
         self.layout = self._create_layout()
         # self.register_callbacks()
@@ -51,9 +61,7 @@ class SensorDataVisualizer:
 
     def _create_layout(self):
         graph1_layout = self.device1_graph_component.get_layout()
-        graph1_shard_store = graph1_layout[2]
         graph2_layout = self.device2_graph_component.get_layout()
-        graph2_shard_store = graph2_layout[2]
         return html.Div(
             style={
                 "height": "100vh",
@@ -85,11 +93,11 @@ class SensorDataVisualizer:
                         graph2_layout[1],
                     ],
                 ),
-                graph1_shard_store,
-                graph2_shard_store,
                 dcc.Interval(
-                    id=self.interval_id, interval=1000, n_intervals=0
-                ),  # 1秒ごとに更新
+                    id=self.interval_id,
+                    interval=self.refresh_interval_ms,
+                    n_intervals=0,
+                ),
                 html.Div(
                     id="status-message",
                     style={
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules under src are imported as top-level packages, as the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from preprocess.alignment import align_pair
+from preprocess.pair_data_extraction import pair_extraction
+
+PERIOD_NS = 10_000_000
+
+
+def recording(
+    motion: np.ndarray, start: int, length: int, delay: int = 0
+) -> pd.DataFrame:
+    # Samples start..start + length of a motion seen by a device with the common clock,
+    # the device sees the motion delay samples late
+    gyro = motion[start - delay : start - delay + length]
+    return pd.DataFrame(
+        {
+            "time": (np.arange(start, start + length) * PERIOD_NS).astype(np.int64),
+            "gyroX": gyro,
+            "gyroY": gyro * 0.5,
+            "gyroZ": gyro * 0.25,
+        }
+    )
+
+
+def motion(length: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return np.convolve(rng.normal(size=length), np.ones(5) / 5, mode="same") + 2
+
+
+def trimmed_correlation(device1_data, device2_data) -> float:
+    trimmed1, trimmed2 = pair_extraction(device1_data, device2_data)
+    length = min(len(trimmed1), len(trimmed2))
+    return np.corrcoef(trimmed1["gyroX"][:length], trimmed2["gyroX"][:length])[0, 1]
+
+
+def test_different_start_times_are_not_a_lag():
+    signal = motion(400)
+    device1_data = recording(signal, 0, 300)
+    device2_data = recording(signal, 20, 300)
+
+    aligned1, aligned2, lag = align_pair(device1_data, device2_data, max_lag=25)
+
+    assert lag == 0
+    assert trimmed_correlation(aligned1, aligned2) > 0.99
+
+
+def test_lag_with_different_start_times():
+    signal = motion(400)
+    device1_data = recording(signal, 0, 300)
+    device2_data = recording(signal, 20, 300, delay=7)
+
+    aligned1, aligned2, lag = align_pair(device1_data, device2_data, max_lag=25)
+
+    assert lag == 7
+    assert trimmed_correlation(aligned1, aligned2) > 0.99
@@ -0,0 +1,31 @@
+import numpy as np
+
+from feature import batch, stats
+
+
+def test_sample_entropy_row_over_budget_uses_chunked_path(monkeypatch):
+    rng = np.random.default_rng(0)
+    values = np.round(rng.normal(size=(2, 300)), 1)
+    offsets = np.array([0, 20, 300])
+    budget = 200 * 200 * 8
+    monkeypatch.setattr(batch, "SAMPLE_ENTROPY_CHUNK_BYTES", budget)
+    monkeypatch.setattr(stats, "SAMPLE_ENTROPY_CHUNK_BYTES", budget)
+
+    padded_sample_entropy = batch._sample_entropy_padded
+
+    def bounded(padded, lengths, m=2):
+        # No padded matrix larger than the budget is allocated
+        assert padded.shape[0] * padded.shape[1] ** 2 * 8 <= budget
+        return padded_sample_entropy(padded, lengths, m)
+
+    monkeypatch.setattr(batch, "_sample_entropy_padded", bounded)
+
+    result = batch.sample_entropy(values, offsets)
+    expected = np.stack(
+        [
+            stats.sample_entropy(values[:, start:end])
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ],
+        axis=1,
+    )
+    np.testing.assert_allclose(result, expected)
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from feature.stats import extract_stats, sample_entropy
+
+
+@pytest.mark.parametrize("n_samples", [0, 1, 2])
+def test_sample_entropy_of_short_series_is_nan(n_samples):
+    values = np.arange(float(n_samples))[None, :]
+    assert np.isnan(sample_entropy(values)).all()
+
+
+def test_extract_stats_of_one_sample():
+    names, feature = extract_stats(np.ones((2, 1)), ["accX", "accY"])
+    feature = dict(zip(names, feature))
+    assert np.isnan(feature["accX__sample_entropy"])
+    assert np.isnan(feature["accY__sample_entropy"])
+    assert feature["accX__maximum"] == 1.0